@@ -0,0 +1,100 @@
+"""
+Helpers for running benchmarks offline: scratch space on tmpfs, S3 from moto, and an
+in-process LocalCluster.
+"""
+
+import datetime as dt
+import os
+import platform
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from os.path import join
+from typing import Any, Dict, Iterator, Optional
+
+import boto3
+from dask.distributed import LocalCluster
+from moto import mock_aws
+from saturn_run.results import LocalResults, S3Results
+from saturn_run.results.base import Results
+
+BUCKET = "saturn-run-bench"
+# tmpfs, so benchmarks measure saturn_run rather than the disk
+TMPFS = "/dev/shm"
+
+
+def scratch_dir() -> str:
+    if os.path.isdir(TMPFS) and os.access(TMPFS, os.W_OK):
+        return TMPFS
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def temp_dir() -> Iterator[str]:
+    with tempfile.TemporaryDirectory(dir=scratch_dir(), prefix="saturn-run-bench-") as path:
+        yield path
+
+
+@contextmanager
+def mock_s3() -> Iterator[str]:
+    """A moto S3 with an empty bucket. Yields the bucket's url."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield f"s3://{BUCKET}"
+
+
+@contextmanager
+def results_backend(kind: str, base_dir: str, name: str) -> Iterator[Results]:
+    """``LocalResults`` under ``base_dir``, or ``S3Results`` on moto, for ``kind``"""
+    if kind == "local":
+        yield LocalResults(join(base_dir, "{name}"), name=name)
+    elif kind == "s3":
+        with mock_s3() as url:
+            yield S3Results(f"{url}/{{name}}/", name=name)
+    else:
+        raise ValueError(f"unknown results backend {kind}")
+
+
+@contextmanager
+def local_cluster(n_workers: int = 2, threads_per_worker: int = 4) -> Iterator[LocalCluster]:
+    # in-process workers, so moto's mocks apply to them as well
+    with LocalCluster(
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        processes=False,
+        dashboard_address=":0",
+    ) as cluster:
+        yield cluster
+
+
+def output_command(output_bytes: int) -> str:
+    """A shell command that writes ``output_bytes`` of results"""
+    if not output_bytes:
+        return "true"
+    return f"head -c {output_bytes} /dev/zero > $RESULTS_DIR/out"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata() -> Dict[str, Any]:
+    """Where and when results were measured, so they can be compared over time"""
+    return {
+        "time": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scratch": scratch_dir(),
+    }
@@ -0,0 +1,60 @@
+"""
+End to end cost of a run on a LocalCluster: submitting it with DaskExecutor.execute,
+then collecting it, with tasks that each write ``output_bytes`` of results.
+
+    python -m benchmarks.dispatch --tasks 1000 --output-bytes 1048576 --results s3
+"""
+
+import json
+import time
+from typing import Optional
+
+import click
+from benchmarks.common import local_cluster, output_command, results_backend, temp_dir
+from saturn_run.executor import DaskExecutor
+from saturn_run.tasks import TaskSpec
+
+
+def run(
+    tasks: int = 1000,
+    output_bytes: int = 0,
+    results_kind: str = "local",
+    batch_size: Optional[int] = None,
+) -> dict:
+    name = f"bench-dispatch-{tasks}"
+    # the tempdir outlives the cluster, so tasks that already started can finish writing
+    with temp_dir() as tempdir, results_backend(
+        results_kind, tempdir, name
+    ) as results, local_cluster() as cluster:
+        executor = DaskExecutor(scheduler_address=cluster.scheduler_address, batch_size=batch_size)
+        specs = [
+            TaskSpec(name=str(idx), command=output_command(output_bytes)) for idx in range(tasks)
+        ]
+        start = time.perf_counter()
+        executor.execute(specs, results, name)
+        submitted = time.perf_counter()
+        executor.collect(name, results)
+        collected = time.perf_counter()
+    return {
+        "benchmark": "dispatch",
+        "tasks": tasks,
+        "output_bytes": output_bytes,
+        "results": results_kind,
+        "batch_size": batch_size,
+        "submit_seconds": submitted - start,
+        "collect_seconds": collected - submitted,
+        "seconds_per_task": (collected - start) / tasks,
+    }
+
+
+@click.command()
+@click.option("--tasks", default=1000)
+@click.option("--output-bytes", default=0)
+@click.option("--results", "results_kind", type=click.Choice(["local", "s3"]), default="local")
+@click.option("--batch-size", default=None, type=int)
+def main(tasks, output_bytes, results_kind, batch_size):
+    print(json.dumps(run(tasks, output_bytes, results_kind, batch_size)))
+
+
+if __name__ == "__main__":
+    main()
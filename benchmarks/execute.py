@@ -0,0 +1,52 @@
+"""
+Per-task overhead of processes.execute_task (supervising the process, syncing and
+saving its results) over running the same command with subprocess.
+
+    python -m benchmarks.execute --tasks 100 --output-bytes 1048576 --results s3
+"""
+
+import json
+import subprocess
+import time
+from os.path import join
+
+import click
+from benchmarks.common import output_command, results_backend, temp_dir
+from saturn_run.processes import execute_task
+from saturn_run.tasks import TaskSpec
+
+
+def run(tasks: int = 100, output_bytes: int = 0, results_kind: str = "local") -> dict:
+    command = output_command(output_bytes)
+    with temp_dir() as tempdir, results_backend(results_kind, tempdir, "bench-execute") as results:
+        start = time.perf_counter()
+        for idx in range(tasks):
+            execute_task(results, TaskSpec(name=str(idx), command=command), poll_interval=1)
+        supervised = time.perf_counter() - start
+
+        env = {"RESULTS_DIR": join(tempdir, "bare")}
+        subprocess.run(["mkdir", "-p", env["RESULTS_DIR"]], check=True)
+        start = time.perf_counter()
+        for _ in range(tasks):
+            subprocess.run(command, shell=True, env=env, check=True, capture_output=True)
+        bare = time.perf_counter() - start
+    return {
+        "benchmark": "execute",
+        "tasks": tasks,
+        "output_bytes": output_bytes,
+        "results": results_kind,
+        "seconds_per_task": supervised / tasks,
+        "overhead_seconds_per_task": (supervised - bare) / tasks,
+    }
+
+
+@click.command()
+@click.option("--tasks", default=100)
+@click.option("--output-bytes", default=0)
+@click.option("--results", "results_kind", type=click.Choice(["local", "s3"]), default="local")
+def main(tasks, output_bytes, results_kind):
+    print(json.dumps(run(tasks, output_bytes, results_kind)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Cost of file_syncs to a LocalCluster: the first sync of a directory to workers with an
+empty chunk cache, a re-sync where nothing changed, and a re-sync after one file
+changed.
+
+    python -m benchmarks.file_sync --sync-bytes 104857600 --files 100
+"""
+
+import json
+import os
+import time
+from os.path import join
+from unittest.mock import patch
+
+import click
+from benchmarks.common import local_cluster, temp_dir
+from dask.distributed import Client
+from saturn_run.executor.dask import sync_files
+from saturn_run.file_sync import ChunkCache
+
+
+def run(sync_bytes: int = 100 * 2**20, files: int = 100) -> dict:
+    file_size = max(1, sync_bytes // files)
+    with temp_dir() as tempdir, local_cluster() as cluster, Client(cluster) as client:
+        src = join(tempdir, "src") + "/"
+        os.makedirs(src)
+        for idx in range(files):
+            with open(join(src, f"{idx}.bin"), "wb") as f:
+                f.write(os.urandom(file_size))
+        timings = {}
+        # start from an empty chunk cache, instead of the one in the home directory
+        with patch.object(ChunkCache.__init__, "__defaults__", (join(tempdir, "cache"),)):
+            start = time.perf_counter()
+            sync_files(client, src)
+            timings["first_sync_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            sync_files(client, src)
+            timings["unchanged_sync_seconds"] = time.perf_counter() - start
+            with open(join(src, "0.bin"), "ab") as f:
+                f.write(b"changed")
+            start = time.perf_counter()
+            sync_files(client, src)
+            timings["one_changed_sync_seconds"] = time.perf_counter() - start
+    return {
+        "benchmark": "file_sync",
+        "sync_bytes": file_size * files,
+        "files": files,
+        "first_sync_mb_per_second": file_size * files / timings["first_sync_seconds"] / 1e6,
+        **timings,
+    }
+
+
+@click.command()
+@click.option("--sync-bytes", default=100 * 2**20)
+@click.option("--files", default=100)
+def main(sync_bytes, files):
+    print(json.dumps(run(sync_bytes, files)))
+
+
+if __name__ == "__main__":
+    main()
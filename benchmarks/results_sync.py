@@ -0,0 +1,58 @@
+"""
+Bandwidth of a task context's sync of its results directory, for a first sync, a sync
+where nothing changed, and a sync after one file changed.
+
+    python -m benchmarks.results_sync --output-bytes 104857600 --files 100 --results s3
+"""
+
+import json
+import os
+import time
+from os.path import join
+
+import click
+from benchmarks.common import results_backend, temp_dir
+
+
+def run(output_bytes: int = 100 * 2**20, files: int = 100, results_kind: str = "s3") -> dict:
+    file_size = max(1, output_bytes // files)
+    with temp_dir() as tempdir, results_backend(results_kind, tempdir, "bench-sync") as results:
+        context = results.make_task_context("task")
+        try:
+            for idx in range(files):
+                with open(join(context.results_dir, f"{idx}.bin"), "wb") as f:
+                    f.write(os.urandom(file_size))
+            timings = {}
+            start = time.perf_counter()
+            context.sync()
+            timings["first_sync_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            context.sync()
+            timings["unchanged_sync_seconds"] = time.perf_counter() - start
+            with open(join(context.results_dir, "0.bin"), "ab") as f:
+                f.write(b"changed")
+            start = time.perf_counter()
+            context.sync()
+            timings["one_changed_sync_seconds"] = time.perf_counter() - start
+        finally:
+            context.cleanup()
+    return {
+        "benchmark": "results_sync",
+        "output_bytes": file_size * files,
+        "files": files,
+        "results": results_kind,
+        "first_sync_mb_per_second": file_size * files / timings["first_sync_seconds"] / 1e6,
+        **timings,
+    }
+
+
+@click.command()
+@click.option("--output-bytes", default=100 * 2**20)
+@click.option("--files", default=100)
+@click.option("--results", "results_kind", type=click.Choice(["local", "s3"]), default="s3")
+def main(output_bytes, files, results_kind):
+    print(json.dumps(run(output_bytes, files, results_kind)))
+
+
+if __name__ == "__main__":
+    main()
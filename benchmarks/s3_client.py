@@ -0,0 +1,74 @@
+"""
+Counts boto3 sessions and S3 requests per task for S3Results, against moto.
+
+    python -m benchmarks.s3_client --tasks 100 --syncs 10
+"""
+
+import json
+import os
+import time
+from unittest.mock import patch
+
+import boto3
+import click
+from botocore.client import BaseClient
+from moto import mock_aws
+from saturn_run.results import S3Results
+
+BUCKET = "saturn-run-bench"
+
+
+def run(tasks: int = 100, syncs: int = 10) -> dict:
+    counts = {"sessions": 0, "requests": 0}
+    session_init = boto3.Session.__init__
+    make_api_call = BaseClient._make_api_call
+
+    def counting_session_init(self, *args, **kwargs):
+        counts["sessions"] += 1
+        session_init(self, *args, **kwargs)
+
+    def counting_make_api_call(self, *args, **kwargs):
+        counts["requests"] += 1
+        return make_api_call(self, *args, **kwargs)
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        results = S3Results(f"s3://{BUCKET}/{{name}}/", name="bench")
+        with patch.object(boto3.Session, "__init__", counting_session_init), patch.object(
+            BaseClient, "_make_api_call", counting_make_api_call
+        ):
+            start = time.perf_counter()
+            for idx in range(tasks):
+                context = results.make_task_context(str(idx))
+                try:
+                    with open(context.stdout_path, "w") as f:
+                        for line in range(syncs):
+                            f.write(f"line {line}\n")
+                            f.flush()
+                            context.sync()
+                    context.set_status("0")
+                    context.finish()
+                finally:
+                    context.cleanup()
+            elapsed = time.perf_counter() - start
+
+    return {
+        "benchmark": "s3_client",
+        "tasks": tasks,
+        "syncs": syncs,
+        "sessions_per_task": counts["sessions"] / tasks,
+        "requests_per_task": counts["requests"] / tasks,
+        "seconds_per_task": elapsed / tasks,
+    }
+
+
+@click.command()
+@click.option("--tasks", default=100)
+@click.option("--syncs", default=10)
+def main(tasks, syncs):
+    print(json.dumps(run(tasks=tasks, syncs=syncs)))
+
+
+if __name__ == "__main__":
+    main()
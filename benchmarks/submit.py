@@ -0,0 +1,55 @@
+"""
+Measures how long DaskExecutor.execute takes to submit a run on a LocalCluster.
+
+    python -m benchmarks.submit --tasks 1000 --tasks 10000 --tasks 100000
+"""
+
+import json
+import tempfile
+import time
+from typing import Iterable, List
+
+import click
+from dask.distributed import Client, LocalCluster
+from saturn_run.executor import DaskExecutor
+from saturn_run.results import LocalResults
+from saturn_run.tasks import TaskSpec
+
+
+def run(task_counts: Iterable[int] = (1000, 10000, 100000)) -> List[dict]:
+    output = []
+    # the tempdir outlives the cluster, so tasks that already started can finish writing
+    with tempfile.TemporaryDirectory() as tempdir, LocalCluster(
+        n_workers=1, threads_per_worker=1, processes=False, dashboard_address=":0"
+    ) as cluster, Client(cluster) as client:
+        executor = DaskExecutor(scheduler_address=cluster.scheduler_address)
+        for count in task_counts:
+            name = f"bench-submit-{count}"
+            results = LocalResults(tempdir + "/{name}", name=name)
+            tasks = [TaskSpec(name=str(idx), command="true") for idx in range(count)]
+            start = time.perf_counter()
+            executor.execute(tasks, results, name)
+            elapsed = time.perf_counter() - start
+            # we only care about submission, so throw the run away
+            client.cancel([fut for fut, _ in client.get_dataset(f"srun/{name}")])
+            client.unpublish_dataset(f"srun/{name}")
+            output.append(
+                {
+                    "benchmark": "submit",
+                    "tasks": count,
+                    "seconds": elapsed,
+                    "tasks_per_second": count / elapsed,
+                }
+            )
+    return output
+
+
+@click.command()
+@click.option("--tasks", "task_counts", multiple=True, type=int, default=[1000, 10000, 100000])
+def main(task_counts):
+    for row in run(task_counts):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
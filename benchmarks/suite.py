@@ -0,0 +1,85 @@
+"""
+Runs every benchmark over a grid of task counts, output volumes and file sync sizes,
+offline, and writes one JSON object per measurement. Appending the output of each run
+to the same file makes regressions easy to spot over time.
+
+    python -m benchmarks.suite --tasks 100 --tasks 1000 --output bench.jsonl
+"""
+
+import itertools
+import json
+import logging
+import sys
+from typing import Callable, Dict, List
+
+import click
+from benchmarks import dispatch, execute, file_sync, results_sync, s3_client, submit
+from benchmarks.common import metadata
+
+BENCHMARKS = ["submit", "dispatch", "execute", "results_sync", "file_sync", "s3_client"]
+
+
+def measurements(
+    task_counts: List[int],
+    output_sizes: List[int],
+    sync_sizes: List[int],
+    results_kinds: List[str],
+) -> Dict[str, List[Callable[[], List[dict]]]]:
+    """The measurements to take for each benchmark, as functions returning rows"""
+    grid = list(itertools.product(task_counts, output_sizes, results_kinds))
+    return {
+        "submit": [lambda: submit.run(task_counts)],
+        "dispatch": [
+            lambda t=t, o=o, r=r: [dispatch.run(t, o, r)] for t, o, r in grid  # type: ignore
+        ],
+        "execute": [
+            # processes are started one at a time, so keep these short
+            lambda t=t, o=o, r=r: [execute.run(min(t, 100), o, r)]  # type: ignore
+            for t, o, r in grid
+        ],
+        # LocalResults writes results in place, so only S3Results has anything to sync
+        "results_sync": [
+            lambda o=o: [results_sync.run(o, results_kind="s3")]  # type: ignore
+            for o in output_sizes
+            if o and "s3" in results_kinds
+        ],
+        "file_sync": [lambda s=s: [file_sync.run(s)] for s in sync_sizes],  # type: ignore
+        "s3_client": [lambda t=t: [s3_client.run(tasks=t)] for t in task_counts],  # type: ignore
+    }
+
+
+@click.command()
+@click.option("--tasks", "task_counts", multiple=True, type=int, default=[100, 1000])
+@click.option("--output-bytes", "output_sizes", multiple=True, type=int, default=[0, 2**20])
+@click.option("--sync-bytes", "sync_sizes", multiple=True, type=int, default=[10 * 2**20])
+@click.option(
+    "--results",
+    "results_kinds",
+    multiple=True,
+    type=click.Choice(["local", "s3"]),
+    default=["local", "s3"],
+)
+@click.option("--only", multiple=True, type=click.Choice(BENCHMARKS), help="benchmarks to run")
+@click.option("--output", default=None, help="append results to this file, as JSON lines")
+def main(task_counts, output_sizes, sync_sizes, results_kinds, only, output):
+    # progress logging from collect would drown out the results
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("distributed").setLevel(logging.ERROR)
+    common = metadata()
+    out = open(output, "a") if output else sys.stdout  # pylint: disable=consider-using-with
+    try:
+        todo = measurements(
+            list(task_counts), list(output_sizes), list(sync_sizes), list(results_kinds)
+        )
+        for benchmark in only or BENCHMARKS:
+            for measure in todo[benchmark]:
+                for row in measure():
+                    out.write(json.dumps({**common, **row}) + "\n")
+                    out.flush()
+    finally:
+        if output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
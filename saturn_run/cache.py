@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Iterator, List
+
+from saturn_run.errors import ConfigError
+from saturn_run.file_sync import FileSync, build_manifest, manifest_digest
+from saturn_run.tasks import TaskSpec, sort_by_dependencies
+
+
+def path_digest(path: str) -> str:
+    """A digest of the file, or everything under the directory, at ``path``"""
+    if os.path.isdir(path) and not path.endswith("/"):
+        path += "/"
+    return manifest_digest(build_manifest(path))
+
+
+def assign_cache_keys(tasks: List[TaskSpec], file_syncs: List[FileSync]):
+    """
+    Set the ``cache_key`` of every task from its command, the synced files, the
+    contents of its declared ``inputs``, and the keys of the tasks it depends on, so a
+    task is only restored from the cache if nothing it could have read has changed.
+    """
+    for _ in iter_cache_keys(sort_by_dependencies(tasks), file_syncs):
+        pass
+
+
+def iter_cache_keys(tasks: Iterable[TaskSpec], file_syncs: List[FileSync]) -> Iterator[TaskSpec]:
+    """
+    ``assign_cache_keys`` for tasks that are streamed, and so must come after the tasks
+    they depend on. Yields each task once its key is set.
+    """
+    syncs = sorted((fs.dest, path_digest(fs.src)) for fs in file_syncs)
+    digests: Dict[str, str] = {}
+    keys: Dict[str, str] = {}
+    for task in tasks:
+        inputs = []
+        for path in task.inputs:
+            if path not in digests:
+                if not os.path.exists(path):
+                    raise ConfigError(f"input {path} of task {task.name} does not exist")
+                digests[path] = path_digest(path)
+            inputs.append((path, digests[path]))
+        upstream = [keys[dep] for dep in task.depends_on]
+        data = json.dumps([task.command, task.shell, syncs, inputs, upstream])
+        task.cache_key = keys[task.name] = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        yield task
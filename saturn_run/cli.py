@@ -4,7 +4,12 @@ logging.basicConfig(level=logging.INFO)
 
 import click  # noqa
 from ruamel.yaml import YAML  # noqa
+from saturn_run.executor.base import Executor  # noqa
+from saturn_run.results.base import FINISHED, Results  # noqa
 from saturn_run.run import RunConfig, TaskConfig  # noqa
+from saturn_run.status import CACHED, StatusIndex  # noqa
+from saturn_run.tracing import DEFAULT_TRACE_PATH, phase_breakdown, read_spans  # noqa
+from saturn_run.utils import parse_bytes, parse_duration  # noqa
 
 
 @click.group()
@@ -12,28 +17,36 @@ def cli():
     pass
 
 
-@cli.command(help="executes a run from the definition in RUN_YAML")
+@cli.command(
+    help="executes a run from the definition in RUN_YAML, with the tasks in TASK_YAML "
+    "(a task yaml, or a .jsonl or .csv file of tasks)"
+)
 @click.argument("run-yaml")
 @click.argument("task-yaml")
 @click.option("--name", default=None)
 @click.option("--prefix", default=None)
-def run(run_yaml, task_yaml, name, prefix):
+@click.option("--force", is_flag=True, help="run tasks even if they are in the results cache")
+def run(run_yaml, task_yaml, name, prefix, force):
     logging.basicConfig(level=logging.INFO)
     with open(run_yaml, "r") as f:
         parsed = YAML().load(f)
     run_config = RunConfig.from_yaml(name=name, prefix=prefix, **parsed)
     if prefix and name:
-        raise ValueError('prefix and name are mutually exclusive')
+        raise ValueError("prefix and name are mutually exclusive")
     if prefix:
         run_config.executor.cleanup(prefix)
     else:
         run_config.executor.cleanup(name)
-    with open(task_yaml, "r") as f:
-        parsed = YAML().load(f)
-    tasks = TaskConfig.from_yaml(**parsed)
+    tasks = TaskConfig.from_file(task_yaml)
 
-    run_config.run(tasks)
-    run_config.executor.collect(run_config.name)
+    try:
+        run_config.run(tasks, force=force)
+        run_config.collect()
+    finally:
+        run_config.executor.close()
+    evicted = run_config.results.evict_cache()
+    if evicted:
+        logging.info(f"evicted {len(evicted)} entries from the results cache")
 
 
 @cli.command(help="executes a run from the definition in RUN_YAML")
@@ -43,7 +56,100 @@ def collect(run_yaml, name):
     with open(run_yaml, "r") as f:
         parsed = YAML().load(f)
     run_config = RunConfig.from_yaml(name=name, **parsed)
-    run_config.executor.collect(name)
+    try:
+        run_config.collect()
+    finally:
+        run_config.executor.close()
+
+
+@cli.command(help="closes the warm pool of the cluster defined in RUN_YAML")
+@click.argument("run-yaml")
+def stop_pool(run_yaml):
+    with open(run_yaml, "r") as f:
+        parsed = YAML().load(f)
+    executor = Executor.create(**parsed["executor"])
+    if not getattr(executor, "stop_warm_pool", None):
+        raise click.UsageError(f"{run_yaml} does not define an executor with a warm pool")
+    if executor.stop_warm_pool():
+        logging.info("stopped the warm pool")
+    else:
+        logging.info("no warm pool is running")
+
+
+@cli.command(help="shows the status of the tasks in a run from the definition in RUN_YAML")
+@click.argument("run-yaml")
+@click.option("--name", required=True)
+@click.option("--state", default=None, help="only list tasks in this state, e.g. failed")
+@click.option("--task", default=None, help="only show this task")
+@click.option("--limit", default=100, show_default=True, help="maximum number of tasks to list")
+def status(run_yaml, name, state, task, limit):
+    with open(run_yaml, "r") as f:
+        parsed = YAML().load(f)
+    results = Results.create(name=name, **parsed["results"])
+    index = StatusIndex(results.fetch_status_index())
+    try:
+        counts = index.counts()
+        click.echo(", ".join(f"{count} {s}" for s, count in sorted(counts.items())) or "no tasks")
+        if state is None and task is None:
+            # by default, list what went wrong
+            states = [s for s in counts if s not in (FINISHED, CACHED)]
+        else:
+            states = [state]
+        for s in states:
+            for record in index.records(state=s, name=task, limit=limit):
+                duration = ""
+                if record.start is not None and record.end is not None:
+                    duration = f"{record.end - record.start:.1f}s"
+                click.echo(
+                    f"{record.name}\t{record.state}\texit={record.exit_code}\t{duration}\t"
+                    f"{record.worker or ''}\tbytes={record.bytes_written}\t"
+                    f"peak_rss={record.peak_rss}"
+                )
+    finally:
+        index.close()
+
+
+@cli.command(help="removes old entries from the results cache defined in RUN_YAML")
+@click.argument("run-yaml")
+@click.option("--max-age", default=None, help="e.g. 7d, defaults to cache_max_age")
+@click.option("--max-size", default=None, help="e.g. 100GB, defaults to cache_max_size")
+def evict_cache(run_yaml, max_age, max_size):
+    with open(run_yaml, "r") as f:
+        parsed = YAML().load(f)
+    # the cache is shared by all runs
+    results = Results.create_cache(**parsed["results"])
+    if not results.cache_enabled:
+        raise click.UsageError(f"{run_yaml} does not configure a results cache")
+    evicted = results.evict_cache(
+        max_age=parse_duration(max_age) if max_age else None,
+        max_size=parse_bytes(max_size) if max_size else None,
+    )
+    logging.info(f"evicted {len(evicted)} entries from the results cache")
+
+
+@cli.command(help="breaks down where the time of a run from the definition in RUN_YAML went")
+@click.argument("run-yaml")
+@click.option("--name", required=True)
+@click.option(
+    "--trace",
+    "traces",
+    multiple=True,
+    help="JSON lines trace file, e.g. copied from a worker. Defaults to the run yaml's",
+)
+def profile(run_yaml, name, traces):
+    with open(run_yaml, "r") as f:
+        parsed = YAML().load(f)
+    if not traces:
+        tracing = parsed.get("tracing") or {}
+        if tracing.get("class_spec") != "JsonLinesExporter":
+            raise click.UsageError(f"{run_yaml} does not trace to a JSON lines file, use --trace")
+        traces = [tracing.get("path", DEFAULT_TRACE_PATH)]
+    spans = read_spans(traces, trace_id=name)
+    if spans:
+        start = min(s.start for s in spans)
+        end = max(s.end for s in spans)
+        click.echo(f"{len(spans)} spans over {end - start:.1f}s for {name}")
+    click.echo(phase_breakdown(spans))
 
 
 if __name__ == "__main__":
@@ -1,2 +1,16 @@
+from importlib import import_module
+
 from saturn_run.executor.base import Executor  # noqa
-from saturn_run.executor.dask import DaskExecutor  # noqa
+
+# executors are imported when they are first used, so that e.g. the dependencies of
+# DaskExecutor are not imported by runs that use LocalProcessExecutor
+_lazy = {
+    "DaskExecutor": "saturn_run.executor.dask",
+    "LocalProcessExecutor": "saturn_run.executor.local",
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(import_module(_lazy[name]), name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
@@ -0,0 +1,173 @@
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from distributed.deploy import Adaptive
+from saturn_run.errors import ConfigError
+from saturn_run.status import CACHED
+from saturn_run.utils import parse_duration
+
+# seconds between scaling decisions, and how many decisions in a row must agree before
+# a worker is removed
+AUTOSCALE_INTERVAL = 5.0
+SCALE_DOWN_WAIT_COUNT = 3
+
+
+@dataclass
+class AutoscalePolicy:
+    """
+    How many workers a cluster should have for the tasks that are left. ``target_time``
+    is how long after submission the run should finish, if ``max_workers`` allows it.
+    Without it, or before any task has finished, every task that can run gets a thread.
+    """
+
+    min_workers: int = 0
+    max_workers: int = 10
+    target_time: Optional[float] = None
+    interval: float = AUTOSCALE_INTERVAL
+
+    @classmethod
+    def from_yaml(
+        cls,
+        min_workers: int = 0,
+        max_workers: int = 10,
+        target_time: Optional[Union[str, float]] = None,
+        interval: Union[str, float] = AUTOSCALE_INTERVAL,
+    ) -> "AutoscalePolicy":
+        if min_workers < 0 or max_workers < max(1, min_workers):
+            raise ConfigError(
+                f"autoscale needs 0 <= min_workers <= max_workers and max_workers >= 1, "
+                f"got {min_workers} and {max_workers}"
+            )
+        return cls(
+            min_workers=min_workers,
+            max_workers=max_workers,
+            target_time=parse_duration(target_time) if target_time is not None else None,
+            interval=parse_duration(interval),
+        )
+
+    def workers(
+        self,
+        work: float,
+        parallel: float,
+        threads_per_worker: float,
+        task_seconds: Optional[float],
+        seconds_left: Optional[float],
+    ) -> int:
+        """
+        ``work`` is the number of threads the remaining tasks need, summed over tasks,
+        and ``parallel`` the most threads they can use at once. Tasks take
+        ``task_seconds`` on average, if known, and the run should be done in
+        ``seconds_left``.
+        """
+        if work <= 0:
+            return self.min_workers
+        # more workers than this would sit idle
+        needed = math.ceil(parallel / threads_per_worker)
+        if task_seconds is not None and self.target_time is not None:
+            # past the target, finish as soon as possible
+            seconds = max(seconds_left or 0.0, task_seconds)
+            needed = min(needed, math.ceil(work * task_seconds / (seconds * threads_per_worker)))
+        return max(self.min_workers, min(self.max_workers, needed))
+
+
+class RunDemand:
+    """
+    What the runs submitted by an executor still need, fed by ``execute`` as it submits
+    futures and by ``collect`` as they finish. Futures that ``execute`` did not submit,
+    e.g. when collecting from another process, count as one thread per task.
+    """
+
+    def __init__(self, policy: AutoscalePolicy):
+        self.policy = policy
+        self.lock = threading.Lock()
+        # future key -> (tasks, threads each task needs, threads the future uses at once)
+        self.pending: Dict[str, Tuple[int, float, float]] = {}
+        self.submitted: Optional[float] = None
+        self.finished_tasks = 0
+        self.finished_seconds = 0.0
+
+    def add(self, key: str, tasks: int, cpus: Optional[float] = None, width: float = 1):
+        threads = max(1.0, cpus or 1.0)
+        with self.lock:
+            if self.submitted is None:
+                self.submitted = time.monotonic()
+            self.pending[key] = (tasks, threads, width * threads)
+
+    def expect(self, manifest: Iterable[Tuple[Any, List[str]]]):
+        """Count futures being collected that were not submitted by this executor"""
+        with self.lock:
+            if self.submitted is None:
+                self.submitted = time.monotonic()
+            for fut, task_names in manifest:
+                self.pending.setdefault(fut.key, (len(task_names), 1.0, 1.0))
+
+    def finish(self, key: str, records: Iterable[Any] = ()):
+        with self.lock:
+            self.pending.pop(key, None)
+            for r in records:
+                if r is not None and r.start is not None and r.end is not None:
+                    if r.state != CACHED:
+                        self.finished_tasks += 1
+                        self.finished_seconds += r.end - r.start
+
+    def workers(self, threads_per_worker: float) -> int:
+        with self.lock:
+            work = sum(tasks * threads for tasks, threads, _ in self.pending.values())
+            parallel = sum(width for _, _, width in self.pending.values())
+            task_seconds = None
+            if self.finished_tasks:
+                task_seconds = self.finished_seconds / self.finished_tasks
+            seconds_left = None
+            if self.submitted is not None and self.policy.target_time is not None:
+                seconds_left = self.policy.target_time - (time.monotonic() - self.submitted)
+        return self.policy.workers(
+            work, parallel, max(1.0, threads_per_worker), task_seconds, seconds_left
+        )
+
+
+def threads_per_worker(cluster) -> float:
+    """Threads of the cluster's workers, or of the workers it would start"""
+    workers = cluster.scheduler_info.get("workers", {})
+    if workers:
+        return sum(w["nthreads"] for w in workers.values()) / len(workers)
+    try:
+        return float(cluster.new_spec["options"]["nthreads"])
+    except (AttributeError, KeyError, TypeError):
+        return 1.0
+
+
+class RunAdaptive(Adaptive):
+    """
+    Scales a cluster to what ``demand`` says the runs need, instead of dask's estimate
+    from the scheduler's task durations. Idle workers are retired gracefully, once
+    ``SCALE_DOWN_WAIT_COUNT`` decisions in a row agree.
+    """
+
+    def __init__(self, *args, demand: RunDemand, **kwargs):
+        self.demand = demand
+        self.last_target: Optional[int] = None
+        super().__init__(*args, **kwargs)
+
+    async def target(self) -> int:
+        target = self.demand.workers(threads_per_worker(self.cluster))
+        if target != self.last_target:
+            logging.info(f"autoscaling to {target} workers")
+            self.last_target = target
+        return target
+
+
+def start_autoscaling(cluster, policy: AutoscalePolicy) -> RunDemand:
+    demand = RunDemand(policy)
+    cluster.adapt(
+        Adaptive=RunAdaptive,
+        demand=demand,
+        minimum=policy.min_workers,
+        maximum=policy.max_workers,
+        interval=policy.interval,
+        wait_count=SCALE_DOWN_WAIT_COUNT,
+    )
+    return demand
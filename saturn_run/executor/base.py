@@ -1,21 +1,42 @@
-from typing import Callable, Dict, List
+from typing import Callable, Dict, Iterable, List, Optional, Union
 
 from saturn_run.file_sync import FileSync
 from saturn_run.results.base import Results
 from saturn_run.tasks import TaskSpec
+from saturn_run.utils import resolve_backend
 
 
 class Executor:
-    backends: Dict[str, Callable[..., "Executor"]] = {}
-
-    def execute(self, tasks: List[TaskSpec], results: Results, name: str):
+    # class_spec -> backend, or the module:attribute path it is imported from
+    backends: Dict[str, Union[str, Callable[..., "Executor"]]] = {
+        "DaskExecutor": "saturn_run.executor.dask:DaskExecutor",
+        "LocalProcessExecutor": "saturn_run.executor.local:LocalProcessExecutor",
+    }
+
+    def execute(
+        self,
+        tasks: Iterable[TaskSpec],
+        results: Results,
+        name: str,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Submit ``tasks``, which is either a list or an iterator of tasks that are parsed
+        as they are submitted. In an iterator, tasks come after the tasks they depend on.
+        ``batch_size`` overrides the executor's own setting for how many tasks are run
+        together by one call on the cluster, where it has one.
+        """
         raise NotImplementedError
 
     @classmethod
     def create(cls, class_spec: str, **kwargs) -> "Executor":
-        return cls.backends[class_spec](**kwargs)
+        return resolve_backend(cls.backends, class_spec)(**kwargs)
 
-    def collect(self, name: str):
+    def collect(self, name: str, results: Optional[Results] = None):
+        """
+        Wait for the tasks of the run ``name`` to finish, and report on them. If
+        ``results`` is given, what happened to each task is written to its status index.
+        """
         raise NotImplementedError
 
     def sync_files(self, file_syncs: List[FileSync]):
@@ -23,3 +44,6 @@ class Executor:
 
     def cleanup(self, prefix: str):
         raise NotImplementedError
+
+    def close(self):
+        """Release what the executor holds on to, e.g. connections to a cluster"""
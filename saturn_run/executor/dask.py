@@ -1,13 +1,18 @@
+import asyncio
 import logging
+import operator
 import os
-import subprocess
+import time
 import traceback
-from typing import Callable, Dict, List, Optional
+from concurrent.futures import CancelledError
+from dataclasses import replace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from dask.base import tokenize
 from dask.distributed import Client, LocalCluster, SpecCluster
-from distributed import get_client
-from distributed.client import FIRST_COMPLETED, wait
+from distributed import Future, get_client
+from distributed.client import as_completed
+from distributed.core import Status
 
 try:
     from dask_saturn import SaturnCluster
@@ -15,18 +20,71 @@ except ImportError:
     SaturnCluster = None
 
 from saturn_run.errors import ConfigError
+from saturn_run.executor import warm_pool
+from saturn_run.executor.autoscale import (
+    AutoscalePolicy,
+    RunDemand,
+    start_autoscaling,
+    threads_per_worker,
+)
 from saturn_run.executor.base import Executor
-from saturn_run.file_sync import FileSync
+from saturn_run.executor.speculation import SpeculationPolicy, Speculator
+from saturn_run.file_sync import ChunkCache, FileSync, build_manifest, iter_chunks
 from saturn_run.logging import logger
-from saturn_run.processes import cleanup_all_processes, execute
-from saturn_run.results.base import Results
-from saturn_run.tasks import TaskSpec
+from saturn_run.metrics import SAMPLE_INTERVAL
+from saturn_run.processes import (
+    MAX_SYNC_INTERVAL,
+    MIN_SYNC_INTERVAL,
+    TERMINATE_GRACE_PERIOD,
+    attempt_run_times,
+    cancel_attempts,
+    check_sync_intervals,
+    execute_batch,
+    execute_many,
+    execute_task,
+    forward_sigterm,
+    terminate_all_processes,
+    terminating,
+)
+from saturn_run.progress import Progress
+from saturn_run.results.base import Results, new_execution
+from saturn_run.status import (
+    ERROR,
+    SUPERSEDED,
+    MetricsSummary,
+    StatusWriter,
+    TaskRecord,
+)
+from saturn_run.task_source import windows
+from saturn_run.tasks import TaskSpec, sort_by_dependencies
+from saturn_run.tracing import span
 
 PREFIX = "SATURN_RUN_FILES_"
+CHUNK_PREFIX = "saturn-run-chunk-"
+# number of chunks a worker fetches at once
+FETCH_BATCH = 16
+# bytes of new chunks the client holds before scattering them
+SCATTER_BATCH_BYTES = 64 * 1024 * 1024
+# workers that hold every chunk in memory, so chunks outlive all but one of them
+CHUNK_REPLICAS = 2
+# tasks sent to the scheduler per message when submitting a run
+SUBMIT_BATCH_SIZE = 10_000
+# tasks read from a streamed task file before they are submitted
+SUBMIT_WINDOW = 50_000
+# seconds between re-publishing the manifest of unfinished tasks while collecting
+REPUBLISH_INTERVAL = 30
+# worker resources that a task's cpus and memory are mapped to, if workers declare them
+CPU_RESOURCE = "CPU"
+MEMORY_RESOURCE = "MEMORY"
+# seconds between looks for completed futures while collecting a speculated run
+SPECULATION_POLL_INTERVAL = 0.1
+# statuses of a worker that is shutting down
+WORKER_CLOSING = (Status.closing, Status.closing_gracefully, Status.closed)
 
 
 async def register_files_to_worker(paths: Optional[List[str]] = None) -> List[str]:
     """Register all files in the given paths on the current worker"""
+    cache = ChunkCache()
     with get_client() as client:
         # If paths isn't provided, register all files in datasets that start with prefix
         if paths is None:
@@ -34,20 +92,31 @@ async def register_files_to_worker(paths: Optional[List[str]] = None) -> List[st
             paths = [p[len(PREFIX) :] for p in datasets if p.startswith(PREFIX)]
 
         for path in paths:
-            # retrieve the filedata from the scheduler
-            payload = await client.get_dataset(f"{PREFIX}{path}")
-
-            # by convention, paths that end with '/' are directories
-            if path.endswith("/"):
-                with open("/tmp/data.tar.gz", "wb+") as f:
-                    f.write(payload)
-                subprocess.run(f"mkdir -p {path}", shell=True, check=True)
-                subprocess.run(f"tar -xvzf /tmp/data.tar.gz -C {path}", shell=True, check=True)
-            else:
-                basepath = os.path.split(path)[0]
-                subprocess.run(f"mkdir -p {basepath}", shell=True, check=True)
-                with open(path, "wb+") as f:
-                    f.write(payload)
+            with span("register_files", path=path) as s:
+                # retrieve the manifest and chunk futures from the scheduler
+                payload = await client.get_dataset(f"{PREFIX}{path}")
+                manifest = payload["manifest"]
+                chunks = payload["chunks"]
+
+                # only fetch the chunks this worker doesn't already have
+                missing = cache.missing(manifest)
+                try:
+                    for idx in range(0, len(missing), FETCH_BATCH):
+                        digests = missing[idx : idx + FETCH_BATCH]
+                        data = await client.gather([chunks[d] for d in digests])
+                        for digest, chunk in zip(digests, data):
+                            cache.put(digest, chunk)
+                except CancelledError:
+                    logger().error(
+                        f"could not sync {path}, its chunks went away with the workers "
+                        f"that held them. Sync it again to restore them."
+                    )
+                    continue
+                written = cache.apply(manifest)
+                if s:
+                    s.attributes.update(chunks_fetched=len(missing), files_written=len(written))
+            logger().info(f"synced {len(written)} changed files to {path}")
+    cache.prune()
     return os.listdir()
 
 
@@ -74,31 +143,74 @@ def sync_files(client: Client, path: str):
     :param client: distributed.Client object
     :param path: string or path obj pointing to file or directory to track.
 
+    Files are split into content addressed chunks. The chunks are scattered to the
+    workers (not the scheduler), each held in memory by ``CHUNK_REPLICAS`` of them, and
+    a manifest describing how to rebuild the files is published along with the chunk
+    futures. Other workers fetch the chunks from those. Chunks that were already
+    published for this path are reused, so a re-sync only ships what changed, and what
+    was lost with the workers that held it.
+
     If used in conjunction with the ``RegisterFiles`` plugin, all files will be uploaded
     to new workers as they get spun up.
     """
     # normalize the path
     path = os.path.abspath(path)
-
     if os.path.isdir(path):
         path += "/"
-        subprocess.run(
-            f"tar --exclude .git -cvzf /tmp/data.tar.gz -C {path} .", shell=True, check=True
-        )
-        with open("/tmp/data.tar.gz", "rb") as f:
-            payload = f.read()
-    else:
-        with open(path, "rb") as f:
-            payload = f.read()
+
+    manifest = build_manifest(path)
+    dataset_name = f"{PREFIX}{path}"
+    known: Dict[str, Future] = {}
+    if dataset_name in client.list_datasets():
+        # chunks are cancelled when every worker holding them is gone
+        known = {
+            digest: fut
+            for digest, fut in client.get_dataset(dataset_name)["chunks"].items()
+            if fut.status == "finished"
+        }
+
+    digests = {d for entry in manifest["files"].values() for d in entry["chunks"]}
+    chunks = {d: known[d] for d in digests if d in known}
+    new_chunks: Dict[str, bytes] = {}
+    new_bytes = 0
+    for digest, data in iter_chunks(manifest, digests - set(known)):
+        new_chunks[f"{CHUNK_PREFIX}{digest}"] = data
+        new_bytes += len(data)
+        # bound client memory by scattering in batches
+        if new_bytes >= SCATTER_BATCH_BYTES:
+            chunks.update(scatter_chunks(client, new_chunks))
+            new_chunks = {}
+            new_bytes = 0
+    chunks.update(scatter_chunks(client, new_chunks))
+    logger().info(f"sync {path}: {len(digests)} chunks, {len(digests - set(known))} new")
 
     # erase the given file or any file in the directory
     for p in [p for p in client.list_datasets() if path in p]:
         client.unpublish_dataset(p)
 
-    client.publish_dataset(**{f"{PREFIX}{path}": payload})
+    client.publish_dataset(**{dataset_name: {"manifest": manifest, "chunks": chunks}})
     client.run(register_files_to_worker, paths=[path])
 
 
+def scatter_chunks(client: Client, chunks: Dict[str, bytes]) -> Dict[str, Future]:
+    if not chunks:
+        return {}
+    futures = client.scatter(chunks)
+    client.replicate(list(futures.values()), n=CHUNK_REPLICAS)
+    return {k[len(CHUNK_PREFIX) :]: fut for k, fut in futures.items()}
+
+
+def group_tasks(tasks: List[TaskSpec]) -> List[List[TaskSpec]]:
+    """
+    Group tasks that need the same resources and have the same ``rank``, so each group
+    can be submitted at once. Groups with a higher rank come first.
+    """
+    groups: Dict[tuple, List[TaskSpec]] = {}
+    for t in tasks:
+        groups.setdefault((t.requirements, t.rank), []).append(t)
+    return sorted(groups.values(), key=lambda group: -group[0].rank)
+
+
 class RegisterFiles:
     """WorkerPlugin for uploading files or directories to dask workers.
 
@@ -114,11 +226,37 @@ class RegisterFiles:
 
 
 class RegisterCleanup:
-    """WorkerPlugin to ensure that there are no ghosted processes"""
+    """
+    WorkerPlugin to ensure that there are no ghosted processes. When the worker stops,
+    or its process gets SIGTERM (e.g. a spot instance being preempted), tasks get
+    SIGTERM and ``grace_period`` seconds to exit before they are killed.
+    """
+
+    # registered once per cluster, see ``register_cleanup``
+    name = "register_cleanup"
+
+    def __init__(self, grace_period: float = TERMINATE_GRACE_PERIOD):
+        self.grace_period = grace_period
 
     # pylint: disable=unused-argument
+    async def setup(self, worker=None):
+        forward_sigterm(self.grace_period)
+
     async def teardown(self, worker=None):
-        cleanup_all_processes()
+        # plugins are also torn down when they are removed or replaced, which must
+        # leave the worker's tasks alone
+        if worker is not None and worker.status not in WORKER_CLOSING:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, terminate_all_processes, self.grace_period)
+        # other workers may share this process, e.g. in a LocalCluster of threads, and
+        # their tasks must not be handed back from now on
+        terminating.clear()
+
+
+def worker_plugin_registered(dask_scheduler, name: str) -> bool:
+    """Whether the scheduler hands the worker plugin ``name`` to its workers"""
+    return name in dask_scheduler.worker_plugins
 
 
 class DaskExecutor(Executor):
@@ -130,23 +268,149 @@ class DaskExecutor(Executor):
         scheduler_address: Optional[str] = None,
         cluster_class: Optional[str] = None,
         cluster_kwargs: Optional[Dict[str, str]] = None,
+        async_concurrency: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        sample_interval: float = SAMPLE_INTERVAL,
+        min_sync_interval: float = MIN_SYNC_INTERVAL,
+        max_sync_interval: float = MAX_SYNC_INTERVAL,
+        warm_pool: bool = False,
+        warm_pool_idle_timeout: float = warm_pool.DEFAULT_IDLE_TIMEOUT,
+        autoscale: Optional[Dict[str, Any]] = None,
+        speculation: Optional[Union[bool, Dict[str, Any]]] = None,
+        terminate_grace_period: float = TERMINATE_GRACE_PERIOD,
     ):
+        """
+        One client, and one cluster if ``cluster_class`` is set, is created on first use
+        and shared by everything the executor does until ``close``.
+
+        If ``warm_pool`` is set, the cluster is started in a process of its own that
+        outlives this one, and later runs with the same ``cluster_class`` and
+        ``cluster_kwargs`` connect to it instead of starting their own. It is closed
+        once it has been unused for ``warm_pool_idle_timeout`` seconds, or with
+        ``saturn stop-pool``.
+
+        ``autoscale`` (``min_workers``, ``max_workers`` and ``target_time``, see
+        ``AutoscalePolicy``) scales the cluster started for ``cluster_class`` to the
+        tasks that are left: up as tasks are submitted, and down as they finish.
+
+        ``speculation`` (true, or ``multiplier``, ``min_seconds`` and ``min_finished``,
+        see ``SpeculationPolicy``) starts a copy of tasks that run well past how long they
+        are expected to take on another worker, while the run is collected in the
+        process that submitted it. Whichever copy is committed first stands for the
+        task, and the other is killed. Tasks in batches, and tasks that other tasks
+        depend on, are not speculated.
+
+        Tasks with a ``retry`` policy run as attempts, and are never batched. They are
+        run again on the same worker when they exit with a code the policy retries, and
+        on another worker when theirs goes away. When a worker stops, its tasks get
+        SIGTERM and ``terminate_grace_period`` seconds to checkpoint before they are
+        killed, and the next attempt starts from the results they left.
+
+        The process tree of every task is sampled every ``sample_interval`` seconds for
+        its ``metrics.json``. The output of a running task is synced between
+        ``min_sync_interval`` and ``max_sync_interval`` seconds apart, more often while
+        it is writing output.
+
+        If ``batch_size`` is set, tasks are sent to workers in batches of that many, and
+        the tasks in a batch run one after another in a single dask task. This is useful
+        for many short commands, where the per task overhead would dominate.
+
+        If ``async_concurrency`` is set, tasks are sent to workers in batches of
+        ``batch_size`` (default: 4 * async_concurrency). Each batch is supervised from
+        an event loop in a single worker thread, with up to ``async_concurrency``
+        subprocesses at a time. This is useful for many lightweight or I/O bound
+        commands, which would otherwise each hold a worker thread.
+        """
 
         self.scheduler_address = scheduler_address
         self.cluster_class = cluster_class
         self.cluster_kwargs = cluster_kwargs
+        self.async_concurrency = async_concurrency
+        self.batch_size = batch_size
+        self.sample_interval = sample_interval
+        check_sync_intervals(min_sync_interval, max_sync_interval)
+        self.min_sync_interval = min_sync_interval
+        self.max_sync_interval = max_sync_interval
+        self.terminate_grace_period = terminate_grace_period
+        if self.async_concurrency and not self.batch_size:
+            self.batch_size = 4 * self.async_concurrency
+        if scheduler_address is None and cluster_class is None:
+            raise ConfigError("cluster_class must be set if scheduler_address is None")
+        if cluster_class is not None and cluster_class not in self.cluster_classes:
+            raise ConfigError(f"unknown cluster_class {cluster_class}")
+        self.warm_pool = warm_pool
+        self.warm_pool_idle_timeout = warm_pool_idle_timeout
+        self.autoscale: Optional[AutoscalePolicy] = None
+        if autoscale:
+            if scheduler_address or warm_pool:
+                raise ConfigError(
+                    "autoscale only applies to clusters started by the executor, "
+                    "not to a scheduler_address or a warm_pool"
+                )
+            self.autoscale = AutoscalePolicy.from_yaml(**autoscale)
+        self.speculation: Optional[SpeculationPolicy] = None
+        if speculation:
+            self.speculation = SpeculationPolicy.from_yaml(
+                **(speculation if isinstance(speculation, dict) else {})
+            )
+        # run name -> the tasks that can be speculated while the run is collected
+        self.speculators: Dict[str, Speculator] = {}
         self.cluster: Optional[SpecCluster] = None
+        self.client: Optional[Client] = None
+        # what submitted tasks still need, if the cluster is autoscaled
+        self.demand: Optional[RunDemand] = None
+        # tasks' memory is only reserved on workers that declare a MEMORY resource
+        self.warned_unreserved_memory = False
 
     def get_dask_client(self) -> Client:
-        if self.scheduler_address:
-            return Client(self.scheduler_address)
-        if self.cluster_class is None:
-            raise ConfigError("cluster_class must be set if scheduler_address is None")
-        cluster_kwargs = self.cluster_kwargs
-        if cluster_kwargs is None:
-            cluster_kwargs = {}
-        self.cluster = self.cluster_classes[self.cluster_class](**cluster_kwargs)
-        return Client(self.cluster)
+        """The executor's client, connected (and its cluster started) on first use"""
+        if self.client is not None and self.client.status == "running":
+            return self.client
+        with span("connect"):
+            if self.scheduler_address:
+                self.client = Client(self.scheduler_address)
+            elif self.cluster_class is None:
+                raise ConfigError("cluster_class must be set if scheduler_address is None")
+            elif self.warm_pool:
+                self.client = self.connect_warm_pool(self.cluster_class)
+            else:
+                if self.cluster is None:
+                    self.cluster = self.cluster_classes[self.cluster_class](
+                        **(self.cluster_kwargs or {})
+                    )
+                    if self.autoscale:
+                        self.demand = start_autoscaling(self.cluster, self.autoscale)
+                self.client = Client(self.cluster)
+        return self.client
+
+    def connect_warm_pool(self, cluster_class: str) -> Client:
+        address = warm_pool.connect(cluster_class, self.cluster_kwargs, self.warm_pool_idle_timeout)
+        try:
+            return Client(address, timeout=warm_pool.CONNECT_TIMEOUT)
+        except OSError:
+            # the pool's process is alive but its scheduler is not, so start over
+            logging.info(f"warm pool at {address} is unreachable, restarting it")
+            warm_pool.stop(cluster_class, self.cluster_kwargs)
+            address = warm_pool.connect(
+                cluster_class, self.cluster_kwargs, self.warm_pool_idle_timeout
+            )
+            return Client(address, timeout=warm_pool.CONNECT_TIMEOUT)
+
+    def close(self):
+        """Close the client, and the cluster unless it is a warm pool"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.cluster is not None:
+            self.cluster.close()
+            self.cluster = None
+            self.demand = None
+
+    def stop_warm_pool(self) -> bool:
+        """Close the warm pool for this executor's cluster, if there is one"""
+        if not self.cluster_class:
+            raise ConfigError("only executors with a cluster_class have a warm pool")
+        return warm_pool.stop(self.cluster_class, self.cluster_kwargs)
 
     def cleanup(self, prefix: str):
         client = self.get_dask_client()
@@ -155,58 +419,476 @@ class DaskExecutor(Executor):
             logger().info(f"cleanup dataset {k}")
             client.unpublish_dataset(k)
 
-    def execute(self, tasks: List[TaskSpec], results: Results, name: str):
-        client = self.get_dask_client()
-        client.register_worker_plugin(RegisterCleanup())
-        datasets = []
+    def execute(
+        self,
+        tasks: Iterable[TaskSpec],
+        results: Results,
+        name: str,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Submit ``tasks``. A list is submitted at once. Any other iterable, e.g. tasks
+        streamed from a file, is submitted ``SUBMIT_WINDOW`` tasks at a time while it
+        is read, so the client holds at most one window of ``TaskSpec``s.
+        """
+        with span("executor.execute", trace_id=name) as s:
+            batch_size = batch_size or self.batch_size
+            client = self.get_dask_client()
+            self.register_cleanup(client)
+            if self.speculation:
+                self.speculators[name] = Speculator(self.speculation)
+            task_windows: Iterable[List[TaskSpec]]
+            if isinstance(tasks, list):
+                logging.info(f"executing {len(tasks)} tasks for {name}")
+                task_windows = [sort_by_dependencies(tasks)]
+            else:
+                logging.info(f"executing tasks for {name} as they are read")
+                task_windows = windows(tasks, SUBMIT_WINDOW)
+            upstream: Dict[str, Tuple[Future, Optional[int]]] = {}
+            manifest: List[Tuple[Future, List[str]]] = []
+            count = 0
+            for window in task_windows:
+                with span("submit", tasks=len(window)):
+                    manifest += self.submit_window(
+                        client, window, results, name, batch_size, upstream
+                    )
+                count += len(window)
+                self.scale_up()
+                if not isinstance(tasks, list):
+                    logging.info(f"submitted {count} tasks for {name}")
+            if s:
+                s.attributes["tasks"] = count
+            # a single manifest of (future, task names) pairs, instead of one dataset per task
+            client.datasets[f"srun/{name}"] = manifest
+
+    def submit_window(
+        self,
+        client: Client,
+        tasks: List[TaskSpec],
+        results: Results,
+        name: str,
+        batch_size: Optional[int],
+        upstream: Dict[str, Tuple[Future, Optional[int]]],
+    ) -> List[Tuple[Future, List[str]]]:
+        """
+        Submit ``tasks``, which come after the tasks they depend on. ``upstream`` holds
+        the future of every task submitted so far, and its position in the result if
+        the task was batched. It is updated with ``tasks``.
+        """
+        submitted = time.time()
         for t in tasks:
-            key = f"{name}/{t.name}/{tokenize(t.command, t.shell)}"
-            logging.info(f"executing {t.name} with key {key} ")
-            fut = client.submit(
-                execute,
-                results=results,
-                name=t.name,
-                cmd=t.command,
-                shell=t.shell,
+            t.submitted = submitted
+        # tasks that others depend on need a future of their own
+        upstream_names = {dep for t in tasks for dep in t.depends_on}
+        independent = [t for t in tasks if not t.depends_on]
+        if batch_size:
+            # tasks that are retried run as attempts, which batches don't
+            batched = [t for t in independent if t.name not in upstream_names and not t.retry]
+            single = [t for t in independent if t.name in upstream_names or t.retry]
+        else:
+            batched = []
+            single = independent
+        manifest = self.submit_tasks(client, single, results, name)
+        for fut, task_names in manifest:
+            upstream[task_names[0]] = (fut, None)
+        if batch_size and batched:
+            batches = self.submit_batches(client, batched, results, name, batch_size)
+            for fut, task_names in batches:
+                for idx, task_name in enumerate(task_names):
+                    upstream[task_name] = (fut, idx)
+            manifest += batches
+        dependent = [t for t in tasks if t.depends_on]
+        if dependent:
+            manifest += self.submit_dependents(client, dependent, results, name, upstream)
+        return manifest
+
+    def scale_up(self):
+        """
+        Scale an autoscaled cluster up to what the submitted tasks need right away,
+        rather than at its next scaling decision
+        """
+        if self.demand is None or self.cluster is None:
+            return
+        target = self.demand.workers(threads_per_worker(self.cluster))
+        if target > len(self.cluster.plan):
+            logging.info(f"scaling up to {target} workers")
+            self.cluster.scale(target)
+
+    def monitor_kwargs(self) -> Dict[str, float]:
+        """How workers sample and sync the tasks they run"""
+        return {
+            "sample_interval": self.sample_interval,
+            "min_sync_interval": self.min_sync_interval,
+            "max_sync_interval": self.max_sync_interval,
+        }
+
+    def task_restrictions(
+        self, workers: Dict[str, Dict[str, Any]], task: TaskSpec, scale: int = 1
+    ) -> Dict[str, Any]:
+        """
+        Map what ``task`` needs (times ``scale``, for batches) to the ``resources=`` and
+        ``workers=`` arguments of ``client.map``.
+
+        Custom resources are passed through as dask resources. CPUs and memory become
+        dask resources if the workers declare ``CPU`` and ``MEMORY`` resources,
+        otherwise tasks are restricted to workers with enough threads and memory. That
+        only filters workers and reserves nothing: dask runs as many tasks on a worker
+        as it has threads, however much memory they need together.
+        """
+        resources = {k: v * scale for k, v in task.resources.items()}
+        declared = {r for info in workers.values() for r in info.get("resources", {})}
+        threads = 0.0
+        memory = 0
+        if task.cpus:
+            if CPU_RESOURCE in declared:
+                resources[CPU_RESOURCE] = task.cpus * scale
+            else:
+                threads = task.cpus * scale
+        if task.memory:
+            if MEMORY_RESOURCE in declared:
+                resources[MEMORY_RESOURCE] = task.memory * scale
+            else:
+                memory = task.memory * scale
+                if not self.warned_unreserved_memory:
+                    logging.warning(
+                        f"workers declare no {MEMORY_RESOURCE} resource, so the memory of "
+                        f"tasks such as {task.name} is not reserved, and tasks that need "
+                        f"more memory together than a worker has can run on it at once"
+                    )
+                    self.warned_unreserved_memory = True
+
+        restrictions: Dict[str, Any] = {}
+        if resources:
+            restrictions["resources"] = resources
+        if (threads or memory) and workers:
+            eligible = [
+                address
+                for address, info in workers.items()
+                if info["nthreads"] >= threads
+                # a memory_limit of 0 means the worker has no limit
+                and (info.get("memory_limit") or float("inf")) >= memory
+            ]
+            if not eligible:
+                raise ConfigError(
+                    f"no worker has {threads} threads and {memory} bytes of memory for {task.name}"
+                )
+            if len(eligible) < len(workers):
+                restrictions["workers"] = eligible
+        return restrictions
+
+    def submit_tasks(
+        self, client: Client, tasks: List[TaskSpec], results: Results, name: str
+    ) -> List[Tuple[Future, List[str]]]:
+        workers = client.scheduler_info()["workers"]
+        speculator = self.speculators.get(name)
+        manifest: List[Tuple[Future, List[str]]] = []
+        for group in group_tasks(tasks):
+            keys = [f"{name}/{t.name}/{tokenize(t.command, t.shell)}" for t in group]
+            restrictions = self.task_restrictions(workers, group[0])
+            for t in group:
+                if speculator or t.retry:
+                    t.attempt_prefix = new_execution()
+            futures = client.map(
+                execute_task,
+                [results] * len(group),
+                group,
+                key=keys,
+                retries=0,
+                batch_size=SUBMIT_BATCH_SIZE,
+                priority=group[0].rank,
+                **self.monitor_kwargs(),
+                **restrictions,
+            )
+            manifest.extend((fut, [t.name]) for fut, t in zip(futures, group))
+            if self.demand:
+                for fut in futures:
+                    self.demand.add(fut.key, 1, group[0].cpus)
+            if speculator:
+                for fut, t in zip(futures, group):
+                    speculator.track(fut, t, restrictions)
+        return manifest
+
+    def submit_batches(
+        self,
+        client: Client,
+        tasks: List[TaskSpec],
+        results: Results,
+        name: str,
+        batch_size: int,
+    ) -> List[Tuple[Future, List[str]]]:
+        """
+        Submit ``tasks`` in batches of ``batch_size``, each run by one dask task. The
+        tasks in a batch run concurrently with ``execute_many`` if ``async_concurrency``
+        is set, and one after another with ``execute_batch`` otherwise. Only tasks with
+        the same priority share a batch.
+        """
+        workers = client.scheduler_info()["workers"]
+        if self.async_concurrency:
+            run_batch: Callable = execute_many
+            kwargs: Dict[str, Any] = {"concurrency": self.async_concurrency}
+            # a batch runs up to ``concurrency`` of its tasks at once
+            scale = min(self.async_concurrency, batch_size)
+        else:
+            run_batch = execute_batch
+            kwargs = {}
+            scale = 1
+        manifest: List[Tuple[Future, List[str]]] = []
+        for group in group_tasks(tasks):
+            batches = [group[idx : idx + batch_size] for idx in range(0, len(group), batch_size)]
+            keys = [
+                f"{name}/batch-{batch[0].name}/"
+                f"{tokenize([(t.name, t.command, t.shell) for t in batch])}"
+                for batch in batches
+            ]
+            futures = client.map(
+                run_batch,
+                [results] * len(batches),
+                batches,
+                key=keys,
                 retries=0,
-                key=key,
+                batch_size=SUBMIT_BATCH_SIZE,
+                priority=group[0].rank,
+                **self.monitor_kwargs(),
+                **kwargs,
+                **self.task_restrictions(workers, group[0], scale=scale),
             )
-            dataset_name = f"srun/{name}/{t.name}"
-            datasets.append(dataset_name)
-            client.datasets[dataset_name] = fut
-        client.datasets[f"srun/{name}"] = datasets
+            manifest.extend((fut, [t.name for t in batch]) for fut, batch in zip(futures, batches))
+            if self.demand:
+                for fut, batch in zip(futures, batches):
+                    self.demand.add(fut.key, len(batch), group[0].cpus, min(scale, len(batch)))
+        return manifest
 
-    def collect(self, name: str):
+    def submit_dependents(
+        self,
+        client: Client,
+        tasks: List[TaskSpec],
+        results: Results,
+        name: str,
+        upstream: Dict[str, Tuple[Future, Optional[int]]],
+    ) -> List[Tuple[Future, List[str]]]:
+        """
+        Submit tasks that depend on other tasks, in dependency order. Each task gets
+        the futures of its upstream tasks as arguments, so dask starts it as soon as
+        they finish, and it receives their records.
+        """
+        workers = client.scheduler_info()["workers"]
+        speculator = self.speculators.get(name)
+        manifest = []
+        for t in tasks:
+            kwargs = {
+                "upstream": [self.record_future(client, upstream, dep) for dep in t.depends_on],
+                **self.task_restrictions(workers, t),
+            }
+            if speculator or t.retry:
+                t.attempt_prefix = new_execution()
+            if speculator:
+                # the futures of upstream tasks must be the ones that stand for them
+                for dep in t.depends_on:
+                    speculator.forget(upstream[dep][0].key)
+            fut = client.submit(
+                execute_task,
+                results,
+                t,
+                key=f"{name}/{t.name}/{tokenize(t.command, t.shell)}",
+                retries=0,
+                priority=t.rank,
+                **self.monitor_kwargs(),
+                **kwargs,
+            )
+            upstream[t.name] = (fut, None)
+            manifest.append((fut, [t.name]))
+            if self.demand:
+                self.demand.add(fut.key, 1, t.cpus)
+            if speculator:
+                speculator.track(fut, t, kwargs)
+        return manifest
+
+    def record_future(
+        self, client: Client, upstream: Dict[str, Tuple[Future, Optional[int]]], name: str
+    ) -> Future:
+        """
+        A future of the record of the task ``name``. For a task that was batched, that
+        is a small task that picks its record out of the batch's.
+        """
+        fut, idx = upstream[name]
+        if idx is None:
+            return fut
+        record = client.submit(operator.getitem, fut, idx, key=f"{fut.key}/record-{name}")
+        upstream[name] = (record, None)
+        return record
+
+    def collect(self, name: str, results: Optional[Results] = None):
         client = self.get_dask_client()
-        datasets = client.get_dataset(f"srun/{name}")
-
-        futures_to_index = {}
-        queue = []
-        for idx, d in enumerate(datasets):
-            fut = client.get_dataset(d, None)
-            if fut:
-                futures_to_index[fut] = idx
-                queue.append(fut)
-
-        while queue:
-            result = wait(queue, return_when=FIRST_COMPLETED)
-            for future in result.done:
-                index = futures_to_index[future]
+        dataset_name = f"srun/{name}"
+        manifest: List[Tuple[Future, List[str]]] = client.get_dataset(dataset_name)
+        if manifest:
+            # the futures can be bound to another client in this process when the
+            # manifest is deserialized, so talk to the scheduler through theirs
+            client = manifest[0][0].client
+
+        remaining = {fut.key: (fut, task_names) for fut, task_names in manifest}
+        if self.demand:
+            self.demand.expect(manifest)
+        progress = Progress(sum(len(task_names) for _, task_names in manifest))
+        status = StatusWriter(results, interval=REPUBLISH_INTERVAL) if results else None
+        metrics = MetricsSummary()
+        last_publish = time.monotonic()
+
+        def running() -> int:
+            processing = client.processing()
+            return sum(
+                len(remaining[k][1]) for keys in processing.values() for k in keys if k in remaining
+            )
+
+        # the tasks of this run that can be speculated, if it was submitted here
+        speculator = self.speculators.pop(name, None)
+        completed = as_completed([fut for fut, _ in manifest])
+        batches: Iterable[List[Future]] = completed.batches()
+        # copies write to the results, so they need them
+        if speculator and results is not None:
+            batches = self.speculative_batches(client, completed, results, speculator)
+        for batch in batches:
+            finished = []
+            records: List[TaskRecord] = []
+            for future in batch:
+                key = speculator.original_key(future.key) if speculator else future.key
+                if key not in remaining:
+                    # the other copy of a speculated task already stands for it
+                    continue
                 if future.status == "finished":
-                    logging.info(f"finished {datasets[index]}")
+                    finished.append((key, future))
+                    continue
+                if speculator and self.other_copy_running(speculator, future):
+                    # e.g. the worker of a straggler went away, and its copy carries on
+                    continue
+                _, task_names = remaining.pop(key)
+                if speculator:
+                    speculator.forget(key)
+                logging.info(f"error {', '.join(task_names)}")
+                progress.errored(len(task_names))
+                records.extend(TaskRecord(name=n, state=ERROR) for n in task_names)
+                if self.demand:
+                    self.demand.finish(key)
+                try:
                     future.result()
-                    client.unpublish_dataset(datasets[index])
-                else:
-                    logging.info(f"error {datasets[index]}")
-                    try:
-                        future.result()
-                    except Exception:
-                        traceback.print_exc()
-                        client.unpublish_dataset(datasets[index])
-            queue = result.not_done
-
-        # if self.cluster and self.cluster.shutdown_on_close:
-        #     self.cluster.close()
+                except Exception:
+                    traceback.print_exc()
+            # one round trip for the whole batch
+            outcomes = client.gather([future for _, future in finished])
+            for (key, future), outcome in zip(finished, outcomes):
+                if speculator:
+                    if isinstance(outcome, TaskRecord) and outcome.state == SUPERSEDED:
+                        speculator.superseded.add(future.key)
+                        if self.other_copy_running(speculator, future):
+                            continue
+                        # the copy that was committed went away before it returned
+                        outcome = None
+                    self.settle(client, speculator, future)
+                _, task_names = remaining.pop(key)
+                # batches return a record per task
+                task_records = outcome if isinstance(outcome, list) else [outcome]
+                if speculator:
+                    speculator.finish(task_records)
+                if self.demand:
+                    self.demand.finish(key, task_records)
+                for task_name, record in zip(task_names, task_records):
+                    if record is None:
+                        record = TaskRecord(name=task_name, state=ERROR)
+                    if record.succeeded:
+                        logging.debug(f"finished {task_name}")
+                        progress.finished()
+                    elif record.exit_code is None:
+                        logging.info(f"error {task_name} did not run")
+                        progress.errored()
+                    else:
+                        logging.info(f"error {task_name} exited with {record.exit_code}")
+                        progress.errored()
+                    records.append(record)
+            if status:
+                status.add(records)
+            metrics.add(records)
+            progress.report(running)
+
+            # drop finished tasks from the manifest every so often, so reconnecting
+            # only tracks what is left
+            if remaining and time.monotonic() - last_publish > REPUBLISH_INTERVAL:
+                client.publish_dataset(**{dataset_name: list(remaining.values())}, override=True)
+                last_publish = time.monotonic()
+        progress.report(force=True)
+        logging.info(metrics.summary())
+        if status:
+            status.close()
+        client.unpublish_dataset(dataset_name)
+
+    def speculative_batches(
+        self, client: Client, completed: as_completed, results: Results, speculator: Speculator
+    ) -> Iterator[List[Future]]:
+        """
+        Batches of completed futures, like ``as_completed.batches``, which start copies
+        of stragglers while waiting for them
+        """
+        while not completed.is_empty():
+            if completed.has_ready():
+                yield completed.next_batch(block=False)
+                continue
+            if speculator.due():
+                self.speculate(client, completed, results, speculator)
+            time.sleep(SPECULATION_POLL_INTERVAL)
+
+    def speculate(
+        self, client: Client, completed: as_completed, results: Results, speculator: Speculator
+    ):
+        """Start a copy of every straggler, on another worker than the one it runs on"""
+        run_times = client.run(attempt_run_times, on_error="ignore")
+        workers = client.scheduler_info()["workers"]
+        for key, worker in speculator.stragglers(run_times):
+            future, task, kwargs = speculator.tasks[key]
+            eligible = [w for w in kwargs.get("workers", workers) if w != worker]
+            if not eligible:
+                continue
+            prefix = f"{task.attempt_prefix}/copy"
+            copy = replace(task, attempt_prefix=prefix)
+            logging.info(f"{task.name} is straggling on {worker}, starting a copy")
+            copy_future = client.submit(
+                execute_task,
+                results,
+                copy,
+                key=f"{future.key}/copy",
+                retries=0,
+                # behind tasks that are waiting, so copies use capacity the run has spare
+                priority=speculator.copy_priority(),
+                **self.monitor_kwargs(),
+                **{**kwargs, "workers": eligible},
+            )
+            speculator.add_copy(key, copy_future, prefix)
+            completed.add(copy_future)
+
+    def other_copy_running(self, speculator: Speculator, future: Future) -> bool:
+        """Whether another copy of the task of ``future`` may still stand for it"""
+        other = speculator.other(future.key)
+        if other is None or other[0].key in speculator.superseded:
+            return False
+        return other[0].status in ("pending", "finished")
+
+    def settle(self, client: Client, speculator: Speculator, future: Future):
+        """``future`` stands for its task, so cancel the other copy and kill its processes"""
+        other = speculator.settle(future.key)
+        if other is None:
+            return
+        other_future, prefix = other
+        if other_future.status == "pending":
+            logging.info(f"cancelling {other_future.key}, {future.key} finished first")
+            client.cancel([other_future])
+            client.run(cancel_attempts, prefix, on_error="ignore")
+
+    def register_cleanup(self, client: Client):
+        """
+        Register ``RegisterCleanup`` with the cluster, unless an earlier run did. Dask
+        tears a plugin down when another one with its name is registered, which would
+        kill the tasks of other runs on the same workers, e.g. on a warm pool.
+        """
+        if not client.run_on_scheduler(worker_plugin_registered, name=RegisterCleanup.name):
+            client.register_worker_plugin(RegisterCleanup(self.terminate_grace_period))
 
     def setup_sync_files(self):
         client = self.get_dask_client()
@@ -221,10 +903,10 @@ class DaskExecutor(Executor):
     def sync_files(self, file_syncs: List[FileSync]):
         self.setup_sync_files()
         for fs in file_syncs:
-            self.call_sync_files(fs.src, fs.dest)
+            with span("sync_files", path=fs.src):
+                self.call_sync_files(fs.src, fs.dest)
 
 
 DaskExecutor.cluster_classes["LocalCluster"] = LocalCluster
 if SaturnCluster:
     DaskExecutor.cluster_classes["SaturnCluster"] = SaturnCluster
-Executor.backends["DaskExecutor"] = DaskExecutor
@@ -0,0 +1,343 @@
+import heapq
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from os.path import exists, expanduser, join
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import psutil
+from saturn_run.executor.base import Executor
+from saturn_run.file_sync import FileSync
+from saturn_run.metrics import SAMPLE_INTERVAL
+from saturn_run.processes import (
+    MAX_SYNC_INTERVAL,
+    MIN_SYNC_INTERVAL,
+    check_sync_intervals,
+    cleanup_all_processes,
+    execute_task,
+)
+from saturn_run.progress import Progress
+from saturn_run.results.base import Results, new_execution
+from saturn_run.status import MetricsSummary, StatusWriter, TaskRecord
+from saturn_run.tasks import TaskSpec, sort_by_dependencies
+from saturn_run.tracing import span
+from saturn_run.utils import parse_bytes
+
+# task states recorded in the event log
+RUNNING = "running"
+FINISHED = "finished"
+ERROR = "error"
+
+# seconds between admission checks while the machine is busy
+ADMISSION_INTERVAL = 0.5
+# seconds between checks of the event log while collecting
+COLLECT_INTERVAL = 1
+
+
+def task_list(names: Iterable[str], limit: int = 10) -> str:
+    """Some of ``names``, for log messages about many tasks"""
+    names = sorted(names)
+    listed = ", ".join(names[:limit])
+    if len(names) > limit:
+        listed += f" and {len(names) - limit} more"
+    return listed
+
+
+class RunState:
+    """
+    On disk state of a local run.
+
+    ``run.json`` records the process that owns the run and the names of its tasks.
+    ``events.jsonl`` is an append-only log of task state changes, so recording an
+    event is O(1) and another process can follow the run by tailing it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offset = 0
+
+    @property
+    def run_path(self) -> str:
+        return join(self.path, "run.json")
+
+    @property
+    def events_path(self) -> str:
+        return join(self.path, "events.jsonl")
+
+    def create(self, task_names: List[str]):
+        os.makedirs(self.path, exist_ok=True)
+        me = psutil.Process()
+        with open(self.run_path, "w") as f:
+            json.dump({"pid": me.pid, "create_time": me.create_time(), "tasks": task_names}, f)
+        with open(self.events_path, "w"):
+            pass
+
+    def exists(self) -> bool:
+        return exists(self.run_path)
+
+    def task_names(self) -> List[str]:
+        with open(self.run_path, "r") as f:
+            return json.load(f)["tasks"]
+
+    def owner_alive(self) -> bool:
+        with open(self.run_path, "r") as f:
+            owner = json.load(f)
+        try:
+            return psutil.Process(owner["pid"]).create_time() == owner["create_time"]
+        except psutil.NoSuchProcess:
+            return False
+
+    def record(self, task: str, state: str, **kwargs):
+        event = {"task": task, "state": state, "time": time.time(), **kwargs}
+        line = json.dumps(event) + "\n"
+        with self.lock, open(self.events_path, "a") as f:
+            f.write(line)
+
+    def read_events(self) -> Iterable[Dict[str, Any]]:
+        """Yields events appended since the last call"""
+        with open(self.events_path, "r") as f:
+            f.seek(self.offset)
+            while True:
+                line = f.readline()
+                # a partially written line will be picked up next time
+                if not line.endswith("\n"):
+                    break
+                self.offset += len(line.encode("utf-8"))
+                yield json.loads(line)
+
+
+class LocalProcessExecutor(Executor):
+    """
+    Runs tasks as subprocesses of this process, without a cluster.
+
+    At most ``max_concurrency`` tasks run at once. A new task is only started while
+    the machine's CPU usage is below ``max_cpu_percent``, at least
+    ``min_available_memory`` (plus the task's own ``memory``) is available, and the
+    ``cpus`` of running tasks leave room for it, unless nothing is running.
+
+    Running tasks are synced every ``poll_interval`` seconds at first, then adaptively
+    between ``min_sync_interval`` and ``max_sync_interval`` (see ``SyncSchedule``).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_cpu_percent: Optional[float] = 90.0,
+        min_available_memory: Union[int, str] = "512MiB",
+        state_dir: str = "~/.saturn-run/runs",
+        poll_interval: int = 5,
+        sample_interval: float = SAMPLE_INTERVAL,
+        min_sync_interval: float = MIN_SYNC_INTERVAL,
+        max_sync_interval: float = MAX_SYNC_INTERVAL,
+    ):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.max_cpu_percent = max_cpu_percent
+        self.min_available_memory = parse_bytes(min_available_memory)
+        self.state_dir = expanduser(state_dir)
+        self.poll_interval = poll_interval
+        self.sample_interval = sample_interval
+        check_sync_intervals(min_sync_interval, max_sync_interval)
+        self.min_sync_interval = min_sync_interval
+        self.max_sync_interval = max_sync_interval
+        self.dispatchers: Dict[str, threading.Thread] = {}
+        self.stopped = threading.Event()
+        # cpus requested by running tasks
+        self.cpus_in_use = 0.0
+        self.cpus_lock = threading.Lock()
+
+    def run_state(self, name: str) -> RunState:
+        return RunState(join(self.state_dir, name))
+
+    def cleanup(self, prefix: str):
+        if not exists(self.state_dir):
+            return
+        for name in os.listdir(self.state_dir):
+            state = self.run_state(name)
+            if name.startswith(prefix) and state.exists() and not state.owner_alive():
+                logging.info(f"cleanup run state {state.path}")
+                shutil.rmtree(state.path)
+
+    def admit(self, task: TaskSpec) -> bool:
+        if self.cpus_in_use + (task.cpus or 0) > (os.cpu_count() or 1):
+            return False
+        if self.max_cpu_percent is not None:
+            if psutil.cpu_percent(interval=None) > self.max_cpu_percent:
+                return False
+        needed = self.min_available_memory + (task.memory or 0)
+        return psutil.virtual_memory().available >= needed
+
+    def execute(
+        self,
+        tasks: Iterable[TaskSpec],
+        results: Results,
+        name: str,
+        batch_size: Optional[int] = None,
+    ):
+        # tasks are started from a thread pool in this process, so there is no per
+        # call overhead for batch_size to amortize, and it is ignored. The run state
+        # lists every task, so streamed tasks are read in full first.
+        task_list = list(tasks)
+        with span("executor.execute", trace_id=name, tasks=len(task_list)):
+            # fail before starting anything on unknown dependencies and cycles
+            sort_by_dependencies(task_list)
+            state = self.run_state(name)
+            state.create([t.name for t in task_list])
+            submitted = time.time()
+            for t in task_list:
+                t.submitted = submitted
+                if t.retry:
+                    t.attempt_prefix = new_execution()
+            logging.info(f"executing {len(task_list)} tasks for {name}")
+            dispatcher = threading.Thread(
+                target=self.dispatch, args=(task_list, results, state), daemon=True
+            )
+            self.dispatchers[name] = dispatcher
+            dispatcher.start()
+
+    def dispatch(self, tasks: List[TaskSpec], results: Results, state: RunState):
+        # prime cpu_percent, the first call has nothing to compare against
+        psutil.cpu_percent(interval=None)
+        by_name = {t.name: t for t in tasks}
+        waiting = {t.name: len(t.depends_on) for t in tasks}
+        dependents: Dict[str, List[str]] = {}
+        for t in tasks:
+            for dep in t.depends_on:
+                dependents.setdefault(dep, []).append(t.name)
+        # tasks that can start, highest priority first, then in the order given
+        ready: List[Tuple[int, int, TaskSpec]] = []
+        order = {t.name: idx for idx, t in enumerate(tasks)}
+
+        def make_ready(task: TaskSpec):
+            heapq.heappush(ready, (-task.rank, order[task.name], task))
+
+        for t in tasks:
+            if not t.depends_on:
+                make_ready(t)
+        records: Dict[str, Optional[TaskRecord]] = {}
+        running: Dict[Future, TaskSpec] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while (ready or running) and not self.stopped.is_set():
+                if ready and (
+                    not running or (len(running) < self.max_concurrency and self.admit(ready[0][2]))
+                ):
+                    task = heapq.heappop(ready)[2]
+                    upstream = [records[dep] for dep in task.depends_on]
+                    state.record(task.name, RUNNING)
+                    with self.cpus_lock:
+                        self.cpus_in_use += task.cpus or 0
+                    running[pool.submit(self.run_task, task, results, state, upstream)] = task
+                    continue
+                done, _ = wait(running, ADMISSION_INTERVAL, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    task = running.pop(fut)
+                    records[task.name] = fut.result()
+                    # tasks whose dependencies have all finished can start
+                    for name in dependents.get(task.name, []):
+                        waiting[name] -= 1
+                        if not waiting[name]:
+                            make_ready(by_name[name])
+
+    def run_task(
+        self,
+        task: TaskSpec,
+        results: Results,
+        state: RunState,
+        upstream: List[Optional[TaskRecord]],
+    ) -> Optional[TaskRecord]:
+        record = None
+        try:
+            record = execute_task(
+                results,
+                task,
+                poll_interval=self.poll_interval,
+                upstream=upstream,
+                sample_interval=self.sample_interval,
+                min_sync_interval=self.min_sync_interval,
+                max_sync_interval=self.max_sync_interval,
+            )
+        except Exception:
+            state.record(task.name, ERROR, error=traceback.format_exc())
+        else:
+            state.record(task.name, FINISHED, exit_code=record.exit_code, record=asdict(record))
+        finally:
+            with self.cpus_lock:
+                self.cpus_in_use -= task.cpus or 0
+        return record
+
+    def collect(self, name: str, results: Optional[Results] = None):
+        state = self.run_state(name)
+        dispatcher = self.dispatchers.get(name)
+        remaining = set(state.task_names())
+        progress = Progress(len(remaining))
+        status = StatusWriter(results) if results else None
+        metrics = MetricsSummary()
+        running: Set[str] = set()
+        try:
+            while remaining:
+                # checked before reading the events, so those it recorded are counted
+                dispatching = dispatcher is None or dispatcher.is_alive()
+                records = []
+                for event in state.read_events():
+                    if event["state"] == RUNNING:
+                        running.add(event["task"])
+                        continue
+                    running.discard(event["task"])
+                    remaining.discard(event["task"])
+                    if event["state"] == FINISHED:
+                        records.append(TaskRecord(**event["record"]))
+                    else:
+                        records.append(TaskRecord(name=event["task"], state=ERROR))
+                    if records[-1].succeeded:
+                        logging.debug(f"finished {event['task']}")
+                        progress.finished()
+                    else:
+                        logging.info(f"error {event['task']}")
+                        if "error" in event:
+                            logging.error(event["error"])
+                        progress.errored()
+                if status:
+                    status.add(records)
+                metrics.add(records)
+                progress.report(lambda: len(running))
+                if not remaining:
+                    break
+                if dispatcher is None and not state.owner_alive():
+                    logging.error(
+                        f"the process running {name} has exited, "
+                        f"{len(remaining)} tasks did not finish: {task_list(remaining)}"
+                    )
+                    break
+                if not dispatching:
+                    logging.error(
+                        f"the thread running {name} has stopped, "
+                        f"{len(remaining)} tasks did not finish: {task_list(remaining)}"
+                    )
+                    break
+                time.sleep(COLLECT_INTERVAL)
+        except KeyboardInterrupt:
+            if dispatcher is not None:
+                # the tasks are our children, so they go away with us
+                self.stopped.set()
+                cleanup_all_processes()
+            raise
+        finally:
+            if status:
+                status.close()
+        progress.report(force=True)
+        logging.info(metrics.summary())
+
+    def sync_files(self, file_syncs: List[FileSync]):
+        # the tasks run on this machine, so the files are already where they need to be
+        for fs in file_syncs:
+            if fs.src != fs.dest:
+                raise NotImplementedError(
+                    f"currently, src and dest must be the same {fs.src}:{fs.dest}"
+                )
@@ -0,0 +1,164 @@
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from saturn_run.errors import ConfigError
+from saturn_run.results.base import FAILED, FINISHED, attempt_prefix
+from saturn_run.tasks import TaskSpec
+from saturn_run.utils import parse_duration
+
+# seconds between checks for stragglers
+SPECULATION_INTERVAL = 10.0
+
+
+@dataclass
+class SpeculationPolicy:
+    """
+    When a running task is a straggler: it has run ``multiplier`` times as long as it
+    is expected to, and at least ``min_seconds``. A task is expected to take its
+    ``predicted_seconds`` from the run history, or else the median duration of the
+    tasks of the run that have finished, once ``min_finished`` of them have.
+    """
+
+    multiplier: float = 2.0
+    min_seconds: float = 60.0
+    min_finished: int = 5
+    interval: float = SPECULATION_INTERVAL
+
+    @classmethod
+    def from_yaml(
+        cls,
+        multiplier: float = 2.0,
+        min_seconds: Union[str, float] = 60.0,
+        min_finished: int = 5,
+        interval: Union[str, float] = SPECULATION_INTERVAL,
+    ) -> "SpeculationPolicy":
+        if multiplier <= 1 or min_finished < 1:
+            raise ConfigError(
+                f"speculation needs multiplier > 1 and min_finished >= 1, "
+                f"got {multiplier} and {min_finished}"
+            )
+        return cls(
+            multiplier=multiplier,
+            min_seconds=parse_duration(min_seconds),
+            min_finished=min_finished,
+            interval=parse_duration(interval),
+        )
+
+    def threshold(self, predicted: Optional[float], median: Optional[float]) -> Optional[float]:
+        """Seconds after which a task is a straggler, None if there is nothing to go by"""
+        expected = predicted if predicted is not None else median
+        if expected is None:
+            return None
+        return max(self.min_seconds, self.multiplier * expected)
+
+
+class Speculator:
+    """
+    The tasks of a run that may be speculated, i.e. that run on their own with an
+    ``attempt_prefix``, and the copies started for the stragglers among them. A task gets at
+    most one copy, and whichever of the two is committed first stands for the task.
+    Futures are tracked by key.
+    """
+
+    def __init__(self, policy: SpeculationPolicy):
+        self.policy = policy
+        # key -> the future, the task it runs, and the arguments it was submitted with
+        self.tasks: Dict[str, Tuple[Any, TaskSpec, Dict[str, Any]]] = {}
+        # attempt prefix of an original future -> its key
+        self.prefixes: Dict[str, str] = {}
+        # key of an original future -> its copy and the copy's prefix, and the key of a
+        # copy -> the key of its original
+        self.copies: Dict[str, Tuple[Any, str]] = {}
+        self.originals: Dict[str, str] = {}
+        # keys of futures that returned SUPERSEDED, which can't stand for their task
+        self.superseded: Set[str] = set()
+        # seconds the tasks of the run that finished took
+        self.durations: List[float] = []
+        self.next_check = time.monotonic() + policy.interval
+
+    def track(self, future, task: TaskSpec, submit_kwargs: Dict[str, Any]):
+        self.tasks[future.key] = (future, task, submit_kwargs)
+        self.prefixes[task.attempt_prefix] = future.key  # type: ignore
+
+    def forget(self, key: str):
+        """Stop tracking the task of the original future ``key``"""
+        entry = self.tasks.pop(key, None)
+        if entry is None:
+            return
+        self.prefixes.pop(entry[1].attempt_prefix, None)  # type: ignore
+        self.superseded.discard(key)
+        copy = self.copies.pop(key, None)
+        if copy is not None:
+            self.originals.pop(copy[0].key, None)
+            self.superseded.discard(copy[0].key)
+
+    def add_copy(self, key: str, future, prefix: str):
+        self.copies[key] = (future, prefix)
+        self.originals[future.key] = key
+
+    def copy_priority(self) -> int:
+        """
+        A dask priority below that of every task still tracked, so copies only run on
+        capacity that none of the run's waiting tasks can use
+        """
+        return min((task.rank for _, task, _ in self.tasks.values()), default=0) - 1
+
+    def original_key(self, key: str) -> str:
+        """The key of the original future of a task, for either of its futures"""
+        return self.originals.get(key, key)
+
+    def other(self, key: str) -> Optional[Tuple[Any, str]]:
+        """The other future running the task of the future ``key``, and its attempt prefix"""
+        if key in self.originals:
+            future, task, _ = self.tasks[self.originals[key]]
+            return future, task.attempt_prefix  # type: ignore
+        return self.copies.get(key)
+
+    def settle(self, key: str) -> Optional[Tuple[Any, str]]:
+        """
+        The future ``key`` stands for its task. Returns the other future running the
+        task and its attempt prefix, if there is one, and stops tracking the task.
+        """
+        other = self.other(key)
+        self.forget(self.original_key(key))
+        return other
+
+    def finish(self, records: Iterable[Any]):
+        for r in records:
+            if r is None or r.state not in (FINISHED, FAILED):
+                continue
+            if r.start is not None and r.end is not None:
+                self.durations.append(r.end - r.start)
+
+    def median(self) -> Optional[float]:
+        if len(self.durations) < self.policy.min_finished:
+            return None
+        return statistics.median(self.durations)
+
+    def due(self) -> bool:
+        """Whether it is time to look for stragglers again"""
+        if not self.tasks or time.monotonic() < self.next_check:
+            return False
+        self.next_check = time.monotonic() + self.policy.interval
+        return True
+
+    def stragglers(self, run_times: Dict[str, Dict[str, float]]) -> List[Tuple[str, str]]:
+        """
+        The key and worker of the tracked tasks that run past their threshold and have
+        no copy yet, from how long the attempts on each worker have been running (see
+        ``attempt_run_times``).
+        """
+        median = self.median()
+        found = []
+        for worker, attempts in run_times.items():
+            for attempt, seconds in attempts.items():
+                key = self.prefixes.get(attempt_prefix(attempt))
+                if key is None or key in self.copies:
+                    continue
+                task = self.tasks[key][1]
+                threshold = self.policy.threshold(task.predicted_seconds, median)
+                if threshold is not None and seconds > threshold:
+                    found.append((key, worker))
+        return found
@@ -0,0 +1,191 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from os.path import expanduser, join
+from typing import Any, Dict, Iterator, Optional
+
+from saturn_run.errors import ConfigError
+
+# A warm pool is a cluster started by one saturn command in a process of its own. It
+# outlives that command, so later commands with the same cluster_class and
+# cluster_kwargs connect to it instead of starting a cluster of their own. The pool's
+# process writes the scheduler address to a state file in POOL_DIR. It closes the
+# cluster once no client has used it for idle_timeout seconds, or when the state file
+# is removed (see ``stop``).
+POOL_DIR = "~/.saturn-run/pools"
+# seconds to wait for a new pool to come up, and to connect to an existing one
+START_TIMEOUT = 300
+CONNECT_TIMEOUT = 10
+# seconds between checks of whether a pool is in use
+CHECK_INTERVAL = 10
+DEFAULT_IDLE_TIMEOUT = 3600
+
+
+def pool_key(cluster_class: str, cluster_kwargs: Optional[Dict[str, Any]]) -> str:
+    """Runs configured with the same cluster share a pool"""
+    spec = json.dumps([cluster_class, cluster_kwargs or {}], sort_keys=True, default=str)
+    return hashlib.sha1(spec.encode("utf-8")).hexdigest()[:16]
+
+
+def pool_paths(key: str) -> Dict[str, str]:
+    directory = expanduser(POOL_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return {ext: join(directory, f"{key}.{ext}") for ext in ("json", "lock", "log")}
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on ``path``, so only one command starts a given pool"""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_state(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def discover(cluster_class: str, cluster_kwargs: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The scheduler address of a running pool for this cluster, if there is one"""
+    state = read_state(pool_paths(pool_key(cluster_class, cluster_kwargs))["json"])
+    if state is None or not alive(state["pid"]):
+        return None
+    return state["address"]
+
+
+def connect(
+    cluster_class: str,
+    cluster_kwargs: Optional[Dict[str, Any]],
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+) -> str:
+    """The scheduler address of the pool for this cluster, starting the pool if needed"""
+    key = pool_key(cluster_class, cluster_kwargs)
+    paths = pool_paths(key)
+    with locked(paths["lock"]):
+        address = discover(cluster_class, cluster_kwargs)
+        if address is not None:
+            logging.info(f"using warm pool {key} at {address}")
+            return address
+        if os.path.exists(paths["json"]):
+            os.remove(paths["json"])
+
+        logging.info(f"starting warm pool {key} with {cluster_class}, logging to {paths['log']}")
+        with open(paths["log"], "a") as log:
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "saturn_run.executor.warm_pool",
+                    cluster_class,
+                    json.dumps(cluster_kwargs or {}),
+                    str(idle_timeout),
+                ],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                # not killed with this command, e.g. by ctrl-c
+                start_new_session=True,
+            )
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            state = read_state(paths["json"])
+            if state is not None:
+                return state["address"]
+            if process.poll() is not None:
+                raise ConfigError(f"warm pool {key} failed to start, see {paths['log']}")
+            time.sleep(0.5)
+        process.terminate()
+        raise ConfigError(f"warm pool {key} did not start in {START_TIMEOUT}s")
+
+
+def stop(cluster_class: str, cluster_kwargs: Optional[Dict[str, Any]]) -> bool:
+    """Ask the pool for this cluster to close its cluster. Returns whether there was one."""
+    paths = pool_paths(pool_key(cluster_class, cluster_kwargs))
+    state = read_state(paths["json"])
+    if state is None:
+        return False
+    os.remove(paths["json"])
+    if alive(state["pid"]):
+        os.kill(state["pid"], signal.SIGTERM)
+    return True
+
+
+def in_use(dask_scheduler, own: str) -> bool:
+    """
+    Whether a client other than the pool's is connected, or the scheduler has tasks.
+    The scheduler also tracks "fire-and-forget" and "published-..." clients, which
+    are not connections.
+    """
+    clients = [c for c in dask_scheduler.clients if c.startswith("Client-") and c != own]
+    return bool(clients) or bool(dask_scheduler.tasks)
+
+
+def serve(cluster_class: str, cluster_kwargs: Dict[str, Any], idle_timeout: float):
+    """Run the pool for this cluster until it is idle for ``idle_timeout`` seconds"""
+    from dask.distributed import Client
+    from saturn_run.executor.dask import DaskExecutor
+
+    paths = pool_paths(pool_key(cluster_class, cluster_kwargs))
+    if cluster_class not in DaskExecutor.cluster_classes:
+        raise ConfigError(f"unknown cluster_class {cluster_class}")
+    cluster = DaskExecutor.cluster_classes[cluster_class](**cluster_kwargs)
+    # closing the cluster on SIGTERM happens in the finally below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        with Client(cluster) as client:
+            tmp = f"{paths['json']}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump({"address": cluster.scheduler_address, "pid": os.getpid()}, f)
+            os.replace(tmp, paths["json"])
+            logging.info(f"warm pool serving {cluster.scheduler_address}")
+
+            last_used = time.monotonic()
+            while time.monotonic() - last_used < idle_timeout:
+                time.sleep(CHECK_INTERVAL)
+                state = read_state(paths["json"])
+                if state is None or state["pid"] != os.getpid():
+                    logging.info("warm pool stopped")
+                    break
+                if client.run_on_scheduler(in_use, own=client.id):
+                    last_used = time.monotonic()
+            else:
+                logging.info(f"warm pool idle for {idle_timeout}s")
+    finally:
+        state = read_state(paths["json"])
+        if state is not None and state["pid"] == os.getpid():
+            os.remove(paths["json"])
+        cluster.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    cluster_class, cluster_kwargs, idle_timeout = sys.argv[1:4]
+    serve(cluster_class, json.loads(cluster_kwargs), float(idle_timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,23 @@
+import hashlib
+import json
+import os
+import time
 from dataclasses import dataclass
-from typing import Optional
+from os.path import dirname, exists, expanduser, join, relpath
+from threading import get_ident
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# files are split into fixed size chunks, addressed by their sha256
+CHUNK_SIZE = 4 * 1024 * 1024
+# directories that are never synced
+EXCLUDE_DIRS = {".git"}
+# where workers keep chunks they have already fetched
+CACHE_DIR = os.environ.get("SATURN_RUN_CACHE_DIR", expanduser("~/.cache/saturn-run"))
+# bytes of chunks a worker keeps, the least recently used are removed first
+CACHE_MAX_BYTES = int(os.environ.get("SATURN_RUN_CACHE_MAX_BYTES", 2 * 1024**3))
+# chunks used this recently are kept whatever the size of the cache, as other workers
+# sharing it (e.g. in a LocalCluster) may be about to apply them
+CACHE_GRACE_PERIOD = 60
 
 
 @dataclass
@@ -12,3 +30,196 @@ class FileSync:
         if dest is None:
             dest = src
         return cls(src=src, dest=dest)
+
+
+def sync_root(path: str) -> str:
+    """
+    The directory files for ``path`` are synced relative to.
+
+    By convention, paths that end with '/' are directories.
+    """
+    if path.endswith("/"):
+        return path
+    return dirname(path)
+
+
+def iter_files(path: str) -> Iterable[str]:
+    """Yields the path relative to ``sync_root`` of every file that should be synced"""
+    if not path.endswith("/"):
+        yield os.path.basename(path)
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDE_DIRS)
+        for f in sorted(files):
+            yield relpath(join(root, f), path)
+
+
+def build_manifest(path: str) -> Dict[str, Any]:
+    """
+    Hash every file under ``path`` into chunks.
+
+    The manifest maps each relative path to its mode, size, and the digests of its
+    chunks. Files are rebuilt on workers by concatenating the chunks in order.
+    """
+    root = sync_root(path)
+    files: Dict[str, Dict[str, Any]] = {}
+    for rel_path in iter_files(path):
+        abs_path = join(root, rel_path)
+        digests = []
+        with open(abs_path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                digests.append(hashlib.sha256(data).hexdigest())
+        st = os.stat(abs_path)
+        files[rel_path] = {"mode": st.st_mode & 0o777, "size": st.st_size, "chunks": digests}
+    return {"path": path, "root": root, "files": files}
+
+
+def manifest_digest(manifest: Dict[str, Any]) -> str:
+    """A digest of the contents and modes of the files in ``manifest``"""
+    files = {k: [v["mode"], v["chunks"]] for k, v in manifest["files"].items()}
+    return hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def iter_chunks(manifest: Dict[str, Any], digests: Iterable[str]) -> Iterable[Tuple[str, bytes]]:
+    """Read the data for the requested chunk digests from the files in ``manifest``"""
+    wanted = set(digests)
+    root = manifest["root"]
+    for rel_path, entry in manifest["files"].items():
+        if not wanted.intersection(entry["chunks"]):
+            continue
+        with open(join(root, rel_path), "rb") as f:
+            for digest in entry["chunks"]:
+                data = f.read(CHUNK_SIZE)
+                if digest in wanted:
+                    wanted.discard(digest)
+                    yield digest, data
+
+
+class ChunkCache:
+    """
+    Content addressed chunk storage on a worker.
+
+    Chunks survive across syncs, so re-syncing a directory only needs the chunks that
+    changed. We also remember which chunks every file was last built from, so files
+    that didn't change are not rewritten, and their chunks are not needed. Chunks
+    beyond ``max_bytes`` are removed by ``prune``.
+    """
+
+    def __init__(self, path: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(join(self.path, "chunks"), exist_ok=True)
+        os.makedirs(join(self.path, "applied"), exist_ok=True)
+
+    def chunk_path(self, digest: str) -> str:
+        return join(self.path, "chunks", digest)
+
+    def missing(self, manifest: Dict[str, Any]) -> List[str]:
+        """The chunks that ``apply`` needs and the cache doesn't have"""
+        digests = {d for entry in self.stale(manifest).values() for d in entry["chunks"]}
+        return sorted(self.touch(digests))
+
+    def touch(self, digests: Iterable[str]) -> List[str]:
+        """
+        Mark chunks as used, so ``prune`` keeps them for now. Returns the digests of
+        those the cache doesn't have.
+        """
+        now = time.time()
+        absent = []
+        for digest in digests:
+            try:
+                os.utime(self.chunk_path(digest), (now, now))
+            except FileNotFoundError:
+                absent.append(digest)
+        return absent
+
+    def put(self, digest: str, data: bytes):
+        tmp_path = f"{self.chunk_path(digest)}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.chunk_path(digest))
+
+    def applied_path(self, manifest: Dict[str, Any]) -> str:
+        key = hashlib.sha256(manifest["path"].encode("utf-8")).hexdigest()
+        return join(self.path, "applied", f"{key}.json")
+
+    def stale(self, manifest: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """The entries of ``manifest`` whose files were not last written from its chunks"""
+        applied_path = self.applied_path(manifest)
+        applied: Dict[str, List[str]] = {}
+        if exists(applied_path):
+            with open(applied_path, "r") as f:
+                applied = json.load(f)
+        stale = {}
+        for rel_path, entry in manifest["files"].items():
+            abs_path = join(manifest["root"], rel_path)
+            if (
+                applied.get(rel_path) != entry["chunks"]
+                or not exists(abs_path)
+                or os.path.getsize(abs_path) != entry["size"]
+            ):
+                stale[rel_path] = entry
+        return stale
+
+    def apply(self, manifest: Dict[str, Any]) -> List[str]:
+        """
+        Write the files in ``manifest`` from cached chunks. Returns the relative paths
+        that were written.
+        """
+        dest = manifest["root"]
+        applied_path = self.applied_path(manifest)
+        written = []
+        for rel_path, entry in self.stale(manifest).items():
+            abs_path = join(dest, rel_path)
+            os.makedirs(dirname(abs_path), exist_ok=True)
+            tmp_path = f"{abs_path}.{os.getpid()}.{get_ident()}.tmp"
+            with open(tmp_path, "wb") as out:
+                for digest in entry["chunks"]:
+                    with open(self.chunk_path(digest), "rb") as f:
+                        out.write(f.read())
+            os.chmod(tmp_path, entry["mode"])
+            os.replace(tmp_path, abs_path)
+            written.append(rel_path)
+        # chunks of files that didn't change are used too
+        self.touch({d for entry in manifest["files"].values() for d in entry["chunks"]})
+
+        # workers sharing the cache (e.g. a LocalCluster) apply at the same time, and
+        # must never read a half written file
+        tmp_path = f"{applied_path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({k: v["chunks"] for k, v in manifest["files"].items()}, f)
+        os.replace(tmp_path, applied_path)
+        return written
+
+    def prune(self) -> int:
+        """
+        Remove the least recently used chunks until the rest fit in ``max_bytes``,
+        keeping those used in the last ``CACHE_GRACE_PERIOD`` seconds. Returns the
+        number of chunks removed.
+        """
+        chunks = []
+        for entry in os.scandir(join(self.path, "chunks")):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            chunks.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in chunks)
+        cutoff = time.time() - CACHE_GRACE_PERIOD
+        removed = 0
+        for mtime, size, path in sorted(chunks):
+            if total <= self.max_bytes or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another worker sharing the cache removed it first
+                pass
+            total -= size
+            removed += 1
+        return removed
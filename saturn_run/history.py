@@ -0,0 +1,118 @@
+import math
+import os
+import sqlite3
+import time
+from os.path import expanduser
+from typing import Iterable, Iterator, Optional
+
+from saturn_run.results.base import FAILED, FINISHED
+from saturn_run.status import TaskRecord
+from saturn_run.tasks import PREDICTED_PRIORITIES, TaskSpec
+
+DEFAULT_HISTORY_PATH = "~/.saturn-run/history.db"
+# weight of the latest duration of a task in its moving average
+HISTORY_WEIGHT = 0.5
+# priorities from predicted durations go up by one every time the duration doubles, so
+# tasks of similar length share a priority, and can be batched together
+PRIORITY_STEPS = 1
+
+
+def duration_priority(seconds: float) -> int:
+    """
+    The ``predicted_priority`` of a task that is predicted to take ``seconds``, longest
+    first, up to ``PREDICTED_PRIORITIES``
+    """
+    steps = int(round(PRIORITY_STEPS * math.log2(1 + max(0.0, seconds))))
+    return min(steps, PREDICTED_PRIORITIES - 1)
+
+
+class RunHistory:
+    """
+    A SQLite file of how long tasks took, kept across runs. Tasks are recognized by
+    their name and ``command_token``, so a task's history starts over when its command
+    changes.
+
+    Durations predict how long the tasks of the next run will take, so the longest can
+    be started first (longest processing time first). That keeps a few long tasks
+    at the end of a task list from setting how long the whole run takes.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS durations ("
+            "name TEXT NOT NULL, command_token TEXT NOT NULL, runs INTEGER NOT NULL, "
+            "seconds REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (name, command_token))"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS durations_command ON durations (command_token)"
+        )
+        self.conn.commit()
+        self._default: Optional[float] = None
+
+    def add(self, records: Iterable[TaskRecord]):
+        """Record the durations of tasks that ran, i.e. were not cached or skipped"""
+        rows = [
+            (r.name, r.command_token, r.end - r.start, time.time())
+            for r in records
+            if r.state in (FINISHED, FAILED)
+            and r.command_token
+            and r.start is not None
+            and r.end is not None
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO durations (name, command_token, runs, seconds, updated) "
+                "VALUES (?, ?, 1, ?, ?) ON CONFLICT (name, command_token) DO UPDATE SET "
+                f"seconds = seconds + {HISTORY_WEIGHT} * (excluded.seconds - seconds), "
+                "runs = runs + 1, updated = excluded.updated",
+                rows,
+            )
+        self._default = None
+
+    def predict(self, task: TaskSpec) -> Optional[float]:
+        """
+        Seconds ``task`` is expected to take: how long it took before, else how long its
+        command took under another name, else how long the task took with another
+        command. None if there is no history of it.
+        """
+        token = task.command_token
+        for query, params in (
+            (
+                "SELECT seconds FROM durations WHERE name = ? AND command_token = ?",
+                (task.name, token),
+            ),
+            ("SELECT AVG(seconds) FROM durations WHERE command_token = ?", (token,)),
+            ("SELECT AVG(seconds) FROM durations WHERE name = ?", (task.name,)),
+        ):
+            row = self.conn.execute(query, params).fetchone()
+            if row is not None and row[0] is not None:
+                return row[0]
+        return None
+
+    def default(self) -> Optional[float]:
+        """The average duration in the history, assumed for tasks without one"""
+        if self._default is None:
+            self._default = self.conn.execute("SELECT AVG(seconds) FROM durations").fetchone()[0]
+        return self._default
+
+    def prioritize(self, tasks: Iterable[TaskSpec]) -> Iterator[TaskSpec]:
+        """
+        Set the ``predicted_seconds`` and ``predicted_priority`` of tasks, yielding them
+        as they go. Tasks without history are treated as average ones, so they are
+        neither held back nor put ahead of known long tasks. A task's own ``priority``
+        still comes first, so predictions only order tasks of the same priority.
+        """
+        for task in tasks:
+            seconds = self.predict(task)
+            task.predicted_seconds = seconds
+            if seconds is None:
+                seconds = self.default()
+            if seconds is not None:
+                task.predicted_priority = duration_priority(seconds)
+            yield task
+
+    def close(self):
+        self.conn.close()
@@ -1,10 +1,15 @@
 import logging
-
-from distributed.client import get_worker
-from distributed.worker import logger as dask_logger
+import sys
 
 
 def logger():
+    # if distributed was never imported, we can't be running on a dask worker
+    if "distributed" not in sys.modules:
+        return logging
+
+    from distributed.client import get_worker
+    from distributed.worker import logger as dask_logger
+
     try:
         get_worker()
         return dask_logger
@@ -0,0 +1,119 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import psutil
+
+# default seconds between samples of a task's process tree
+SAMPLE_INTERVAL = 1.0
+
+
+@dataclass
+class TaskMetrics:
+    """
+    Timing and resource usage of a task, saved as ``metrics.json`` next to its status.
+
+    CPU, memory, I/O and threads are sampled from the task's process tree every
+    ``sample_interval`` seconds, so tasks that exit between samples are undercounted.
+    """
+
+    name: str
+    worker: str
+    sample_interval: float = SAMPLE_INTERVAL
+    # unix times the task was submitted, its process started, and its process exited
+    submitted: Optional[float] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
+    exit_code: Optional[int] = None
+    samples: int = 0
+    cpu_user_seconds: float = 0.0
+    cpu_system_seconds: float = 0.0
+    # RSS of the whole tree at the last sample, and the highest seen
+    rss_bytes: int = 0
+    peak_rss_bytes: Optional[int] = None
+    read_bytes: int = 0
+    write_bytes: int = 0
+    peak_threads: int = 0
+    # syncs while the task ran, and the final sync, status and upload once it exited
+    syncs: int = 0
+    sync_seconds: float = 0.0
+    finish_seconds: float = 0.0
+    bytes_written: int = 0
+
+    @property
+    def queue_seconds(self) -> Optional[float]:
+        if self.submitted is None or self.start is None:
+            return None
+        return max(0.0, self.start - self.submitted)
+
+    @property
+    def run_seconds(self) -> Optional[float]:
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def cpu_seconds(self) -> float:
+        return self.cpu_user_seconds + self.cpu_system_seconds
+
+    def to_json(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["queue_seconds"] = self.queue_seconds
+        data["run_seconds"] = self.run_seconds
+        return data
+
+
+class ProcessMonitor:
+    """Samples the process tree of a task into its ``TaskMetrics``"""
+
+    def __init__(self, pid: int, metrics: TaskMetrics):
+        self.metrics = metrics
+        # I/O of every process we have seen, since they don't add up in their parents
+        self.io: Dict[int, Tuple[int, int]] = {}
+        try:
+            self.process: Optional[psutil.Process] = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            self.process = None
+
+    def sample(self):
+        if self.process is None:
+            return
+        try:
+            tree = [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        threads = 0
+        user = 0.0
+        system = 0.0
+        for proc in tree:
+            try:
+                with proc.oneshot():
+                    rss += proc.memory_info().rss
+                    threads += proc.num_threads()
+                    # the times of children that were waited on are included in
+                    # their parent's children_* times, so nothing is counted twice
+                    times = proc.cpu_times()
+                    user += times.user + times.children_user
+                    system += times.system + times.children_system
+                    try:
+                        io = proc.io_counters()
+                        self.io[proc.pid] = (io.read_bytes, io.write_bytes)
+                    except (psutil.AccessDenied, AttributeError):
+                        # not available on every platform
+                        pass
+            except psutil.Error:
+                # processes come and go while we look at them
+                continue
+        if not rss:
+            # the task has exited, but has not been waited on yet
+            return
+        m = self.metrics
+        m.samples += 1
+        m.rss_bytes = rss
+        m.peak_rss_bytes = max(m.peak_rss_bytes or 0, rss)
+        m.peak_threads = max(m.peak_threads, threads)
+        # processes that exited since the last sample take their times with them
+        m.cpu_user_seconds = max(m.cpu_user_seconds, user)
+        m.cpu_system_seconds = max(m.cpu_system_seconds, system)
+        m.read_bytes = sum(r for r, _ in self.io.values())
+        m.write_bytes = sum(w for _, w in self.io.values())
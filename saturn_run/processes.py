@@ -1,16 +1,90 @@
+import asyncio
+import contextvars
 import os
+import re
+import select
+import signal
+import socket
 import subprocess
-from typing import List, Set, Union
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import psutil
+from saturn_run.errors import ConfigError
 from saturn_run.logging import logger
-from saturn_run.results.base import Results
+from saturn_run.metrics import SAMPLE_INTERVAL, ProcessMonitor, TaskMetrics
+from saturn_run.resources import ResourceLimits
+from saturn_run.results.base import (
+    Results,
+    ResultsTaskContext,
+    attempt_id,
+    attempt_prefix,
+)
+from saturn_run.status import CACHED, ERROR, SUPERSEDED, UPSTREAM_FAILED, TaskRecord
+from saturn_run.tasks import RetryPolicy, TaskSpec
+from saturn_run.tracing import record_span, span
 
 running_pids: Set[int] = set()
+# attempt -> (pid, unix start time) of the attempts running in this process, and the
+# attempts that were cancelled while running, see ``cancel_attempts``
+running_attempts: Dict[str, Tuple[int, float]] = {}
+cancelled_attempts: Set[str] = set()
+# set once this process is stopping, e.g. because its worker is being preempted. The
+# running tasks were sent SIGTERM, and no new ones start (see ``terminate_all_processes``)
+terminating = threading.Event()
+
+# how much we read from a child's pipe at a time
+CHUNK_SIZE = 64 * 1024
+# seconds between checks of whether an output pump should stop
+PUMP_WAKE_INTERVAL = 0.5
+# seconds a stopping asyncio pump waits for more output before it gives up
+PUMP_DRAIN_TIMEOUT = 0.01
+# default bounds, in seconds, on the time between syncs of a running task
+MIN_SYNC_INTERVAL = 1.0
+MAX_SYNC_INTERVAL = 60.0
+# the next sync is at least this many times as far off as the last sync took, so that
+# slow syncs (e.g. a congested connection to S3) take at most ~10% of the time
+SYNC_COST_FACTOR = 10
+# seconds tasks get to exit and have their output synced after SIGTERM, before they
+# are killed
+TERMINATE_GRACE_PERIOD = 30.0
+
+
+class ActiveTasks:
+    """Counts the tasks being supervised in this process, including their final sync"""
+
+    def __init__(self):
+        self.count = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def supervising(self) -> Iterator[None]:
+        with self.condition:
+            self.count += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.count -= 1
+                self.condition.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for every task to be done. Returns whether they are."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count == 0, timeout)
+
+
+active_tasks = ActiveTasks()
 
 
 def cleanup_all_processes(*args, **kargs):  # pylint:disable=unused-argument
-    for pid in running_pids:
+    # tasks can start and stop on other threads while we're cleaning up
+    for pid in list(running_pids):
         cleanup(pid)
 
 
@@ -41,31 +115,903 @@ def cleanup(pid: int):
             pass
 
 
-def execute(
-    results: Results, name: str, cmd: Union[List, str], shell: bool = False, poll_interval: int = 5
-) -> None:
+def terminate(pid: int):
+    """Send SIGTERM to a child and its descendants"""
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return
+    for proc in processes:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+
+def terminate_all_processes(grace_period: float = TERMINATE_GRACE_PERIOD):
+    """
+    Stop the tasks running in this process, e.g. because its worker is being preempted.
+    Their children get SIGTERM, so tasks that checkpoint to ``RESULTS_DIR`` can save
+    their progress, and ``grace_period`` seconds to exit and have their output synced.
+    Whatever is still running after that is killed.
+    """
+    if not terminating.is_set():
+        terminating.set()
+        for pid in list(running_pids):
+            terminate(pid)
+    if not active_tasks.wait_idle(grace_period):
+        logger().warning(f"tasks still running {grace_period}s after SIGTERM, killing them")
+    cleanup_all_processes()
+
+
+def forward_sigterm(grace_period: float = TERMINATE_GRACE_PERIOD) -> bool:
+    """
+    Have SIGTERM to this process stop its tasks with ``terminate_all_processes`` before
+    the signal's previous handler runs. Signal handlers can only be set from the main
+    thread, so this returns False elsewhere.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGTERM)
+    if getattr(previous, "forwards_sigterm", False):
+        return True
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def stop(signum):
+        terminate_all_processes(grace_period)
+        stopped.set()
+        # the previous handler takes it from here
+        os.kill(os.getpid(), signum)
+
+    def handle(signum, frame):
+        if stopped.is_set():
+            signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                os.kill(os.getpid(), signum)
+        elif not started.is_set():
+            # stopping can take the whole grace period, which must not block the main thread
+            started.set()
+            threading.Thread(target=stop, args=(signum,), daemon=True).start()
+
+    handle.forwards_sigterm = True  # type: ignore
+    signal.signal(signal.SIGTERM, handle)
+    return True
+
+
+def reschedule():
+    """Hand the task being run back to the dask scheduler, to run on another worker"""
+    from distributed import Reschedule  # pylint:disable=import-outside-toplevel
+
+    raise Reschedule()
+
+
+def is_reschedule(error: BaseException) -> bool:
+    """Whether ``error`` hands a task back to the dask scheduler, see ``reschedule``"""
+    # distributed is only imported where it runs the task
+    distributed = sys.modules.get("distributed")
+    return distributed is not None and isinstance(error, distributed.Reschedule)
+
+
+def attempt_run_times() -> Dict[str, float]:
+    """Seconds every attempt running in this process has been running for"""
+    now = time.time()
+    return {attempt: now - start for attempt, (_, start) in list(running_attempts.items())}
+
+
+def cancel_attempts(prefix: str) -> bool:
+    """
+    Kill the process tree of the attempt running under ``prefix``, e.g. because another
+    attempt of its task was committed first. Returns whether one was running in this
+    process.
+    """
+    cancelled = False
+    for attempt, (pid, _) in list(running_attempts.items()):
+        if attempt_prefix(attempt) != prefix:
+            continue
+        cancelled_attempts.add(attempt)
+        cleanup(pid)
+        try:
+            psutil.Process(pid).kill()
+        except psutil.NoSuchProcess:
+            pass
+        cancelled = True
+    return cancelled
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def timed_sync(context: ResultsTaskContext, metrics: TaskMetrics) -> float:
+    """Sync the task's output, and return how long it took"""
+    logger().info("sync")
+    start = time.monotonic()
+    with span("sync", task=context.name):
+        context.sync()
+    elapsed = time.monotonic() - start
+    metrics.syncs += 1
+    metrics.sync_seconds += elapsed
+    return elapsed
+
+
+def task_record(
+    metrics: TaskMetrics,
+    key: Optional[str] = None,
+    command_token: Optional[str] = None,
+    committed: bool = True,
+) -> TaskRecord:
+    kwargs = dict(
+        key=key,
+        command_token=command_token,
+        start=metrics.start,
+        end=metrics.end,
+        worker=metrics.worker,
+        bytes_written=metrics.bytes_written,
+        peak_rss=metrics.peak_rss_bytes,
+        queue_seconds=metrics.queue_seconds,
+        cpu_seconds=metrics.cpu_seconds,
+        sync_seconds=metrics.sync_seconds + metrics.finish_seconds,
+    )
+    if not committed:
+        # the task's outputs and status are those of another attempt
+        return TaskRecord(name=metrics.name, state=SUPERSEDED, **kwargs)  # type: ignore
+    return TaskRecord.from_exit_code(metrics.name, metrics.exit_code, **kwargs)  # type: ignore
+
+
+def output_size(context: ResultsTaskContext) -> int:
+    """Bytes of stdout, stderr and results a task has written"""
+    paths = [context.stdout_path, context.stderr_path]
+    for root, _, files in os.walk(context.results_dir):
+        paths.extend(os.path.join(root, f) for f in files)
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+
+def check_sync_intervals(min_interval: float, max_interval: float):
+    if min_interval <= 0 or max_interval < min_interval:
+        raise ConfigError(
+            f"sync intervals must satisfy 0 < min_sync_interval <= max_sync_interval, "
+            f"got {min_interval} and {max_interval}"
+        )
+
+
+class SyncSchedule:
+    """
+    Decides when the output of a running task is synced.
+
+    The interval starts at ``poll_interval``. It doubles every time there was nothing
+    new to sync, and halves every time there was, within ``min_interval`` and
+    ``max_interval``. It is also never less than ``SYNC_COST_FACTOR`` times the last
+    sync took.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = 5,
+        min_interval: float = MIN_SYNC_INTERVAL,
+        max_interval: float = MAX_SYNC_INTERVAL,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(poll_interval, self.min_interval), self.max_interval)
+        self.next_sync = time.monotonic() + self.interval
+        # (size, mtime) of every results file when we last looked
+        self.files: Dict[str, Tuple[int, int]] = {}
+
+    def timeout(self) -> float:
+        """Seconds until the next sync is due"""
+        return max(0.0, self.next_sync - time.monotonic())
+
+    def due(self) -> bool:
+        return time.monotonic() >= self.next_sync
+
+    def results_changed(self, context: ResultsTaskContext) -> bool:
+        """Whether files in the task's results directory were added or changed since last time"""
+        files = {}
+        for root, _, names in os.walk(context.results_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+        changed = files != self.files
+        self.files = files
+        return changed
+
+    def synced(self, seconds: float):
+        """There was new output, and syncing it took ``seconds``"""
+        interval = max(self.interval / 2, self.min_interval, seconds * SYNC_COST_FACTOR)
+        self.interval = min(interval, self.max_interval)
+        self.next_sync = time.monotonic() + self.interval
+
+    def skipped(self):
+        """There was nothing new to sync"""
+        self.interval = min(self.interval * 2, self.max_interval)
+        self.next_sync = time.monotonic() + self.interval
+
 
-    context = results.make_task_context(name)
-    print(context)
-    stdout = open(context.stdout_path, "w+")
-    stderr = open(context.stderr_path, "w+")
+class OutputPump(threading.Thread):
+    """
+    Copies a pipe from a child process into a local file as bytes arrive, and sets
+    ``changed`` so the monitor loop knows there is new output to sync.
+    """
+
+    def __init__(self, pipe: IO[bytes], path: str, changed: threading.Event):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.path = path
+        self.changed = changed
+        self.bytes_written = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        fd = self.pipe.fileno()
+        with self.pipe, open(self.path, "wb") as f:
+            while True:
+                # once stopping, only what can be read right away is copied
+                timeout = 0 if self.stopping.is_set() else PUMP_WAKE_INTERVAL
+                if not select.select([fd], [], [], timeout)[0]:
+                    if self.stopping.is_set():
+                        break
+                    continue
+                # read from the fd itself, so nothing is left in a buffer select can't see
+                chunk = os.read(fd, CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                f.flush()
+                self.bytes_written += len(chunk)
+                self.changed.set()
+
+    def stop(self):
+        """
+        Copy what has been written so far, and let go of the pipe, e.g. because a
+        grandchild that outlives the task holds it open
+        """
+        self.stopping.set()
+        self.join()
+
+
+def finish_pumps(pumps: List[OutputPump], timeout: float):
+    """
+    Wait up to ``timeout`` seconds for the pumps to reach the end of their pipes, then
+    stop them, so the final sync has all the output that was written, and the pumps
+    are done with the task's files before they are removed
+    """
+    deadline = time.monotonic() + timeout
+    for pump in pumps:
+        pump.join(max(0.0, deadline - time.monotonic()))
+    for pump in pumps:
+        if pump.is_alive():
+            pump.stop()
+
+
+def open_task_context(
+    results: Results, name: str, attempt: Optional[str] = None, resume: Sequence[str] = ()
+) -> ResultsTaskContext:
+    """
+    The context the task ``name`` runs in, with the results of the latest of the earlier
+    attempts in ``resume`` (newest first) that has any copied into ``RESULTS_DIR``
+    """
+    context = results.make_task_context(name, attempt)
+    for earlier in resume:
+        with span("resume", task=name):
+            restored = context.resume_from(earlier)
+        if restored:
+            logger().info(f"resuming {name} from {restored} results files of {earlier}")
+            break
+    return context
+
+
+def task_env(context: ResultsTaskContext, extra_env: Optional[Dict[str, str]]) -> Dict[str, str]:
     env = os.environ.copy()
+    env.update(extra_env or {})
     env["RESULTS_DIR"] = context.results_dir
-    proc = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, shell=shell, env=env)
+    return env
+
+
+def finish_task(
+    context: ResultsTaskContext,
+    metrics: TaskMetrics,
+    exit_code: int,
+    attempt: Optional[str] = None,
+    commit: bool = True,
+) -> bool:
+    """
+    ``complete`` a task that exited with ``exit_code``, or drop its output if its
+    ``attempt`` was cancelled. Returns False if the output doesn't stand for the task.
+    """
+    metrics.exit_code = exit_code
+    if attempt is not None and attempt in cancelled_attempts:
+        cancelled_attempts.discard(attempt)
+        context.discard()
+        context.cleanup()
+        return False
+    metrics.bytes_written = output_size(context)
+    return complete(context, exit_code, metrics, commit)
+
 
-    with stdout as stdout, stderr as stderr, proc as proc:
-        running_pids.add(proc.pid)
+def execute(
+    results: Results,
+    name: str,
+    cmd: Union[List, str],
+    shell: bool = False,
+    poll_interval: int = 5,
+    cpus: Optional[float] = None,
+    memory: Optional[int] = None,
+    extra_env: Optional[Dict[str, str]] = None,
+    key: Optional[str] = None,
+    command_token: Optional[str] = None,
+    submitted: Optional[float] = None,
+    sample_interval: float = SAMPLE_INTERVAL,
+    min_sync_interval: float = MIN_SYNC_INTERVAL,
+    max_sync_interval: float = MAX_SYNC_INTERVAL,
+    attempt: Optional[str] = None,
+    resume: Sequence[str] = (),
+    commit: bool = True,
+) -> TaskRecord:
+    """
+    Run ``cmd`` for the task ``name``, syncing its output to ``results`` while it runs.
+    Syncs start ``poll_interval`` seconds apart, and adapt to how often there is new
+    output between ``min_sync_interval`` and ``max_sync_interval`` (see ``SyncSchedule``).
+    The process tree is sampled every ``sample_interval`` seconds for ``metrics.json``.
+    Returns a record with the exit code and what the task used.
+
+    With an ``attempt``, the output is written under the attempt's prefix and committed
+    when the task exits, unless ``commit`` is False. If another attempt was committed
+    first, or the attempt is cancelled with ``cancel_attempts``, its output is dropped
+    and the record is ``SUPERSEDED``. The results of the latest of the earlier attempts
+    in ``resume`` (newest first) that has any are copied into ``RESULTS_DIR`` first.
+    """
+
+    metrics = TaskMetrics(name, worker_id(), sample_interval, submitted=submitted)
+    with active_tasks.supervising(), span(
+        "task", trace_id=results.name, task=name, worker=metrics.worker
+    ):
+        context = open_task_context(results, name, attempt, resume)
+        env = task_env(context, extra_env)
+        limits = ResourceLimits(cpus=cpus, memory=memory)
+        try:
+            with span("spawn", task=name):
+                proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    shell=shell,
+                    env=env,
+                    preexec_fn=limits.prepare(),
+                )
+            # the pumps own the pipes, so the Popen context manager is not used here
+            running_pids.add(proc.pid)
+            pumps: List[OutputPump] = []
+            try:
+                metrics.start = time.time()
+                if attempt is not None:
+                    running_attempts[attempt] = (proc.pid, metrics.start)
+                changed = threading.Event()
+                pumps = [
+                    OutputPump(proc.stdout, context.stdout_path, changed),  # type: ignore
+                    OutputPump(proc.stderr, context.stderr_path, changed),  # type: ignore
+                ]
+                for pump in pumps:
+                    pump.start()
+
+                monitor = ProcessMonitor(proc.pid, metrics)
+                schedule = SyncSchedule(poll_interval, min_sync_interval, max_sync_interval)
+                while True:
+                    monitor.sample()
+                    try:
+                        exit_code = proc.wait(min(schedule.timeout(), sample_interval))
+                    except subprocess.TimeoutExpired:
+                        if not schedule.due():
+                            continue
+                        # only sync when the child has written something since the last sync
+                        if changed.is_set() or schedule.results_changed(context):
+                            changed.clear()
+                            schedule.synced(timed_sync(context, metrics))
+                        else:
+                            schedule.skipped()
+                    else:
+                        metrics.end = time.time()
+                        # grandchildren can hold the pipes open after the child exits,
+                        # so don't wait on them forever
+                        finish_pumps(pumps, poll_interval)
+                        break
+            except BaseException:
+                # don't leave the task running, or its pumps writing, when supervising it fails
+                cleanup(proc.pid)
+                proc.kill()
+                proc.wait()
+                finish_pumps(pumps, poll_interval)
+                raise
+            finally:
+                running_pids.discard(proc.pid)
+                if attempt is not None:
+                    running_attempts.pop(attempt, None)
+        finally:
+            limits.release()
+        record_span("run", metrics.start, metrics.end, task=name)
+        committed = finish_task(context, metrics, exit_code, attempt, commit)
+    if submitted is not None:
+        record_span("queue", submitted, metrics.start, trace_id=results.name, task=name)
+    return task_record(metrics, key, command_token, committed)
+
+
+def complete(
+    context: ResultsTaskContext,
+    exit_code: int,
+    metrics: Optional[TaskMetrics] = None,
+    commit: bool = True,
+) -> bool:
+    """
+    Final sync, status, and results upload for a task that has exited, followed by its
+    ``metrics`` if there are any. Then the context is committed, unless ``commit`` is
+    False, and its output is dropped if another attempt was committed first. Returns
+    False if it was.
+    """
+    logger().info("sync")
+    start = time.monotonic()
+    with span("sync", task=context.name):
+        context.sync()
+    with span("set_status", task=context.name):
+        context.set_status(str(exit_code))
+    with span("finish", task=context.name):
+        context.finish()
+    if metrics is not None:
+        metrics.finish_seconds = time.monotonic() - start
+        with span("save_metrics", task=context.name):
+            context.save_metrics(metrics.to_json())
+    committed = not commit or commit_context(context)
+    context.cleanup()
+    return committed
+
+
+def commit_context(context: ResultsTaskContext) -> bool:
+    """Commit an attempt, dropping its output if another one was committed first"""
+    with span("commit", task=context.name):
+        committed = context.commit()
+        if not committed:
+            logger().info(f"another attempt of {context.name} was committed first")
+            context.discard()
+    return committed
+
+
+def upstream_env(results: Results, task: TaskSpec) -> Dict[str, str]:
+    """
+    ``UPSTREAM_RESULTS_DIR_<NAME>`` for every task ``task`` depends on, pointing at
+    its results. Characters that can't be used in variable names become ``_``.
+    """
+    return {
+        f"UPSTREAM_RESULTS_DIR_{re.sub(r'[^0-9a-zA-Z]', '_', dep).upper()}": (
+            results.task_results_url(dep)
+        )
+        for dep in task.depends_on
+    }
+
+
+def restore_from_cache(results: Results, task: TaskSpec) -> Optional[TaskRecord]:
+    """Restore the results of ``task`` from the cache, if it has succeeded before"""
+    if not task.cache_key or not results.skip_cached:
+        return None
+    start = time.time()
+    with span("restore_cached", trace_id=results.name, task=task.name):
+        restored = results.restore_cached(task.name, task.cache_key)
+    if not restored:
+        return None
+    logger().info(f"skipping {task.name}, restored from cache {task.cache_key}")
+    return TaskRecord(
+        name=task.name,
+        state=CACHED,
+        exit_code=0,
+        key=task.cache_key,
+        command_token=task.command_token,
+        start=start,
+        end=time.time(),
+        worker=worker_id(),
+    )
+
+
+def save_to_cache(results: Results, task: TaskSpec, record: TaskRecord):
+    if not task.cache_key or not record.succeeded:
+        return
+    try:
+        results.store_cached(task.name, task.cache_key)
+    except Exception:
+        # the task itself succeeded, so this isn't worth failing it over
+        logger().warning(f"could not cache {task.name}\n{traceback.format_exc()}")
+
+
+def execute_task(
+    results: Results,
+    task: TaskSpec,
+    poll_interval: int = 5,
+    upstream: Optional[List[Optional[TaskRecord]]] = None,
+    sample_interval: float = SAMPLE_INTERVAL,
+    min_sync_interval: float = MIN_SYNC_INTERVAL,
+    max_sync_interval: float = MAX_SYNC_INTERVAL,
+) -> TaskRecord:
+    """
+    Run a ``TaskSpec`` with ``execute``.
+
+    ``upstream`` holds the records of the tasks ``task`` depends on. If any of them
+    failed, the task is not run and its status is set to ``UPSTREAM_FAILED``.
+
+    Tasks with a ``cache_key`` are restored from the results cache instead of running
+    if they have succeeded before, and are cached when they succeed.
+
+    Tasks with an ``attempt_prefix`` run as attempts, see ``run_attempts``. Tasks that
+    would start in a process that is stopping are handed back to the dask scheduler.
+    """
+    if terminating.is_set():
+        reschedule()
+    if upstream and any(r is None or not r.succeeded for r in upstream):
+        context = results.make_task_context(task.name)
+        with span("set_status", trace_id=results.name, task=task.name):
+            context.set_status(UPSTREAM_FAILED)
+        context.cleanup()
+        logger().info(f"skipping {task.name}, an upstream task failed")
+        return TaskRecord(
+            name=task.name,
+            state=UPSTREAM_FAILED,
+            key=task.cache_key,
+            command_token=task.command_token,
+        )
+    cached = restore_from_cache(results, task)
+    if cached:
+        return cached
+    kwargs = dict(
+        poll_interval=poll_interval,
+        cpus=task.cpus,
+        memory=task.memory,
+        extra_env=upstream_env(results, task),
+        key=task.cache_key,
+        command_token=task.command_token,
+        submitted=task.submitted,
+        sample_interval=sample_interval,
+        min_sync_interval=min_sync_interval,
+        max_sync_interval=max_sync_interval,
+    )
+    if task.attempt_prefix is None:
+        record = execute(results, task.name, task.command, task.shell, **kwargs)  # type: ignore
+    else:
+        record = run_attempts(results, task, **kwargs)
+    save_to_cache(results, task, record)
+    return record
+
+
+def claim_next_attempt(results: Results, name: str, prefix: str, number: int) -> int:
+    """Claim the first attempt of the task ``name`` from ``number`` on that is free"""
+    while not results.claim_attempt(name, attempt_id(prefix, number)):
+        number += 1
+    return number
+
+
+def run_attempts(results: Results, task: TaskSpec, **kwargs) -> TaskRecord:
+    """
+    Run ``task`` as numbered attempts under its ``attempt_prefix``, until one succeeds
+    or its ``retry`` policy says to stop, and commit that attempt. Attempts that came
+    before the one being run, in this call or in calls lost with their worker, are
+    left under their prefixes, and the newest of them with results is resumed from.
+
+    If the process starts stopping while an attempt runs, and the task is retried on
+    worker loss, the attempt's output is left for the next one and the task is handed
+    back to the dask scheduler. Tasks without a ``retry`` policy are run once per
+    call, and again whenever their worker goes away, like any other dask task.
+    """
+    retry = task.retry or RetryPolicy()
+    prefix: str = task.attempt_prefix  # type: ignore
+    number = claim_next_attempt(results, task.name, prefix, 0)
+    if (
+        number
+        and task.retry is not None
+        and (not retry.worker_lost or number >= retry.max_attempts)
+    ):
+        # the attempts before this call never finished, so their workers went away
+        logger().info(f"not retrying {task.name}, its worker went away after {number} attempts")
+        context = results.make_task_context(task.name, attempt_id(prefix, number))
+        context.set_status(ERROR)
+        committed = commit_context(context)
+        context.cleanup()
+        return TaskRecord(
+            name=task.name,
+            state=ERROR if committed else SUPERSEDED,
+            key=task.cache_key,
+            command_token=task.command_token,
+        )
+    while True:
+        attempt = attempt_id(prefix, number)
+        record = execute(
+            results,
+            task.name,
+            task.command,
+            task.shell,
+            attempt=attempt,
+            resume=[attempt_id(prefix, n) for n in reversed(range(number))],
+            commit=False,
+            **kwargs,
+        )
+        if record.state == SUPERSEDED:
+            return record
+        if terminating.is_set() and not record.succeeded:
+            if task.retry is None or (retry.worker_lost and number + 1 < retry.max_attempts):
+                logger().info(f"stopping, {task.name} is left for another worker to resume")
+                reschedule()
+            break
+        if not retry.retries(record.exit_code, number):  # type: ignore
+            break
+        logger().info(f"retrying {task.name}, attempt {number} exited with {record.exit_code}")
+        number = claim_next_attempt(results, task.name, prefix, number + 1)
+    context = results.make_task_context(task.name, attempt)
+    committed = commit_context(context)
+    context.cleanup()
+    if not committed:
+        return replace(record, state=SUPERSEDED, exit_code=None)
+    return record
+
+
+def execute_batch(
+    results: Results,
+    tasks: List[TaskSpec],
+    poll_interval: int = 5,
+    sample_interval: float = SAMPLE_INTERVAL,
+    min_sync_interval: float = MIN_SYNC_INTERVAL,
+    max_sync_interval: float = MAX_SYNC_INTERVAL,
+) -> List[Optional[TaskRecord]]:
+    """
+    Run a batch of tasks one after another with ``execute_task``, so that many short
+    tasks share one call on the cluster. Returns the record of every task, or None
+    for tasks that could not be run.
+
+    If the process starts stopping before the batch is done, the whole batch is handed
+    back to the dask scheduler, and the tasks that already ran in it run again (or are
+    restored from the cache) on another worker.
+    """
+    records: List[Optional[TaskRecord]] = []
+    for task in tasks:
+        if terminating.is_set():
+            reschedule()
+        try:
+            records.append(
+                execute_task(
+                    results,
+                    task,
+                    poll_interval=poll_interval,
+                    sample_interval=sample_interval,
+                    min_sync_interval=min_sync_interval,
+                    max_sync_interval=max_sync_interval,
+                )
+            )
+        except Exception as e:
+            if is_reschedule(e):
+                raise
+            logger().error(f"error running {task.name}\n{traceback.format_exc()}")
+            records.append(None)
+    return records
+
+
+async def pump_async(
+    stream: asyncio.StreamReader, path: str, changed: asyncio.Event, stopping: asyncio.Event
+):
+    """The asyncio version of ``OutputPump``, which stops once ``stopping`` is set"""
+    with open(path, "wb") as f:
         while True:
+            # once stopping, only what can be read right away is copied
+            timeout = PUMP_DRAIN_TIMEOUT if stopping.is_set() else PUMP_WAKE_INTERVAL
             try:
-                exit_code = proc.wait(poll_interval)
-            except subprocess.TimeoutExpired:
-                logger().info("sync")
-                context.sync()
-            else:
-                logger().info("sync")
-                context.sync()
-                context.set_status(str(exit_code))
+                chunk = await asyncio.wait_for(stream.read(CHUNK_SIZE), timeout)
+            except asyncio.TimeoutError:
+                if stopping.is_set():
+                    break
+                continue
+            if not chunk:
                 break
-    running_pids.remove(proc.pid)
-    context.finish()
-    context.cleanup()
+            f.write(chunk)
+            f.flush()
+            changed.set()
+
+
+async def execute_async(
+    results: Results,
+    name: str,
+    cmd: Union[List, str],
+    shell: bool = False,
+    poll_interval: int = 5,
+    cpus: Optional[float] = None,
+    memory: Optional[int] = None,
+    key: Optional[str] = None,
+    command_token: Optional[str] = None,
+    submitted: Optional[float] = None,
+    sample_interval: float = SAMPLE_INTERVAL,
+    min_sync_interval: float = MIN_SYNC_INTERVAL,
+    max_sync_interval: float = MAX_SYNC_INTERVAL,
+    extra_env: Optional[Dict[str, str]] = None,
+    attempt: Optional[str] = None,
+    resume: Sequence[str] = (),
+    commit: bool = True,
+) -> TaskRecord:
+    """
+    Same as ``execute``, but supervises the child from the event loop instead of
+    blocking a thread on it. Blocking calls on the results, such as syncs, run on the
+    loop's default executor.
+    """
+    metrics = TaskMetrics(name, worker_id(), sample_interval, submitted=submitted)
+    loop = asyncio.get_running_loop()
+    with active_tasks.supervising(), span(
+        "task", trace_id=results.name, task=name, worker=metrics.worker
+    ):
+        # executor threads don't inherit the current span otherwise
+        context = await loop.run_in_executor(
+            None, contextvars.copy_context().run, open_task_context, results, name, attempt, resume
+        )
+        env = task_env(context, extra_env)
+        limits = ResourceLimits(cpus=cpus, memory=memory)
+        pipes = dict(
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            preexec_fn=limits.prepare(),
+        )
+        try:
+            with span("spawn", task=name):
+                if shell:
+                    proc = await asyncio.create_subprocess_shell(cmd, **pipes)  # type: ignore
+                else:
+                    args = [cmd] if isinstance(cmd, str) else cmd
+                    proc = await asyncio.create_subprocess_exec(*args, **pipes)  # type: ignore
+            running_pids.add(proc.pid)
+            pumps: List[asyncio.Future] = []
+            try:
+                metrics.start = time.time()
+                if attempt is not None:
+                    running_attempts[attempt] = (proc.pid, metrics.start)
+                changed = asyncio.Event()
+                stopping = asyncio.Event()
+                pumps = [
+                    asyncio.ensure_future(
+                        pump_async(stream, path, changed, stopping)  # type: ignore
+                    )
+                    for stream, path in [
+                        (proc.stdout, context.stdout_path),
+                        (proc.stderr, context.stderr_path),
+                    ]
+                ]
+
+                monitor = ProcessMonitor(proc.pid, metrics)
+                waiter = asyncio.ensure_future(proc.wait())
+                schedule = SyncSchedule(poll_interval, min_sync_interval, max_sync_interval)
+                while True:
+                    monitor.sample()
+                    timeout = min(schedule.timeout(), sample_interval)
+                    done, _ = await asyncio.wait({waiter}, timeout=timeout)
+                    # wait() also waits for the pipes, which grandchildren can hold open
+                    if done or proc.returncode is not None:
+                        metrics.end = time.time()
+                        break
+                    if not schedule.due():
+                        continue
+                    if changed.is_set() or schedule.results_changed(context):
+                        changed.clear()
+                        elapsed = await loop.run_in_executor(
+                            None, contextvars.copy_context().run, timed_sync, context, metrics
+                        )
+                        schedule.synced(elapsed)
+                    else:
+                        schedule.skipped()
+                # grandchildren can hold the pipes open after the child exits, so the pumps
+                # stop with what has been written so far
+                _, pending = await asyncio.wait(pumps, timeout=poll_interval)
+                if pending:
+                    stopping.set()
+                    await asyncio.wait(pending)
+                    # let go of the pipes, which also lets wait() return
+                    proc._transport.close()  # type: ignore # pylint:disable=protected-access
+            except BaseException:
+                # don't leave the task running, or its pumps writing, when supervising it fails;
+                # closing the transport kills the child if it is still running
+                cleanup(proc.pid)
+                for pump in pumps:
+                    pump.cancel()
+                proc._transport.close()  # type: ignore # pylint:disable=protected-access
+                raise
+            finally:
+                running_pids.discard(proc.pid)
+                if attempt is not None:
+                    running_attempts.pop(attempt, None)
+        finally:
+            limits.release()
+        record_span("run", metrics.start, metrics.end, task=name)
+        exit_code = await waiter
+        committed = await loop.run_in_executor(
+            None,
+            contextvars.copy_context().run,
+            finish_task,
+            context,
+            metrics,
+            exit_code,
+            attempt,
+            commit,
+        )
+    if submitted is not None:
+        record_span("queue", submitted, metrics.start, trace_id=results.name, task=name)
+    return task_record(metrics, key, command_token, committed)
+
+
+def execute_many(
+    results: Results,
+    tasks: List[TaskSpec],
+    concurrency: int = 64,
+    poll_interval: int = 5,
+    sample_interval: float = SAMPLE_INTERVAL,
+    min_sync_interval: float = MIN_SYNC_INTERVAL,
+    max_sync_interval: float = MAX_SYNC_INTERVAL,
+) -> List[Optional[TaskRecord]]:
+    """
+    Run a batch of tasks from one thread, with at most ``concurrency`` children at a
+    time. Returns the record of every task, or None for tasks that could not be run.
+    Tasks stop starting once the process is stopping, and the batch is then handed
+    back to the dask scheduler, as with ``execute_batch``.
+
+    Tasks that depend on others, or run as attempts, need ``execute_task`` and can't be
+    batched here.
+    """
+    unsupported = [t.name for t in tasks if t.depends_on or t.retry or t.attempt_prefix]
+    if unsupported:
+        raise ConfigError(
+            "tasks with depends_on, retry or an attempt_prefix can't run in an async "
+            f"batch: {', '.join(unsupported)}"
+        )
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def run(task: TaskSpec) -> Optional[TaskRecord]:
+            async with semaphore:
+                if terminating.is_set():
+                    # the batch is handed back once the tasks that started are done
+                    unstarted.append(task.name)
+                    return None
+                try:
+                    cached = await loop.run_in_executor(None, restore_from_cache, results, task)
+                    if cached:
+                        return cached
+                    record = await execute_async(
+                        results,
+                        task.name,
+                        task.command,
+                        task.shell,
+                        poll_interval=poll_interval,
+                        cpus=task.cpus,
+                        memory=task.memory,
+                        key=task.cache_key,
+                        command_token=task.command_token,
+                        submitted=task.submitted,
+                        sample_interval=sample_interval,
+                        min_sync_interval=min_sync_interval,
+                        max_sync_interval=max_sync_interval,
+                    )
+                    await loop.run_in_executor(None, save_to_cache, results, task, record)
+                    return record
+                except Exception:
+                    logger().error(f"error running {task.name}\n{traceback.format_exc()}")
+                    return None
+
+        return await asyncio.gather(*(run(t) for t in tasks))
+
+    unstarted: List[str] = []
+    records = asyncio.run(run_all())
+    if unstarted:
+        logger().info(f"stopping, {len(unstarted)} tasks of the batch did not start")
+        reschedule()
+    return records
@@ -0,0 +1,50 @@
+import logging
+import time
+from typing import Callable, Optional
+
+
+class Progress:
+    """
+    Keeps counts for a run while it is being collected, and logs a summary at most
+    every ``interval`` seconds.
+    """
+
+    def __init__(self, total: int, interval: float = 10):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.done - self.failed
+
+    def finished(self, count: int = 1):
+        self.done += count
+
+    def errored(self, count: int = 1):
+        self.failed += count
+
+    def summary(self, running: Optional[int] = None) -> str:
+        elapsed = time.monotonic() - self.start
+        throughput = (self.done + self.failed) / elapsed if elapsed else 0.0
+        pending = f"{self.pending} pending"
+        if running is not None:
+            pending += f" ({running} on workers)"
+        return (
+            f"{self.done}/{self.total} done, {self.failed} failed, {pending}, "
+            f"{throughput:.1f} tasks/s"
+        )
+
+    def report(self, running: Optional[Callable[[], int]] = None, force: bool = False):
+        """
+        Log a summary if ``interval`` has passed. ``running`` is only called when a
+        summary is logged, since it may be expensive.
+        """
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        logging.info(self.summary(running() if running else None))
@@ -0,0 +1,145 @@
+import itertools
+import math
+import os
+import resource
+import threading
+from os.path import join
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# numbers the cgroups this process creates for its tasks
+cgroup_ids = itertools.count()
+
+
+class CpuAllocator:
+    """
+    Hands out CPU cores to the tasks running in this process, so that tasks that
+    asked for CPUs don't end up sharing cores with each other.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_use: Dict[int, int] = {}
+
+    def acquire(self, cpus: float) -> List[int]:
+        available = psutil.Process().cpu_affinity() or list(range(psutil.cpu_count()))
+        count = min(max(1, math.ceil(cpus)), len(available))
+        with self.lock:
+            # least used cores first, so we only share cores once they have all been handed out
+            cores = sorted(available, key=lambda c: self.in_use.get(c, 0))[:count]
+            for core in cores:
+                self.in_use[core] = self.in_use.get(core, 0) + 1
+        return sorted(cores)
+
+    def release(self, cores: List[int]):
+        with self.lock:
+            for core in cores:
+                self.in_use[core] -= 1
+                if not self.in_use[core]:
+                    del self.in_use[core]
+
+
+cpu_allocator = CpuAllocator()
+
+
+def own_cgroup() -> Optional[str]:
+    """The cgroup v2 directory of this process, if there is one"""
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return join(CGROUP_ROOT, line.strip()[3:].lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+def memory_cgroup(memory: int) -> Optional[str]:
+    """
+    Create a new cgroup v2 sibling of this process's cgroup with ``memory.max`` set,
+    for a task to join. This only works where cgroups are delegated to us. Returns the
+    new cgroup, or None if it could not be set up.
+    """
+    cgroup = own_cgroup()
+    if cgroup is None:
+        return None
+    parent = os.path.dirname(cgroup)
+    try:
+        with open(join(parent, "cgroup.subtree_control"), "r") as f:
+            if "memory" not in f.read().split():
+                return None
+        path = join(parent, f"saturn-run-{os.getpid()}-{next(cgroup_ids)}")
+        os.makedirs(path, exist_ok=True)
+        with open(join(path, "memory.max"), "w") as f:
+            f.write(str(memory))
+    except OSError:
+        return None
+    return path
+
+
+class ResourceLimits:
+    """
+    Applies a task's ``cpus`` and ``memory`` to its process as it starts, before it
+    runs the task's command, so they are inherited by everything the task starts.
+
+    CPUs are enforced by pinning the process to cores from ``cpu_allocator``. Memory is
+    enforced with a cgroup when possible, and otherwise with ``RLIMIT_DATA``, which
+    bounds the heap and private mappings of each process in the tree (not their sum).
+    """
+
+    def __init__(self, cpus: Optional[float] = None, memory: Optional[int] = None):
+        self.cpus = cpus
+        self.memory = memory
+        self.cores: List[int] = []
+        self.cgroup: Optional[str] = None
+        self.procs_fd: Optional[int] = None
+
+    def prepare(self) -> Optional[Callable[[], None]]:
+        """
+        Reserve cores and set up a cgroup for a task that is about to start. Returns
+        the ``preexec_fn`` that applies them in the task's process, or None if there is
+        nothing to apply. It runs between fork and exec, so it only makes system calls.
+        """
+        if not self.cpus and not self.memory:
+            return None
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            self.cores = cpu_allocator.acquire(self.cpus)
+        if self.memory:
+            self.cgroup = memory_cgroup(self.memory)
+            if self.cgroup is not None:
+                try:
+                    self.procs_fd = os.open(join(self.cgroup, "cgroup.procs"), os.O_WRONLY)
+                except OSError:
+                    self.procs_fd = None
+        cores, memory, procs_fd = self.cores, self.memory, self.procs_fd
+
+        def preexec():
+            if cores:
+                os.sched_setaffinity(0, cores)
+            if memory:
+                if procs_fd is not None:
+                    try:
+                        # "0" is the process that writes it
+                        os.write(procs_fd, b"0")
+                        return
+                    except OSError:
+                        pass
+                resource.setrlimit(resource.RLIMIT_DATA, (memory, memory))
+
+        return preexec
+
+    def release(self):
+        if self.procs_fd is not None:
+            os.close(self.procs_fd)
+            self.procs_fd = None
+        if self.cores:
+            cpu_allocator.release(self.cores)
+            self.cores = []
+        if self.cgroup:
+            try:
+                os.rmdir(self.cgroup)
+            except OSError:
+                pass
+            self.cgroup = None
@@ -1,3 +1,18 @@
+from importlib import import_module
+
 from saturn_run.results.base import Results, ResultsTaskContext  # noqa
-from saturn_run.results.local import LocalResults, LocalTaskContext  # noqa
-from saturn_run.results.s3 import S3Results, S3TaskContext  # noqa
+
+# backends are imported when they are first used, so that e.g. boto3 is not imported
+# by runs that use LocalResults
+_lazy = {
+    "LocalResults": "saturn_run.results.local",
+    "LocalTaskContext": "saturn_run.results.local",
+    "S3Results": "saturn_run.results.s3",
+    "S3TaskContext": "saturn_run.results.s3",
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(import_module(_lazy[name]), name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
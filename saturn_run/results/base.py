@@ -1,7 +1,12 @@
 import os
 import tempfile
+import time
+import uuid
+from dataclasses import dataclass
 from os.path import join
-from typing import Callable, Dict
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from saturn_run.utils import resolve_backend
 
 # status fields
 
@@ -11,17 +16,174 @@ FINISHED = "finished"
 SAVED = "saved"
 FAILED = "failed"
 
+# name of the status index of a run, next to the results of its tasks
+STATUS_INDEX_FILE = "status.db"
+# Attempts of a task write under ``<task>/attempts/<attempt>/`` until one of them is
+# committed. An attempt is ``<prefix>/<number>``, where the prefix is an execution of
+# the task (e.g. ``a1b2c3``), or a copy of it (``a1b2c3/copy``). The first attempt of
+# an execution to commit claims ``<task>/attempts/<execution>/committed``.
+ATTEMPTS_DIR = "attempts"
+COMMIT_FILE = "committed"
+# What a task leaves in its own place once it is done, or its attempt is committed.
+# Only these are cached, never the attempts, which other copies may still be writing.
+TASK_OUTPUTS = ("status", "stdout", "stderr", "metrics.json", "results")
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    # unix time the entry was written, and its total size in bytes
+    created: float
+    size: int
+
+
+def select_evictions(
+    entries: List[CacheEntry],
+    max_age: Optional[float] = None,
+    max_size: Optional[int] = None,
+    now: Optional[float] = None,
+) -> List[str]:
+    """
+    Keys of the cache entries to remove: entries older than ``max_age`` seconds, then
+    the oldest entries until the rest fit in ``max_size`` bytes.
+    """
+    now = time.time() if now is None else now
+    evicted = []
+    kept = []
+    for entry in sorted(entries, key=lambda e: e.created):
+        if max_age is not None and now - entry.created > max_age:
+            evicted.append(entry.key)
+        else:
+            kept.append(entry)
+    if max_size is not None:
+        total = sum(e.size for e in kept)
+        for entry in kept:
+            if total <= max_size:
+                break
+            evicted.append(entry.key)
+            total -= entry.size
+    return evicted
+
+
+def is_task_output(rel_path: str) -> bool:
+    """Whether ``rel_path``, relative to the place of a task, is one of its ``TASK_OUTPUTS``"""
+    return rel_path.split("/", 1)[0] in TASK_OUTPUTS
+
+
+def new_execution() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def attempt_id(prefix: str, number: int) -> str:
+    return f"{prefix}/{number}"
+
+
+def attempt_prefix(attempt: str) -> str:
+    return attempt.rsplit("/", 1)[0]
+
+
+def attempt_execution(attempt: str) -> str:
+    return attempt.split("/", 1)[0]
+
 
 class Results:
 
-    backends: Dict[str, Callable[..., "Results"]] = {}
+    # class_spec -> backend, or the module:attribute path it is imported from
+    backends: Dict[str, Union[str, Callable[..., "Results"]]] = {
+        "LocalResults": "saturn_run.results.local:LocalResults",
+        "S3Results": "saturn_run.results.s3:S3Results",
+    }
+
+    # the name of the run
+    name = ""
+
+    # Backends that support caching set these. Tasks that succeeded are stored in the
+    # cache under their ``cache_key``, and later tasks with the same key are restored
+    # from it instead of running, unless ``skip_cached`` is turned off.
+    cache_enabled = False
+    skip_cached = True
+    cache_max_age: Optional[float] = None
+    cache_max_size: Optional[int] = None
 
-    def make_task_context(self, name: str):
+    def make_task_context(self, name: str, attempt: Optional[str] = None):
+        """
+        The context a task writes its outputs through. With an ``attempt``, they are
+        written under the attempt's own prefix, and only become the task's outputs once
+        the attempt is committed (see ``ResultsTaskContext.commit``).
+        """
         raise NotImplementedError
 
+    def task_results_url(self, name: str) -> str:
+        """
+        Where the results of the task ``name`` end up, so that downstream tasks can
+        find them.
+        """
+        raise NotImplementedError
+
+    def claim_attempt(self, name: str, attempt: str) -> bool:
+        """
+        Reserve the prefix of ``attempt`` for one run of the task ``name``, so runs that
+        are dispatched again (e.g. after their worker went away) never share one.
+        Returns False if the attempt was claimed before.
+        """
+        raise NotImplementedError
+
+    def fetch_status_index(self) -> str:
+        """
+        Local path of the run's status index. Backends that keep the index remotely
+        download the latest copy, if there is one.
+        """
+        raise NotImplementedError
+
+    def publish_status_index(self):
+        """Store the local status index with the results, after it has been updated"""
+
+    def restore_cached(self, name: str, key: str) -> bool:
+        """
+        Copy the cached outputs for ``key`` into the results of the task
+        ``name``. Returns False if there is no cached entry.
+        """
+        return False
+
+    def store_cached(self, name: str, key: str):
+        """Save the outputs of the task ``name``, which succeeded, in the cache"""
+
+    def cache_entries(self) -> List[CacheEntry]:
+        raise NotImplementedError
+
+    def remove_cache_entries(self, keys: List[str]):
+        raise NotImplementedError
+
+    def evict_cache(
+        self, max_age: Optional[float] = None, max_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Remove cache entries older than ``max_age`` seconds, then the oldest entries
+        until the cache fits in ``max_size`` bytes. Defaults to ``cache_max_age`` and
+        ``cache_max_size``. Returns the keys that were removed.
+        """
+        if not self.cache_enabled:
+            return []
+        max_age = self.cache_max_age if max_age is None else max_age
+        max_size = self.cache_max_size if max_size is None else max_size
+        if max_age is None and max_size is None:
+            return []
+        keys = select_evictions(self.cache_entries(), max_age, max_size)
+        if keys:
+            self.remove_cache_entries(keys)
+        return keys
+
     @classmethod
     def create(cls, class_spec: str, name: str, **kwargs):
-        return cls.backends[class_spec](name=name, **kwargs)
+        return resolve_backend(cls.backends, class_spec)(name=name, **kwargs)
+
+    @classmethod
+    def create_cache(cls, class_spec: str, **kwargs):
+        """
+        The backend without a run, to look after its cache (e.g. ``evict_cache``) outside
+        of one. Only the cache methods can be used.
+        """
+        return resolve_backend(cls.backends, class_spec)(name=None, **kwargs)
 
 
 class ResultsTaskContext:
@@ -29,9 +191,10 @@ class ResultsTaskContext:
     Results obs3ject passed to a specific task
     """
 
-    def __init__(self, name: str, results: Results):
+    def __init__(self, name: str, results: Results, attempt: Optional[str] = None):
         self.name = name
         self.results = results
+        self.attempt = attempt
         self.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
 
     @property
@@ -77,3 +240,29 @@ class ResultsTaskContext:
 
     def set_status(self, status: str):
         raise NotImplementedError()
+
+    def save_metrics(self, metrics: Dict[str, Any]):
+        """Save the task's ``TaskMetrics`` as ``metrics.json``, next to its status"""
+        raise NotImplementedError()
+
+    def commit(self) -> bool:
+        """
+        Make the outputs, status and metrics of this attempt those of the task, once it
+        is finished. Attempts of the same execution race to commit: the first one wins,
+        and the others return False without touching the task's outputs. Contexts
+        without an attempt write in place, so there is nothing to do.
+        """
+        if self.attempt is None:
+            return True
+        raise NotImplementedError()
+
+    def discard(self):
+        """Remove the outputs of an attempt that will not be committed"""
+
+    def resume_from(self, attempt: str) -> int:
+        """
+        Copy the results of an earlier ``attempt`` of the task into ``results_dir``, so
+        a task that checkpoints there can pick up where that attempt left off. Returns
+        the number of files copied.
+        """
+        raise NotImplementedError()
@@ -1,25 +1,150 @@
+import json
 import os
-from os.path import join
+import shutil
+import time
+from os.path import exists, join, relpath
+from threading import get_ident
+from typing import Any, Dict, List, Optional, Union
 
-from saturn_run.results.base import Results, ResultsTaskContext
+from saturn_run.results.base import (
+    ATTEMPTS_DIR,
+    COMMIT_FILE,
+    STATUS_INDEX_FILE,
+    TASK_OUTPUTS,
+    CacheEntry,
+    Results,
+    ResultsTaskContext,
+    attempt_execution,
+)
+from saturn_run.utils import parse_bytes, parse_duration
+
+# written last when an entry is cached, so its presence means the entry is complete
+CACHE_ENTRY_FILE = "entry.json"
+
+
+def replace_with_copy(src: str, dest: str):
+    # never hard link, or editing the restored file in place would change the cache, and
+    # remove dest first in case it is such a link
+    if exists(dest):
+        os.remove(dest)
+    shutil.copy2(src, dest)
 
 
 class LocalResults(Results):
-    def __init__(self, path, name: str):
+    def __init__(
+        self,
+        path,
+        name: Optional[str],
+        cache_path: Optional[str] = None,
+        cache_max_age: Optional[Union[float, str]] = None,
+        cache_max_size: Optional[Union[int, str]] = None,
+    ):
         self.path = path
-        if "{name}" in self.path:
-            self.path = self.path.replace("{name}", name)
-        os.makedirs(self.path, exist_ok=True)
+        # without a name, only the cache is used (see ``Results.create_cache``)
+        if name is not None:
+            self.name = name
+            if "{name}" in self.path:
+                self.path = self.path.replace("{name}", name)
+            os.makedirs(self.path, exist_ok=True)
+        self.cache_path = cache_path
+        self.cache_enabled = cache_path is not None
+        if cache_max_age is not None:
+            self.cache_max_age = parse_duration(cache_max_age)
+        if cache_max_size is not None:
+            self.cache_max_size = parse_bytes(cache_max_size)
+        if self.cache_path:
+            os.makedirs(self.cache_path, exist_ok=True)
+
+    def make_task_context(self, name: str, attempt: Optional[str] = None):
+        return LocalTaskContext(name, self, attempt)
+
+    def task_results_url(self, name: str) -> str:
+        return join(self.path, name, "results")
+
+    def claim_attempt(self, name: str, attempt: str) -> bool:
+        path = join(self.path, name, ATTEMPTS_DIR, attempt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            return False
+        return True
+
+    def fetch_status_index(self) -> str:
+        return join(self.path, STATUS_INDEX_FILE)
+
+    def restore_cached(self, name: str, key: str) -> bool:
+        if not self.cache_path:
+            return False
+        entry_path = join(self.cache_path, key)
+        if not exists(join(entry_path, CACHE_ENTRY_FILE)):
+            return False
+        task_path = join(self.path, name)
+        for root, dirs, files in os.walk(entry_path):
+            if root == entry_path:
+                # only the outputs, e.g. not the entry file
+                dirs[:] = [d for d in dirs if d in TASK_OUTPUTS]
+                files = [f for f in files if f in TASK_OUTPUTS]
+            os.makedirs(join(task_path, relpath(root, entry_path)), exist_ok=True)
+            for f in files:
+                src = join(root, f)
+                replace_with_copy(src, join(task_path, relpath(src, entry_path)))
+        return True
 
-    def make_task_context(self, name: str):
-        return LocalTaskContext(name, self)
+    def store_cached(self, name: str, key: str):
+        if not self.cache_path:
+            return
+        entry_path = join(self.cache_path, key)
+        if exists(entry_path):
+            return
+        # copy into place under a temporary name, so readers never see half an entry
+        tmp_path = f"{entry_path}.{os.getpid()}.{get_ident()}.tmp"
+        os.makedirs(tmp_path)
+        for output in TASK_OUTPUTS:
+            src = join(self.path, name, output)
+            if os.path.isdir(src):
+                shutil.copytree(src, join(tmp_path, output))
+            elif exists(src):
+                shutil.copy2(src, join(tmp_path, output))
+        size = sum(
+            os.path.getsize(join(root, f)) for root, _, files in os.walk(tmp_path) for f in files
+        )
+        with open(join(tmp_path, CACHE_ENTRY_FILE), "w") as f:
+            json.dump({"task": name, "created": time.time(), "size": size}, f)
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # another task with the same key got there first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def cache_entries(self) -> List[CacheEntry]:
+        entries: List[CacheEntry] = []
+        if not self.cache_path or not exists(self.cache_path):
+            return entries
+        for key in os.listdir(self.cache_path):
+            entry_file = join(self.cache_path, key, CACHE_ENTRY_FILE)
+            if not exists(entry_file):
+                continue
+            with open(entry_file, "r") as f:
+                entry = json.load(f)
+            entries.append(CacheEntry(key=key, created=entry["created"], size=entry["size"]))
+        return entries
+
+    def remove_cache_entries(self, keys: List[str]):
+        for key in keys:
+            shutil.rmtree(join(self.cache_path, key), ignore_errors=True)  # type: ignore
 
 
 class LocalTaskContext(ResultsTaskContext):
-    def __init__(self, name: str, results: LocalResults):  # pylint: disable=super-init-not-called
+    # pylint: disable=super-init-not-called
+    def __init__(self, name: str, results: LocalResults, attempt: Optional[str] = None):
         self.name = name
         self.results = results
-        self.path = join(self.results.path, self.name)
+        self.attempt = attempt
+        self.task_path = join(self.results.path, self.name)
+        self.path = self.task_path
+        if attempt is not None:
+            self.path = join(self.task_path, ATTEMPTS_DIR, attempt)
         os.makedirs(self.path, exist_ok=True)
 
     def set_status(self, status):
@@ -27,6 +152,10 @@ class LocalTaskContext(ResultsTaskContext):
         with open(path, "w+") as f:
             f.write(str(status))
 
+    def save_metrics(self, metrics: Dict[str, Any]):
+        with open(join(self.path, "metrics.json"), "w") as f:
+            json.dump(metrics, f)
+
     @property
     def stdout_path(self):
         """
@@ -66,8 +195,35 @@ class LocalTaskContext(ResultsTaskContext):
         """
         pass
 
-    def cleanup(self):
-        pass
+    def commit(self) -> bool:
+        if self.attempt is None:
+            return True
+        claim = join(self.task_path, ATTEMPTS_DIR, attempt_execution(self.attempt), COMMIT_FILE)
+        try:
+            fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.attempt)
+        # the status is moved last, so a task with a status has all of its outputs
+        for entry in sorted(os.listdir(self.path), key=lambda e: e == "status"):
+            dest = join(self.task_path, entry)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            os.replace(join(self.path, entry), dest)
+        os.rmdir(self.path)
+        return True
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
 
+    def resume_from(self, attempt: str) -> int:
+        src = join(self.task_path, ATTEMPTS_DIR, attempt, "results")
+        if not exists(src):
+            return 0
+        # copied rather than linked, as tasks may update their checkpoints in place
+        shutil.copytree(src, self.results_dir, dirs_exist_ok=True)
+        return sum(len(files) for _, _, files in os.walk(src))
 
-Results.backends["LocalResults"] = LocalResults
+    def cleanup(self):
+        pass
@@ -1,11 +1,123 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import walk
-from os.path import exists, join, relpath
+from os.path import exists, expanduser, join, relpath
+from threading import Condition, Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import boto3
 from boto3_type_annotations.s3 import Client
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from saturn_run.logging import logger
-from saturn_run.results.base import Results, ResultsTaskContext
+from saturn_run.results.base import (
+    ATTEMPTS_DIR,
+    COMMIT_FILE,
+    STATUS_INDEX_FILE,
+    CacheEntry,
+    Results,
+    ResultsTaskContext,
+    attempt_execution,
+    is_task_output,
+)
+from saturn_run.utils import parse_bytes, parse_duration
+
+# stdout and stderr are shipped as numbered parts while the task runs
+LOG_STREAMS = ("stdout", "stderr")
+# upper bound on the size of a single log part
+MAX_PART_SIZE = 64 * 1024 * 1024
+
+# s3 clients are thread safe and expensive to build (credential resolution, TLS
+# handshakes), so we keep one per process and client configuration.
+_clients: Dict[Tuple, Client] = {}
+_clients_lock = Lock()
+# where the status index of a run is kept while it is read or updated
+STATUS_DIR = expanduser("~/.saturn-run/status")
+# written last when an entry is cached, so its presence means the entry is complete
+CACHE_ENTRY_FILE = "entry.json"
+# ``<attempt>.claimed`` next to the prefix of an attempt reserves it, see ``claim_attempt``
+CLAIM_SUFFIX = ".claimed"
+
+
+def put_if_absent(s3: Client, bucket: str, key: str, body: bytes) -> bool:
+    """Create ``key`` unless it exists. Returns False if it did."""
+    try:
+        s3.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch="*")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+    return True
+
+
+def upload_files(
+    s3: Client,
+    bucket: str,
+    uploads: List[Tuple[str, str, int]],
+    concurrency: int,
+    max_inflight_bytes: int,
+) -> None:
+    """
+    Upload ``(local_path, key, size)`` tuples with a pool of threads, holding back new
+    uploads while more than ``max_inflight_bytes`` are being sent. A single file larger
+    than the budget is uploaded on its own.
+    """
+    condition = Condition()
+    inflight = [0]
+
+    def upload(local_path: str, key: str, size: int):
+        try:
+            s3.upload_file(local_path, bucket, key)
+        finally:
+            with condition:
+                inflight[0] -= size
+                condition.notify_all()
+
+    def has_room(size: int) -> bool:
+        return inflight[0] == 0 or inflight[0] + size <= max_inflight_bytes
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for local_path, key, size in uploads:
+            with condition:
+                condition.wait_for(partial(has_room, size))
+                inflight[0] += size
+            futures.append(pool.submit(upload, local_path, key, size))
+        for fut in futures:
+            fut.result()
+
+
+def list_objects(s3: Client, bucket: str, prefix: str) -> Iterable[Dict[str, Any]]:
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
+def delete_keys(s3: Client, bucket: str, keys: List[str]) -> None:
+    # delete_objects takes at most 1000 keys per request
+    for idx in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys[idx : idx + 1000]]}
+        )
+
+
+def copy_objects(
+    s3: Client, bucket: str, copies: List[Tuple[str, str, str]], concurrency: int
+) -> None:
+    """
+    Server side copies of ``(src_key, dest_bucket, dest_key)`` tuples, so nothing goes
+    through this machine.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(s3.copy, {"Bucket": bucket, "Key": src}, dest_bucket, dest)
+            for src, dest_bucket, dest in copies
+        ]
+        for fut in futures:
+            fut.result()
 
 
 class S3Results(Results):
@@ -15,19 +127,157 @@ class S3Results(Results):
     Individual tasks will have S3Context objects based off of this.
     """
 
-    def __init__(self, s3_url, name):
+    def __init__(
+        self,
+        s3_url,
+        name: Optional[str],
+        max_pool_connections: int = 10,
+        max_attempts: int = 5,
+        retry_mode: str = "standard",
+        upload_concurrency: int = 8,
+        max_inflight_bytes: int = 256 * 1024 * 1024,
+        cache_url: Optional[str] = None,
+        cache_max_age: Optional[Union[float, str]] = None,
+        cache_max_size: Optional[Union[int, str]] = None,
+    ):
         self.s3_url = s3_url
-        if "{name}" in self.s3_url:
-            self.s3_url = self.s3_url.replace("{name}", name)
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.retry_mode = retry_mode
+        self.upload_concurrency = upload_concurrency
+        self.max_inflight_bytes = max_inflight_bytes
+        # without a name, only the cache is used (see ``Results.create_cache``)
+        if name is not None:
+            self.name = name
+            if "{name}" in self.s3_url:
+                self.s3_url = self.s3_url.replace("{name}", name)
         parsed = urlparse(self.s3_url)
         self.bucket = parsed.netloc
         self.path = parsed.path.lstrip("/")
+        self.cache_url = cache_url
+        self.cache_enabled = cache_url is not None
+        if cache_url is not None:
+            parsed = urlparse(cache_url)
+            self.cache_bucket = parsed.netloc
+            self.cache_path = parsed.path.lstrip("/")
+        if cache_max_age is not None:
+            self.cache_max_age = parse_duration(cache_max_age)
+        if cache_max_size is not None:
+            self.cache_max_size = parse_bytes(cache_max_size)
+
+    def make_task_context(self, name: str, attempt: Optional[str] = None):
+        return S3TaskContext(name, self, attempt)
+
+    def task_results_url(self, name: str) -> str:
+        return f"s3://{self.bucket}/{join(self.path, name, 'results')}/"
+
+    def claim_attempt(self, name: str, attempt: str) -> bool:
+        key = join(self.path, name, ATTEMPTS_DIR, attempt + CLAIM_SUFFIX)
+        return put_if_absent(self.s3_client(), self.bucket, key, b"")
+
+    def s3_client(self) -> Client:
+        """
+        Returns the s3 client shared by every task context in this process.
+
+        The cache is keyed on the pid so that forked processes build their own client.
+        """
+        key = (os.getpid(), self.max_pool_connections, self.max_attempts, self.retry_mode)
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                config = Config(
+                    max_pool_connections=self.max_pool_connections,
+                    retries={"max_attempts": self.max_attempts, "mode": self.retry_mode},
+                )
+                client = boto3.Session().client("s3", config=config)
+                _clients[key] = client
+        return client
+
+    @property
+    def status_index_key(self) -> str:
+        return join(self.path, STATUS_INDEX_FILE)
+
+    def fetch_status_index(self) -> str:
+        local_path = join(STATUS_DIR, self.bucket, self.status_index_key)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        try:
+            self.s3_client().download_file(self.bucket, self.status_index_key, local_path)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+        return local_path
+
+    def publish_status_index(self):
+        local_path = join(STATUS_DIR, self.bucket, self.status_index_key)
+        if exists(local_path):
+            self.s3_client().upload_file(local_path, self.bucket, self.status_index_key)
+
+    def cache_entry_prefix(self, key: str) -> str:
+        return join(self.cache_path, key) + "/"
 
-    def make_task_context(self, name: str):
-        return S3TaskContext(name, self)
+    def restore_cached(self, name: str, key: str) -> bool:
+        if not self.cache_enabled:
+            return False
+        s3 = self.s3_client()
+        prefix = self.cache_entry_prefix(key)
+        try:
+            s3.head_object(Bucket=self.cache_bucket, Key=prefix + CACHE_ENTRY_FILE)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        task_prefix = join(self.path, name) + "/"
+        copies = [
+            (obj["Key"], self.bucket, task_prefix + obj["Key"][len(prefix) :])
+            for obj in list_objects(s3, self.cache_bucket, prefix)
+            if is_task_output(obj["Key"][len(prefix) :])
+        ]
+        copy_objects(s3, self.cache_bucket, copies, self.upload_concurrency)
+        return True
+
+    def store_cached(self, name: str, key: str):
+        if not self.cache_enabled:
+            return
+        s3 = self.s3_client()
+        prefix = self.cache_entry_prefix(key)
+        task_prefix = join(self.path, name) + "/"
+        objects = [
+            obj
+            for obj in list_objects(s3, self.bucket, task_prefix)
+            if is_task_output(obj["Key"][len(task_prefix) :])
+        ]
+        copies = [
+            (obj["Key"], self.cache_bucket, prefix + obj["Key"][len(task_prefix) :])
+            for obj in objects
+        ]
+        copy_objects(s3, self.bucket, copies, self.upload_concurrency)
+        entry = {"task": name, "created": time.time(), "size": sum(o["Size"] for o in objects)}
+        s3.put_object(
+            Bucket=self.cache_bucket,
+            Key=prefix + CACHE_ENTRY_FILE,
+            Body=json.dumps(entry).encode("utf-8"),
+        )
 
+    def cache_entries(self) -> List[CacheEntry]:
+        if not self.cache_enabled:
+            return []
+        s3 = self.s3_client()
+        prefix = join(self.cache_path, "")
+        sizes: Dict[str, int] = {}
+        created: Dict[str, float] = {}
+        for obj in list_objects(s3, self.cache_bucket, prefix):
+            key, _, rel_path = obj["Key"][len(prefix) :].partition("/")
+            sizes[key] = sizes.get(key, 0) + obj["Size"]
+            if rel_path == CACHE_ENTRY_FILE:
+                created[key] = obj["LastModified"].timestamp()
+        # entries without an entry file are still being written
+        return [CacheEntry(key=k, created=created[k], size=sizes[k]) for k in created]
 
-Results.backends["S3Results"] = S3Results
+    def remove_cache_entries(self, keys: List[str]):
+        s3 = self.s3_client()
+        for key in keys:
+            objects = list_objects(s3, self.cache_bucket, self.cache_entry_prefix(key))
+            delete_keys(s3, self.cache_bucket, [obj["Key"] for obj in objects])
 
 
 class S3TaskContext(ResultsTaskContext):
@@ -35,45 +285,175 @@ class S3TaskContext(ResultsTaskContext):
     S3 object used by a specific task.
     """
 
-    def __init__(self, name: str, results: S3Results):
-        super().__init__(name, results)
+    def __init__(self, name: str, results: S3Results, attempt: Optional[str] = None):
+        super().__init__(name, results, attempt)
         self.results: S3Results = results  # for mypy?
+        self.task_prefix = join(self.results.path, self.name)
+        # where this context writes, i.e. the task's prefix, or its attempt's
+        self.prefix = self.task_prefix
+        if attempt is not None:
+            self.prefix = join(self.task_prefix, ATTEMPTS_DIR, attempt)
+        # bytes of each log stream that have already been shipped, and the number
+        # of parts they were shipped in
+        self.log_offsets = {stream: 0 for stream in LOG_STREAMS}
+        self.log_parts = {stream: 0 for stream in LOG_STREAMS}
+        # (size, mtime) of every results file as of its last upload
+        self.uploaded: Dict[str, Tuple[int, int]] = {}
 
     def s3_client(self) -> Client:
-        sess = boto3.Session()
-        s3 = sess.client("s3")
-        return s3
+        return self.results.s3_client()
 
     def set_status(self, status: str):
         s3 = self.s3_client()
-        path = join(self.results.path, self.name, "status")
+        path = join(self.prefix, "status")
         s3.put_object(Bucket=self.results.bucket, Key=path, Body=status.encode("utf-8"))
 
+    def save_metrics(self, metrics: Dict[str, Any]):
+        s3 = self.s3_client()
+        path = join(self.prefix, "metrics.json")
+        s3.put_object(
+            Bucket=self.results.bucket, Key=path, Body=json.dumps(metrics).encode("utf-8")
+        )
+
+    def log_part_key(self, stream: str, part: int) -> str:
+        return join(self.prefix, f"{stream}.parts", f"{part:08d}")
+
     def sync(self):
+        """
+        Ship whatever was appended to stdout and stderr since the last sync as new
+        numbered parts, so the cost of a sync scales with the bytes written rather than
+        the size of the logs.
+        """
         s3 = self.s3_client()
         logger().info(f"sync {self.stdout_path} {self.stderr_path}")
-        s3_path = join(self.results.path, self.name, "stdout")
-        if exists(self.stdout_path):
-            s3.upload_file(self.stdout_path, self.results.bucket, s3_path)
+        for stream, local_path in zip(LOG_STREAMS, (self.stdout_path, self.stderr_path)):
+            if not exists(local_path):
+                continue
+            with open(local_path, "rb") as f:
+                f.seek(self.log_offsets[stream])
+                while True:
+                    data = f.read(MAX_PART_SIZE)
+                    if not data:
+                        break
+                    s3.put_object(
+                        Bucket=self.results.bucket,
+                        Key=self.log_part_key(stream, self.log_parts[stream]),
+                        Body=data,
+                    )
+                    self.log_offsets[stream] += len(data)
+                    self.log_parts[stream] += 1
+        self.sync_results(s3)
 
-        s3_path = join(self.results.path, self.name, "stderr")
-        if exists(self.stderr_path):
-            s3.upload_file(self.stderr_path, self.results.bucket, s3_path)
+    def sync_results(self, s3: Client):
+        """
+        Upload results files that are new or changed (by size and mtime) since they were
+        last uploaded.
+        """
+        uploads = []
+        stats = {}
+        for root, _, files in walk(self.results_dir):
+            for f in files:
+                abs_path = join(root, f)
+                rel_path = relpath(abs_path, self.results_dir)
+                try:
+                    st = os.stat(abs_path)
+                except FileNotFoundError:
+                    continue
+                stat = (st.st_size, st.st_mtime_ns)
+                if self.uploaded.get(rel_path) == stat:
+                    continue
+                s3_path = join(self.prefix, "results", rel_path)
+                uploads.append((abs_path, s3_path, st.st_size))
+                stats[rel_path] = stat
+        if not uploads:
+            return
+        upload_files(
+            s3,
+            self.results.bucket,
+            uploads,
+            self.results.upload_concurrency,
+            self.results.max_inflight_bytes,
+        )
+        self.uploaded.update(stats)
+        logger().info(
+            f"saved {len(uploads)} results files ({sum(u[2] for u in uploads)} bytes) "
+            f"from {self.results_dir}"
+        )
+
+    def finish_logs(self, s3: Client):
+        """
+        Upload the complete stdout and stderr once, and remove the parts that were
+        shipped while the task was running.
+        """
+        for stream, local_path in zip(LOG_STREAMS, (self.stdout_path, self.stderr_path)):
+            if exists(local_path):
+                s3_path = join(self.prefix, stream)
+                s3.upload_file(local_path, self.results.bucket, s3_path)
+            parts = [self.log_part_key(stream, part) for part in range(self.log_parts[stream])]
+            delete_keys(s3, self.results.bucket, parts)
 
     def finish(self):
         s3 = self.s3_client()
-        logger().info(f"save results {self.results_dir}")
+        self.finish_logs(s3)
         if exists(self.results_dir):
-            for root, _, files in walk(self.results_dir):
-                for f in files:
-                    abs_path = join(root, f)
-                    s3_path = join(
-                        self.results.path, self.name, "results", relpath(abs_path, self.results_dir)
-                    )
-                    logger().warning(f"saving {abs_path} to {s3_path}")
-                    s3.upload_file(abs_path, self.results.bucket, s3_path)
+            self.sync_results(s3)
         else:
             logger().warning(f"results dir {self.results_dir} does not exist")
 
+    def commit(self) -> bool:
+        """
+        Claim the execution with a conditional put, which fails if another attempt
+        claimed it first, then copy the attempt's objects to the task's prefix on the
+        server side and remove them.
+        """
+        if self.attempt is None:
+            return True
+        s3 = self.s3_client()
+        bucket = self.results.bucket
+        claim = join(self.task_prefix, ATTEMPTS_DIR, attempt_execution(self.attempt), COMMIT_FILE)
+        if not put_if_absent(s3, bucket, claim, self.attempt.encode("utf-8")):
+            return False
+        prefix = self.prefix + "/"
+        keys = [obj["Key"] for obj in list_objects(s3, bucket, prefix)]
+        status = prefix + "status"
+        copies = [
+            (key, bucket, join(self.task_prefix, key[len(prefix) :]))
+            for key in keys
+            if key != status
+        ]
+        copy_objects(s3, bucket, copies, self.results.upload_concurrency)
+        # the status is copied last, so a task with a status has all of its outputs
+        if status in keys:
+            copy_objects(s3, bucket, [(status, bucket, join(self.task_prefix, "status"))], 1)
+        delete_keys(s3, bucket, keys)
+        return True
+
+    def discard(self):
+        s3 = self.s3_client()
+        objects = list_objects(s3, self.results.bucket, self.prefix + "/")
+        delete_keys(s3, self.results.bucket, [obj["Key"] for obj in objects])
+
+    def resume_from(self, attempt: str) -> int:
+        """
+        Download the results of ``attempt``, and copy them to this attempt's prefix on
+        the server side, so they are not uploaded again unless the task changes them.
+        """
+        s3 = self.s3_client()
+        bucket = self.results.bucket
+        src = join(self.task_prefix, ATTEMPTS_DIR, attempt, "results") + "/"
+        copies = []
+        for obj in list_objects(s3, bucket, src):
+            rel_path = obj["Key"][len(src) :]
+            if not rel_path or rel_path.endswith("/"):
+                continue
+            local_path = join(self.results_dir, rel_path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            s3.download_file(bucket, obj["Key"], local_path)
+            st = os.stat(local_path)
+            self.uploaded[rel_path] = (st.st_size, st.st_mtime_ns)
+            copies.append((obj["Key"], bucket, join(self.prefix, "results", rel_path)))
+        copy_objects(s3, bucket, copies, self.results.upload_concurrency)
+        return len(copies)
+
     def cleanup(self):
         self.tempdir.cleanup()
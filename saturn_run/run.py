@@ -1,30 +1,68 @@
 import datetime as dt
 import logging
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Union
 
+from saturn_run.cache import assign_cache_keys, iter_cache_keys
 from saturn_run.errors import ConfigError
 from saturn_run.executor.base import Executor
 from saturn_run.file_sync import FileSync
+from saturn_run.history import RunHistory
 from saturn_run.results.base import Results
-from saturn_run.tasks import TaskSpec
+from saturn_run.status import StatusIndex
+from saturn_run.task_source import iter_task_specs, read_task_file
+from saturn_run.tasks import TaskSpec, sort_by_dependencies
+from saturn_run.templates import expand_templates, is_template
+from saturn_run.tracing import configure_from_yaml
 
 
 @dataclass
 class TaskConfig:
-    tasks: List[TaskSpec]
+    # a list, or an iterator of tasks that are parsed as they are submitted
+    tasks: Iterable[TaskSpec]
+    # run this many tasks together in one call on the cluster, overriding the executor
+    batch_size: Optional[int] = None
 
     @classmethod
     def from_yaml(
         cls,
         tasks: List[Dict[str, Any]],
+        batch_size: Optional[int] = None,
     ):
+        if batch_size is not None and batch_size < 1:
+            raise ConfigError(f"batch_size must be at least 1, got {batch_size}")
+        if any(is_template(t) for t in tasks):
+            # templates can stand for many tasks, which are built as they are submitted
+            return cls(tasks=iter_task_specs(expand_templates(tasks)), batch_size=batch_size)
+
         task_specs = []
+        names = set()
         for idx, t in enumerate(tasks):
             task_spec = TaskSpec.from_yaml(idx, **t)
+            if task_spec.name in names:
+                raise ConfigError(f"duplicate task name {task_spec.name}")
+            names.add(task_spec.name)
             task_specs.append(task_spec)
+        # fail early on unknown dependencies and cycles
+        sort_by_dependencies(task_specs)
+        return cls(tasks=task_specs, batch_size=batch_size)
 
-        return cls(tasks=task_specs)
+    @classmethod
+    def from_file(cls, path: str) -> "TaskConfig":
+        """
+        Read the tasks in ``path``. A yaml file with a ``tasks`` list is read at once,
+        with ``from_yaml``. JSON lines and CSV files, and yaml files with a task in each
+        document, are streamed: tasks are parsed as they are submitted. Task templates
+        (see ``saturn_run.templates``) are expanded as they are reached, in either case.
+        """
+        documents = read_task_file(path)
+        first = next(documents, None)
+        if first is None:
+            raise ConfigError(f"{path} has no tasks")
+        if isinstance(first, dict) and "tasks" in first:
+            return cls.from_yaml(**first)
+        return cls(tasks=iter_task_specs(expand_templates(chain([first], documents))))
 
 
 @dataclass
@@ -33,6 +71,8 @@ class RunConfig:
     results: Results
     executor: Executor
     file_syncs: Optional[List[FileSync]]
+    # durations of earlier runs, to start the longest tasks first
+    history: Optional[RunHistory] = None
 
     @classmethod
     def from_yaml(
@@ -42,6 +82,8 @@ class RunConfig:
         name: Optional[str] = None,
         prefix: Optional[str] = None,
         file_syncs: Optional[List[Dict[str, str]]] = None,
+        tracing: Optional[Dict[str, Any]] = None,
+        history: Optional[Union[bool, Dict[str, Any]]] = None,
     ):
         if prefix is not None:
             ts_str = dt.datetime.now(dt.timezone.utc).isoformat()
@@ -49,15 +91,59 @@ class RunConfig:
         if name is None:
             raise ConfigError("name or prefix must be set")
 
+        # before the executor is created, so that workers it starts trace too
+        configure_from_yaml(tracing)
         file_syncs_obj = None
         if file_syncs:
             file_syncs_obj = [FileSync.from_yaml(**x) for x in file_syncs]
         results_obj = Results.create(name=name, **results)
         executor_obj = Executor.create(**executor)
+        history_obj = None
+        if history:
+            history_obj = RunHistory(**(history if isinstance(history, dict) else {}))
         logging.info(f"creating run config with name: {name}")
-        return cls(name=name, results=results_obj, executor=executor_obj, file_syncs=file_syncs_obj)
+        return cls(
+            name=name,
+            results=results_obj,
+            executor=executor_obj,
+            file_syncs=file_syncs_obj,
+            history=history_obj,
+        )
 
-    def run(self, task_config: TaskConfig) -> None:
+    def run(self, task_config: TaskConfig, force: bool = False) -> None:
+        """
+        Submit the tasks in ``task_config``. If the results backend has a cache, tasks
+        that already succeeded with the same inputs are restored from it instead of
+        running, unless ``force`` is set. With a run history, tasks of the same
+        ``priority`` start longest first, from how long they took before.
+        """
         if self.file_syncs:
             self.executor.sync_files(self.file_syncs)
-        return self.executor.execute(task_config.tasks, self.results, self.name)
+        tasks = task_config.tasks
+        if self.results.cache_enabled:
+            if isinstance(tasks, list):
+                assign_cache_keys(tasks, self.file_syncs or [])
+            else:
+                tasks = iter_cache_keys(tasks, self.file_syncs or [])
+            self.results.skip_cached = not force
+        if self.history:
+            if isinstance(tasks, list):
+                tasks = list(self.history.prioritize(tasks))
+            else:
+                tasks = self.history.prioritize(tasks)
+        return self.executor.execute(
+            tasks, self.results, self.name, batch_size=task_config.batch_size
+        )
+
+    def collect(self) -> None:
+        """
+        Wait for the tasks of the run to finish, and add how long they took to the run
+        history, if there is one.
+        """
+        self.executor.collect(self.name, self.results)
+        if self.history:
+            index = StatusIndex(self.results.fetch_status_index())
+            try:
+                self.history.add(index.records())
+            finally:
+                index.close()
@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, Iterable, List, Optional
+
+from saturn_run.results.base import FAILED, FINISHED, Results
+from saturn_run.utils import format_bytes
+
+# states of tasks in the status index, besides FINISHED and FAILED
+CACHED = "cached"
+UPSTREAM_FAILED = "upstream-failed"
+# the task raised, or its worker went away, before it had an exit code
+ERROR = "error"
+# another attempt of the task was committed first, so this one's outputs were dropped
+SUPERSEDED = "superseded"
+
+
+@dataclass
+class TaskRecord:
+    """What happened to a task, as recorded in the status index"""
+
+    name: str
+    state: str
+    exit_code: Optional[int] = None
+    # the task's cache key, if it has one
+    key: Optional[str] = None
+    # digest of the task's command, see ``TaskSpec.command_token``
+    command_token: Optional[str] = None
+    # unix times
+    start: Optional[float] = None
+    end: Optional[float] = None
+    # host:pid of the process that supervised the task
+    worker: Optional[str] = None
+    # bytes of stdout, stderr and results
+    bytes_written: int = 0
+    peak_rss: Optional[int] = None
+    # seconds from submission to start, of CPU used, and spent syncing results
+    queue_seconds: Optional[float] = None
+    cpu_seconds: Optional[float] = None
+    sync_seconds: Optional[float] = None
+
+    @classmethod
+    def from_exit_code(cls, name: str, exit_code: int, **kwargs) -> "TaskRecord":
+        return cls(
+            name=name, state=FINISHED if exit_code == 0 else FAILED, exit_code=exit_code, **kwargs
+        )
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exit_code == 0
+
+
+COLUMNS = [f.name for f in fields(TaskRecord)]
+COLUMN_TYPES = {
+    "name": "TEXT PRIMARY KEY",
+    "state": "TEXT NOT NULL",
+    "exit_code": "INTEGER",
+    "key": "TEXT",
+    "command_token": "TEXT",
+    "start": "REAL",
+    "end": "REAL",
+    "worker": "TEXT",
+    "bytes_written": "INTEGER",
+    "peak_rss": "INTEGER",
+    "queue_seconds": "REAL",
+    "cpu_seconds": "REAL",
+    "sync_seconds": "REAL",
+}
+
+
+class StatusIndex:
+    """
+    A SQLite file with one row per task of a run, so questions like "which tasks
+    failed?" are answered with one query instead of reading every task's status.
+
+    Rows are written in batches by ``collect``. A task that is recorded again (e.g.
+    when a run is collected twice) replaces its earlier row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        columns = ", ".join(f"{c} {COLUMN_TYPES[c]}" for c in COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS tasks ({columns})")
+        # indexes written by older versions lack the newer columns
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        for column in COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {COLUMN_TYPES[column]}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)")
+        self.conn.commit()
+
+    def add(self, records: Iterable[TaskRecord]):
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO tasks ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                [tuple(asdict(r).values()) for r in records],
+            )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state")
+        return dict(rows.fetchall())
+
+    def records(
+        self, state: Optional[str] = None, name: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[TaskRecord]:
+        query = f"SELECT {', '.join(COLUMNS)} FROM tasks"
+        conditions = []
+        params: list = []
+        if state is not None:
+            conditions.append("state = ?")
+            params.append(state)
+        if name is not None:
+            conditions.append("name = ?")
+            params.append(name)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY start"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [TaskRecord(*row) for row in self.conn.execute(query, params)]
+
+    def close(self):
+        self.conn.close()
+
+
+class MetricsSummary:
+    """Aggregates the timing and resource usage of the tasks in a run, for ``collect``"""
+
+    def __init__(self):
+        self.tasks = 0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.sync_seconds = 0.0
+        self.max_peak_rss = 0
+        self.total_peak_rss = 0
+        # tasks that ran long enough for their memory to be sampled
+        self.sampled = 0
+        self.bytes_written = 0
+
+    def add(self, records: Iterable[TaskRecord]):
+        for r in records:
+            # only tasks that ran have metrics
+            if r.start is None or r.end is None or r.state == CACHED:
+                continue
+            self.tasks += 1
+            self.run_seconds += r.end - r.start
+            self.max_run_seconds = max(self.max_run_seconds, r.end - r.start)
+            self.queue_seconds += r.queue_seconds or 0
+            self.max_queue_seconds = max(self.max_queue_seconds, r.queue_seconds or 0)
+            self.cpu_seconds += r.cpu_seconds or 0
+            self.sync_seconds += r.sync_seconds or 0
+            if r.peak_rss is not None:
+                self.sampled += 1
+                self.max_peak_rss = max(self.max_peak_rss, r.peak_rss)
+                self.total_peak_rss += r.peak_rss
+            self.bytes_written += r.bytes_written
+
+    def summary(self) -> str:
+        if not self.tasks:
+            return "no tasks ran"
+        memory = "no memory samples"
+        if self.sampled:
+            memory = (
+                f"peak RSS {format_bytes(self.total_peak_rss // self.sampled)} on average "
+                f"(max {format_bytes(self.max_peak_rss)})"
+            )
+        return (
+            f"{self.tasks} tasks ran for {self.run_seconds / self.tasks:.1f}s on average "
+            f"(max {self.max_run_seconds:.1f}s), queued {self.queue_seconds / self.tasks:.1f}s "
+            f"(max {self.max_queue_seconds:.1f}s), used {self.cpu_seconds:.1f} CPU seconds, "
+            f"{memory}, wrote {format_bytes(self.bytes_written)}, "
+            f"spent {self.sync_seconds:.1f}s syncing results"
+        )
+
+
+class StatusWriter:
+    """
+    Adds records to the status index of a run in batches, and stores the index with the
+    results at most every ``interval`` seconds, and when closed.
+    """
+
+    def __init__(self, results: Results, interval: float = 30):
+        self.results = results
+        self.interval = interval
+        self.index = StatusIndex(results.fetch_status_index())
+        self.last_publish = time.monotonic()
+
+    def add(self, records: List[TaskRecord]):
+        if not records:
+            return
+        self.index.add(records)
+        if time.monotonic() - self.last_publish > self.interval:
+            self.results.publish_status_index()
+            self.last_publish = time.monotonic()
+
+    def close(self):
+        self.index.close()
+        self.results.publish_status_index()
@@ -0,0 +1,112 @@
+import csv
+import json
+from os.path import splitext
+from typing import Any, Dict, Iterable, Iterator, List
+
+from ruamel.yaml import YAML
+from saturn_run.errors import ConfigError
+from saturn_run.tasks import TaskSpec
+
+# task files in these formats are read one task at a time
+JSON_LINES_EXTENSIONS = {".jsonl", ".ndjson"}
+CSV_EXTENSIONS = {".csv"}
+# CSV columns that hold space separated lists, and the prefix of columns that are
+# custom resources, e.g. resources.GPU
+CSV_LIST_COLUMNS = {"depends_on", "inputs"}
+CSV_RESOURCE_PREFIX = "resources."
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+FALSE_VALUES = {"0", "false", "no", "n", "off"}
+
+
+def iter_json_lines(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ConfigError(f"{path}:{number}: {e}") from e
+
+
+def csv_row_to_task(row: Dict[str, str]) -> Dict[str, Any]:
+    """Converts a CSV row to the keyword arguments of ``TaskSpec.from_yaml``"""
+    task: Dict[str, Any] = {}
+    resources: Dict[str, float] = {}
+    for column, value in row.items():
+        if column is None or value is None or value == "":
+            continue
+        if column.startswith(CSV_RESOURCE_PREFIX):
+            resources[column[len(CSV_RESOURCE_PREFIX) :]] = float(value)
+        elif column in CSV_LIST_COLUMNS:
+            task[column] = value.split()
+        elif column == "cpus":
+            task[column] = float(value)
+        elif column == "shell":
+            if value.lower() not in TRUE_VALUES | FALSE_VALUES:
+                raise ConfigError(f"shell must be true or false, got {value}")
+            task[column] = value.lower() in TRUE_VALUES
+        else:
+            task[column] = value
+    if resources:
+        task["resources"] = resources
+    return task
+
+
+def iter_csv(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            yield csv_row_to_task(row)
+
+
+def iter_yaml_documents(path: str) -> Iterator[Any]:
+    """The documents of a yaml file, parsed one at a time"""
+    with open(path, "r") as f:
+        yield from YAML(typ="safe").load_all(f)
+
+
+def read_task_file(path: str) -> Iterator[Any]:
+    """
+    The tasks in a JSON lines (``.jsonl``) or CSV (``.csv``) file, or the documents of
+    a yaml file, as they are read.
+    """
+    extension = splitext(path)[1].lower()
+    if extension in JSON_LINES_EXTENSIONS:
+        return iter_json_lines(path)
+    if extension in CSV_EXTENSIONS:
+        return iter_csv(path)
+    return iter_yaml_documents(path)
+
+
+def iter_task_specs(task_dicts: Iterable[Dict[str, Any]]) -> Iterator[TaskSpec]:
+    """
+    Build ``TaskSpec``s as they are read, checking for duplicate names and unknown
+    dependencies along the way. Without the whole list at hand, every task has to come
+    after the tasks it depends on.
+    """
+    names = set()
+    for idx, task_dict in enumerate(task_dicts):
+        if not isinstance(task_dict, dict):
+            raise ConfigError(f"task {idx} is not a mapping: {task_dict!r}")
+        task = TaskSpec.from_yaml(idx, **task_dict)
+        if task.name in names:
+            raise ConfigError(f"duplicate task name {task.name}")
+        for dep in task.depends_on:
+            if dep not in names:
+                raise ConfigError(
+                    f"task {task.name} depends on {dep}, which does not come before it"
+                )
+        names.add(task.name)
+        yield task
+
+
+def windows(tasks: Iterable[TaskSpec], size: int) -> Iterator[List[TaskSpec]]:
+    """Lists of up to ``size`` tasks from ``tasks``, in order"""
+    window: List[TaskSpec] = []
+    for task in tasks:
+        window.append(task)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
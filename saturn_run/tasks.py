@@ -1,5 +1,50 @@
-from dataclasses import dataclass
-from typing import List, Optional, Union
+import hashlib
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from saturn_run.errors import ConfigError
+from saturn_run.utils import parse_bytes
+
+# predicted priorities run from 0 to one below this, so they only order tasks of the
+# same ``priority`` (see ``TaskSpec.rank``)
+PREDICTED_PRIORITIES = 32
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How many times a task is run before it fails for good (``max_attempts`` counts
+    the first run), which exit codes are worth another attempt (any non-zero exit code
+    if ``exit_codes`` is None), and whether a task whose worker went away, e.g. a
+    preempted spot instance, is run again.
+    """
+
+    max_attempts: int = 1
+    exit_codes: Optional[Tuple[int, ...]] = None
+    worker_lost: bool = True
+
+    @classmethod
+    def from_yaml(
+        cls,
+        max_attempts: int = 3,
+        exit_codes: Optional[List[int]] = None,
+        worker_lost: bool = True,
+    ) -> "RetryPolicy":
+        if max_attempts < 1:
+            raise ConfigError(f"max_attempts must be at least 1, got {max_attempts}")
+        return cls(
+            max_attempts=int(max_attempts),
+            exit_codes=tuple(int(c) for c in exit_codes) if exit_codes is not None else None,
+            worker_lost=bool(worker_lost),
+        )
+
+    def retries(self, exit_code: int, number: int) -> bool:
+        """Whether attempt ``number`` (from 0), which exited with ``exit_code``, is retried"""
+        if exit_code == 0 or number + 1 >= self.max_attempts:
+            return False
+        return self.exit_codes is None or exit_code in self.exit_codes
 
 
 @dataclass
@@ -7,6 +52,30 @@ class TaskSpec:
     name: str
     command: Union[str, List[str]]
     shell: bool = True
+    # CPUs and bytes of memory the task needs, and any custom resources (e.g. GPU)
+    cpus: Optional[float] = None
+    memory: Optional[int] = None
+    resources: Dict[str, float] = field(default_factory=dict)
+    # names of tasks that must finish successfully before this one starts
+    depends_on: List[str] = field(default_factory=list)
+    # files or directories the task reads, which are part of its cache key
+    inputs: List[str] = field(default_factory=list)
+    # tasks with a higher priority start first
+    priority: Optional[int] = None
+    # how the task is retried when it fails, if at all
+    retry: Optional[RetryPolicy] = None
+    # set when the run is submitted, if the results backend has a cache
+    cache_key: Optional[str] = None
+    # unix time the task was submitted, set by the executor
+    submitted: Optional[float] = None
+    # seconds the task is expected to take, and the priority that follows from it among
+    # tasks of the same ``priority``, from the run history
+    predicted_seconds: Optional[float] = None
+    predicted_priority: Optional[int] = None
+    # set by the executor when the task may run more than once. Each run is an attempt,
+    # numbered under this prefix, that writes under a prefix of its own until it is
+    # committed (see ``Results.make_task_context``)
+    attempt_prefix: Optional[str] = None
 
     @classmethod
     def from_yaml(
@@ -15,7 +84,77 @@ class TaskSpec:
         command: Union[str, List[str]],
         shell: bool = True,
         name: Optional[str] = None,
+        cpus: Optional[float] = None,
+        memory: Optional[Union[int, str]] = None,
+        resources: Optional[Dict[str, float]] = None,
+        depends_on: Optional[Union[str, List[str]]] = None,
+        inputs: Optional[Union[str, List[str]]] = None,
+        priority: Optional[int] = None,
+        retry: Optional[Dict[str, Any]] = None,
     ) -> "TaskSpec":
         if name is None:
             name = str(count)
-        return cls(name=name, command=command, shell=shell)
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return cls(
+            name=name,
+            command=command,
+            shell=shell,
+            cpus=cpus,
+            memory=parse_bytes(memory) if memory is not None else None,
+            resources=dict(resources or {}),
+            depends_on=list(depends_on or []),
+            inputs=list(inputs or []),
+            priority=int(priority) if priority is not None else None,
+            retry=RetryPolicy.from_yaml(**retry) if retry is not None else None,
+        )
+
+    @property
+    def command_token(self) -> str:
+        """A digest of what the task runs, to recognize it across runs"""
+        data = json.dumps([self.command, self.shell])
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def rank(self) -> int:
+        """
+        The priority the task is started with: its ``priority`` first, then its
+        ``predicted_priority`` among tasks of the same priority
+        """
+        return (self.priority or 0) * PREDICTED_PRIORITIES + (self.predicted_priority or 0)
+
+    @property
+    def requirements(self) -> tuple:
+        """Hashable summary of what the task needs, for grouping tasks"""
+        return (self.cpus, self.memory, tuple(sorted(self.resources.items())))
+
+
+def sort_by_dependencies(tasks: List[TaskSpec]) -> List[TaskSpec]:
+    """
+    Order tasks so that every task comes after the tasks it depends on, keeping the
+    original order otherwise. Raises ConfigError for unknown dependencies and cycles.
+    """
+    by_name = {t.name: t for t in tasks}
+    waiting = {t.name: len(t.depends_on) for t in tasks}
+    dependents: Dict[str, List[str]] = {}
+    for t in tasks:
+        for dep in t.depends_on:
+            if dep not in by_name:
+                raise ConfigError(f"task {t.name} depends on unknown task {dep}")
+            dependents.setdefault(dep, []).append(t.name)
+
+    ready: Deque[TaskSpec] = deque(t for t in tasks if not t.depends_on)
+    ordered = []
+    while ready:
+        task = ready.popleft()
+        ordered.append(task)
+        for name in dependents.get(task.name, []):
+            waiting[name] -= 1
+            if not waiting[name]:
+                ready.append(by_name[name])
+    if len(ordered) != len(tasks):
+        cycle = sorted(name for name, count in waiting.items() if count)
+        raise ConfigError(f"tasks have circular dependencies: {', '.join(cycle)}")
+    return ordered
@@ -0,0 +1,125 @@
+import csv
+import itertools
+import re
+from os.path import splitext
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from saturn_run.errors import ConfigError
+from saturn_run.task_source import JSON_LINES_EXTENSIONS, iter_json_lines
+
+# how the axes of a template are combined
+CARTESIAN = "cartesian"
+ZIP = "zip"
+# {name} placeholders, only replaced for names that are parameters, so other braces
+# in a command (e.g. ${HOME} or awk programs) are left alone
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+Axis = Union[range, List[Any]]
+
+
+def parse_axis(name: str, axis: Any) -> Axis:
+    """A list of values, or a ``{start, stop, step}`` mapping that becomes a range"""
+    if isinstance(axis, dict):
+        unknown = set(axis) - {"start", "stop", "step"}
+        if unknown or "stop" not in axis:
+            raise ConfigError(f"parameter {name} must be a list or have start, stop and step")
+        return range(int(axis.get("start", 0)), int(axis["stop"]), int(axis.get("step", 1)))
+    if isinstance(axis, (list, tuple)):
+        return list(axis)
+    return [axis]
+
+
+def substitute(value: Any, params: Dict[str, Any]) -> Any:
+    """Replace ``{name}`` placeholders in ``value``, and in the strings it contains"""
+    if isinstance(value, str):
+        match = PLACEHOLDER.fullmatch(value)
+        if match and match.group(1) in params:
+            # keep the type of the parameter, e.g. for cpus: "{cpus}"
+            return params[match.group(1)]
+        return PLACEHOLDER.sub(
+            lambda m: str(params[m.group(1)]) if m.group(1) in params else m.group(0), value
+        )
+    if isinstance(value, list):
+        return [substitute(v, params) for v in value]
+    if isinstance(value, dict):
+        return {k: substitute(v, params) for k, v in value.items()}
+    return value
+
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Rows of parameters from a CSV or JSON lines file"""
+    if splitext(path)[1].lower() in JSON_LINES_EXTENSIONS:
+        yield from iter_json_lines(path)
+        return
+    with open(path, "r", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+class TaskTemplate:
+    """
+    A task yaml entry with ``params`` and/or ``params_file``, which stands for one task
+    per combination of parameters. The other fields of the entry are those of a task,
+    with ``{name}`` placeholders for the parameters.
+
+    ``params`` maps names to lists of values, or to ``{start, stop, step}`` ranges. The
+    axes are combined with a ``cartesian`` product, or with ``zip``. Each row of
+    ``params_file`` (CSV or JSON lines) is combined with every combination of the axes.
+    Tasks are produced lazily, in a deterministic order.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None,
+        product: str = CARTESIAN,
+        params_file: Optional[str] = None,
+    ):
+        if "command" not in fields:
+            raise ConfigError("a task template needs a command")
+        if product not in (CARTESIAN, ZIP):
+            raise ConfigError(f"product must be {CARTESIAN} or {ZIP}, got {product}")
+        self.fields = fields
+        self.axes = {name: parse_axis(name, axis) for name, axis in (params or {}).items()}
+        self.product = product
+        self.params_file = params_file
+        if product == ZIP and len({len(axis) for axis in self.axes.values()}) > 1:
+            raise ConfigError("parameters combined with zip must have the same number of values")
+
+    @classmethod
+    def from_yaml(
+        cls,
+        params: Optional[Dict[str, Any]] = None,
+        product: str = CARTESIAN,
+        params_file: Optional[str] = None,
+        **fields,
+    ) -> "TaskTemplate":
+        return cls(dict(fields), params=params, product=product, params_file=params_file)
+
+    def combinations(self) -> Iterator[Dict[str, Any]]:
+        names = list(self.axes)
+        axes: Sequence[Axis] = [self.axes[n] for n in names]
+        values: Iterable[tuple] = zip(*axes) if self.product == ZIP else itertools.product(*axes)
+        for combination in values:
+            yield dict(zip(names, combination))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """The task yaml entries this template stands for"""
+        rows: Iterable[Dict[str, Any]] = [{}]
+        if self.params_file:
+            rows = read_rows(self.params_file)
+        for row in rows:
+            for combination in self.combinations():
+                yield substitute(self.fields, {**row, **combination})
+
+
+def is_template(task: Any) -> bool:
+    return isinstance(task, dict) and ("params" in task or "params_file" in task)
+
+
+def expand_templates(tasks: Iterable[Any]) -> Iterator[Any]:
+    """Task yaml entries, with templates expanded as they are reached"""
+    for task in tasks:
+        if is_template(task):
+            yield from TaskTemplate.from_yaml(**task)
+        else:
+            yield task
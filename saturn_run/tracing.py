@@ -0,0 +1,312 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from os.path import expanduser
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from saturn_run.errors import ConfigError
+from saturn_run.utils import resolve_backend
+
+# JSON of the exporter's yaml section. It is set when a run configures tracing, so that
+# processes started afterwards (e.g. the workers of a LocalCluster) trace too. Set it
+# on remote workers to trace the tasks they run.
+TRACE_ENV = "SATURN_RUN_TRACE"
+DEFAULT_TRACE_PATH = "~/.saturn-run/traces.jsonl"
+
+
+@dataclass
+class Span:
+    """A timed phase of a run. ``trace_id`` is the name of the run."""
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    # unix time the phase started, and how long it took in seconds
+    start: float = 0.0
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+
+class SpanExporter:
+    """Receives spans as they start and end"""
+
+    # class_spec -> exporter, or the module:attribute path it is imported from
+    backends: Dict[str, Union[str, Callable[..., "SpanExporter"]]] = {}
+
+    def on_start(self, span: Span):
+        """Called when ``span`` starts, before its children"""
+
+    def export(self, span: Span):
+        """Called when ``span`` has ended"""
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+    @classmethod
+    def create(cls, class_spec: str, **kwargs) -> "SpanExporter":
+        return resolve_backend(cls.backends, class_spec)(**kwargs)
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Appends every span to ``path`` as a line of JSON. Lines are written with a single
+    ``write``, so processes on one machine can share a file.
+    """
+
+    def __init__(self, path: str = DEFAULT_TRACE_PATH):
+        self.path = expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = (json.dumps(asdict(span), default=str) + "\n").encode("utf-8")
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+class OpenTelemetryExporter(SpanExporter):
+    """
+    Forwards spans to an OpenTelemetry collector over OTLP (gRPC). Needs the
+    ``opentelemetry-sdk`` and ``opentelemetry-exporter-otlp`` packages.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = "localhost:4317",
+        service_name: str = "saturn-run",
+        insecure: bool = True,
+    ):
+        try:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError as e:
+            raise ConfigError(
+                "OpenTelemetryExporter needs opentelemetry-sdk and opentelemetry-exporter-otlp"
+            ) from e
+
+        self.provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        self.provider.add_span_processor(
+            BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint, insecure=insecure))
+        )
+        self.tracer = self.provider.get_tracer("saturn_run")
+        self.lock = threading.Lock()
+        # OpenTelemetry spans that have started and not ended, by our span_id
+        self.open: Dict[str, Any] = {}
+
+    def on_start(self, span: Span):
+        from opentelemetry import trace
+
+        with self.lock:
+            parent = self.open.get(span.parent_id) if span.parent_id else None
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.tracer.start_span(
+            span.name,
+            context=context,
+            start_time=int(span.start * 1e9),
+            attributes={"saturn_run.run": span.trace_id, **otel_attributes(span.attributes)},
+        )
+        with self.lock:
+            self.open[span.span_id] = otel_span
+
+    def export(self, span: Span):
+        with self.lock:
+            otel_span = self.open.pop(span.span_id, None)
+        if otel_span is None:
+            # spans recorded after the fact (see ``record_span``) never started
+            self.on_start(span)
+            with self.lock:
+                otel_span = self.open.pop(span.span_id)
+        otel_span.set_attributes(otel_attributes(span.attributes))
+        otel_span.end(end_time=int(span.end * 1e9))
+
+    def shutdown(self):
+        self.provider.shutdown()
+
+
+def otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """OpenTelemetry only takes str, bool, int and float attributes"""
+    return {
+        k: v if isinstance(v, (str, bool, int, float)) else str(v)
+        for k, v in attributes.items()
+        if v is not None
+    }
+
+
+SpanExporter.backends["JsonLinesExporter"] = JsonLinesExporter
+SpanExporter.backends["OpenTelemetryExporter"] = OpenTelemetryExporter
+
+_exporter: Optional[SpanExporter] = None
+_configured = False
+_configure_lock = threading.Lock()
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "saturn_run_span", default=None
+)
+
+
+def configure(exporter: Optional[SpanExporter]):
+    """Send spans from this process to ``exporter``, or stop tracing if it is None"""
+    global _exporter, _configured  # pylint: disable=global-statement
+    with _configure_lock:
+        if _exporter is not None and _exporter is not exporter:
+            _exporter.shutdown()
+        _exporter = exporter
+        _configured = True
+
+
+def configure_from_yaml(tracing: Optional[Dict[str, Any]]):
+    """
+    Configure tracing from the ``tracing`` section of a run yaml, and pass it on to
+    processes started from this one.
+    """
+    if not tracing:
+        return
+    configure(SpanExporter.create(**tracing))
+    os.environ[TRACE_ENV] = json.dumps(dict(tracing))
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    """The exporter of this process, configured from ``SATURN_RUN_TRACE`` on first use"""
+    global _exporter, _configured  # pylint: disable=global-statement
+    if _configured:
+        return _exporter
+    with _configure_lock:
+        if not _configured:
+            spec = os.environ.get(TRACE_ENV)
+            _exporter = SpanExporter.create(**json.loads(spec)) if spec else None
+            _configured = True
+    return _exporter
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Time the body as a span called ``name``, nested in the current span. Spans take
+    the ``trace_id`` of their parent unless one is given. Does nothing, and yields
+    None, if tracing is not configured.
+    """
+    exporter = get_exporter()
+    if exporter is None:
+        yield None
+        return
+    parent = _current.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else ""
+    s = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        start=time.time(),
+        attributes=attributes,
+    )
+    exporter.on_start(s)
+    token = _current.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        s.duration = time.perf_counter() - started
+        _current.reset(token)
+        exporter.export(s)
+
+
+def record_span(name: str, start: float, end: float, trace_id: Optional[str] = None, **attributes):
+    """
+    Export a span for a phase that has already happened, e.g. the time a task spent
+    queued before it started, nested in the current span.
+    """
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    parent = _current.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else ""
+    exporter.export(
+        Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start=start,
+            duration=max(0.0, end - start),
+            attributes=attributes,
+        )
+    )
+
+
+def read_spans(paths: Iterable[str], trace_id: Optional[str] = None) -> List[Span]:
+    """Spans from the files written by ``JsonLinesExporter``, optionally for one run"""
+    spans = []
+    for path in paths:
+        with open(expanduser(path), "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                s = Span(**json.loads(line))
+                if trace_id is None or s.trace_id == trace_id:
+                    spans.append(s)
+    return spans
+
+
+def percentile(values: List[float], q: float) -> float:
+    """The ``q`` percentile of sorted ``values``, by nearest rank"""
+    rank = math.ceil(q / 100 * len(values))
+    return values[min(len(values), max(1, rank)) - 1]
+
+
+def phase_breakdown(spans: Iterable[Span]) -> str:
+    """A table of the latency of each phase (span name), slowest in total first"""
+    durations: Dict[str, List[float]] = {}
+    for s in spans:
+        durations.setdefault(s.name, []).append(s.duration)
+    if not durations:
+        return "no spans"
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append(
+            (
+                name,
+                len(values),
+                sum(values),
+                sum(values) / len(values),
+                percentile(values, 50),
+                percentile(values, 95),
+                values[-1],
+            )
+        )
+    rows.sort(key=lambda r: r[2], reverse=True)
+    width = max(len("phase"), max(len(r[0]) for r in rows))
+    lines = [
+        f"{'phase':<{width}} {'count':>8} {'total':>10} {'mean':>9} {'p50':>9} {'p95':>9} "
+        f"{'max':>9}"
+    ]
+    for name, count, total, mean, p50, p95, most in rows:
+        lines.append(
+            f"{name:<{width}} {count:>8} {total:>9.3f}s {mean:>8.3f}s {p50:>8.3f}s "
+            f"{p95:>8.3f}s {most:>8.3f}s"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,79 @@
+import re
+from importlib import import_module
+from typing import Any, Callable, Dict, Union
+
+from saturn_run.errors import ConfigError
+
+BYTE_UNITS = {
+    "": 1,
+    "b": 1,
+    "kb": 10**3,
+    "mb": 10**6,
+    "gb": 10**9,
+    "tb": 10**12,
+    "kib": 2**10,
+    "mib": 2**20,
+    "gib": 2**30,
+    "tib": 2**40,
+}
+
+
+def parse_bytes(value: Union[int, float, str]) -> int:
+    """
+    Parse a size like ``512MiB``, ``4 GB`` or ``1024`` into a number of bytes.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([a-zA-Z]*)\s*", value)
+    if match is None or match.group(2).lower() not in BYTE_UNITS:
+        raise ValueError(f"could not parse {value!r} as a number of bytes")
+    return int(float(match.group(1)) * BYTE_UNITS[match.group(2).lower()])
+
+
+def format_bytes(value: int) -> str:
+    """Format a number of bytes like ``1.5GiB``"""
+    size = float(value)
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+
+DURATION_UNITS = {
+    "": 1,
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+
+def parse_duration(value: Union[int, float, str]) -> float:
+    """
+    Parse a duration like ``30m``, ``7d`` or ``3600`` into a number of seconds.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([a-zA-Z]*)\s*", value)
+    if match is None or match.group(2).lower() not in DURATION_UNITS:
+        raise ValueError(f"could not parse {value!r} as a duration")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2).lower()]
+
+
+def resolve_backend(backends: Dict[str, Any], class_spec: str) -> Callable:
+    """
+    Look up ``class_spec`` in a registry of backends. Entries are either the backend
+    itself or a ``module:attribute`` path, which is imported on first use so that only
+    the dependencies of the configured backend are loaded. ``class_spec`` can also be
+    a ``module:attribute`` path of its own, for backends outside of saturn_run.
+    """
+    backend = backends.get(class_spec, class_spec)
+    if isinstance(backend, str):
+        module, _, attribute = backend.partition(":")
+        if not attribute:
+            raise ConfigError(f"unknown class_spec {class_spec}, expected one of {list(backends)}")
+        backend = getattr(import_module(module), attribute)
+        backends[class_spec] = backend
+    return backend
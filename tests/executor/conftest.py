@@ -0,0 +1,103 @@
+from unittest.mock import Mock
+
+import pytest
+from saturn_run.executor import dask
+from saturn_run.progress import Progress
+
+
+class FakeAsCompleted:
+    """
+    Stands in for ``as_completed``, handing out ``steps`` in order. Each step is a batch
+    of futures that are done, or None for a poll that finds none. Futures only take
+    their ``done_status`` once they are handed out.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.added = []
+
+    def is_empty(self):
+        return not self.steps
+
+    def has_ready(self):
+        if self.steps and self.steps[0] is None:
+            self.steps.pop(0)
+            return False
+        return bool(self.steps)
+
+    def next_batch(self, block=True):
+        batch = self.steps.pop(0)
+        for future in batch:
+            future.status = future.done_status
+        return batch
+
+    def batches(self):
+        while self.steps:
+            if self.has_ready():
+                yield self.next_batch()
+
+    def add(self, future):
+        self.added.append(future)
+
+
+@pytest.fixture
+def completed(monkeypatch):
+    """The ``as_completed`` of the next collect, whose ``steps`` the test sets"""
+    fake = FakeAsCompleted()
+    monkeypatch.setattr(dask, "as_completed", lambda futures: fake)
+    return fake
+
+
+@pytest.fixture
+def collect_client():
+    """
+    A client for collecting the run published as ``client.manifest``, whose futures
+    return ``client.outcomes[key]`` when gathered
+    """
+    client = Mock()
+    client.manifest = []
+    client.outcomes = {}
+    client.get_dataset.side_effect = lambda name: client.manifest
+    client.gather.side_effect = lambda futures: [client.outcomes[f.key] for f in futures]
+    client.processing.return_value = {}
+    client.scheduler_info.return_value = {"workers": {"w1": {}, "w2": {}}}
+    return client
+
+
+def make_future(client, key, status="finished"):
+    future = Mock()
+    future.key = key
+    future.status = "pending"
+    future.done_status = status
+    future.client = client
+    if status != "finished":
+        future.result.side_effect = RuntimeError(f"{key} {status}")
+    return future
+
+
+@pytest.fixture
+def client_future(collect_client):
+    """
+    Makes futures of ``collect_client``, e.g. ``future("a", status="error")`` for one
+    that errors once it is done
+    """
+    return lambda key, status="finished": make_future(collect_client, key, status)
+
+
+@pytest.fixture
+def collect(monkeypatch, collect_client):
+    """Collects the run ``run`` with ``collect_client``, and returns its ``Progress``"""
+
+    def run(executor, results):
+        progresses = []
+
+        def make_progress(total):
+            progresses.append(Progress(total))
+            return progresses[-1]
+
+        monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=collect_client))
+        monkeypatch.setattr(dask, "Progress", make_progress)
+        executor.collect("run", results)
+        return progresses[0]
+
+    return run
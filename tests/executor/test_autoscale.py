@@ -0,0 +1,72 @@
+import time
+from unittest.mock import Mock
+
+from pytest import raises
+from saturn_run.errors import ConfigError
+from saturn_run.executor import DaskExecutor
+from saturn_run.executor.autoscale import AutoscalePolicy, RunDemand
+from saturn_run.results import LocalResults
+from saturn_run.status import CACHED, TaskRecord
+from saturn_run.tasks import TaskSpec
+
+
+def test_policy():
+    policy = AutoscalePolicy.from_yaml(min_workers=1, max_workers=10, target_time="10m")
+    assert policy.target_time == 600
+    # nothing left
+    assert policy.workers(0, 0, 4, None, None) == 1
+    # no durations yet: a thread for every task that can run
+    assert policy.workers(20, 20, 4, None, 600) == 5
+    assert policy.workers(200, 200, 4, None, 600) == 10
+    # 100 tasks of 60s on 4 threads a worker, in 300s
+    assert policy.workers(100, 100, 4, 60, 300) == 5
+    # no more workers than tasks that can run at once
+    assert policy.workers(100, 8, 4, 60, 300) == 2
+    # past the target, as fast as possible
+    assert policy.workers(100, 100, 4, 60, -10) == 10
+
+    with raises(ConfigError):
+        AutoscalePolicy.from_yaml(min_workers=5, max_workers=2)
+
+
+def test_demand():
+    demand = RunDemand(AutoscalePolicy(max_workers=100, target_time=100))
+    demand.add("a", tasks=1, cpus=4)
+    # a batch of 10 tasks, running 2 at a time
+    demand.add("b", tasks=10, cpus=None, width=2)
+    demand.expect([(Mock(key="b"), ["b1"]), (Mock(key="c"), ["c1", "c2"])])
+    assert demand.pending == {"a": (1, 4.0, 4.0), "b": (10, 1.0, 2.0), "c": (2, 1.0, 1.0)}
+    # 7 threads at most
+    assert demand.workers(threads_per_worker=2) == 4
+
+    now = time.time()
+    demand.finish("a", [TaskRecord(name="a", state="finished", start=now - 50, end=now)])
+    demand.finish("c", [TaskRecord(name="c1", state=CACHED, start=now - 1000, end=now), None])
+    assert demand.finished_tasks == 1
+    # 10 tasks of 50s left, with 100s to go: 5 threads, but only 2 at once
+    assert demand.workers(threads_per_worker=1) == 2
+    demand.finish("b")
+    assert demand.workers(threads_per_worker=1) == 0
+
+
+def test_executor_autoscale(monkeypatch, tmpdir):
+    with raises(ConfigError):
+        DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", autoscale={"max_workers": 2})
+
+    executor = DaskExecutor(
+        cluster_class="LocalCluster", autoscale={"max_workers": 8}, batch_size=2
+    )
+    client = Mock()
+    client.datasets = {}
+    client.map.side_effect = lambda *args, **kwargs: [Mock(key=k) for k in kwargs["key"]]
+    client.scheduler_info.return_value = {"workers": {}}
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    executor.cluster = Mock(plan=set(), scheduler_info={"workers": {}}, new_spec={})
+    executor.demand = RunDemand(executor.autoscale)
+    tasks = [TaskSpec(name=str(idx), command="echo", cpus=2) for idx in range(5)]
+
+    executor.execute(tasks, LocalResults(str(tmpdir), name="run"), "run")
+
+    assert sorted(executor.demand.pending.values()) == [(1, 2.0, 2.0), (2, 2.0, 2.0), (2, 2.0, 2.0)]
+    # scaled up at submit: 3 batches of 2 threads, on workers of 1 thread
+    executor.cluster.scale.assert_called_once_with(6)
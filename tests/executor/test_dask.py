@@ -1,8 +1,22 @@
+import asyncio
+import operator
+import os
+import threading
+from os.path import join
 from unittest.mock import Mock, call
 
+from distributed import Reschedule
+from distributed.core import Status
 from pytest import raises
-from saturn_run.executor import DaskExecutor
+from saturn_run import file_sync, processes
+from saturn_run.errors import ConfigError
+from saturn_run.executor import DaskExecutor, dask
 from saturn_run.file_sync import FileSync
+from saturn_run.processes import execute_batch, execute_many, execute_task
+from saturn_run.results import LocalResults
+from saturn_run.results.base import FAILED, FINISHED
+from saturn_run.status import ERROR, StatusIndex, TaskRecord
+from saturn_run.tasks import PREDICTED_PRIORITIES, TaskSpec
 
 
 def test_sync_files(monkeypatch):
@@ -30,3 +44,340 @@ def test_sync_files_mismatched_src_dest(monkeypatch):
     monkeypatch.setattr(plugins, "sync_files", sync_files)
     with raises(NotImplementedError):
         executor.sync_files([FileSync(src="a", dest="v")])
+
+
+def test_execute_publishes_one_manifest(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    client = Mock()
+    client.datasets = {}
+    client.map.return_value = ["fut-a", "fut-b"]
+    client.scheduler_info.return_value = {"workers": {}}
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [TaskSpec(name="a", command="echo a"), TaskSpec(name="b", command="echo b")]
+
+    executor.execute(tasks, results, "run")
+
+    client.map.assert_called_once()
+    args = client.map.call_args.args
+    assert args[0] is execute_task
+    assert args[2] == tasks
+    assert client.datasets == {"srun/run": [("fut-a", ["a"]), ("fut-b", ["b"])]}
+
+
+def test_execute_async_batches(monkeypatch, tmpdir):
+    executor = DaskExecutor(
+        scheduler_address="tcp://127.0.0.1:8786", async_concurrency=10, batch_size=2
+    )
+    client = Mock()
+    client.datasets = {}
+    client.map.return_value = ["fut-0", "fut-1"]
+    client.scheduler_info.return_value = {"workers": {}}
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [TaskSpec(name=str(idx), command=f"echo {idx}") for idx in range(3)]
+
+    executor.execute(tasks, results, "run")
+
+    args = client.map.call_args.args
+    assert args[0] is execute_many
+    assert [[t.name for t in batch] for batch in args[2]] == [["0", "1"], ["2"]]
+    assert client.map.call_args.kwargs["concurrency"] == 10
+    assert client.datasets == {"srun/run": [("fut-0", ["0", "1"]), ("fut-1", ["2"])]}
+
+
+def test_execute_sequential_batches(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", batch_size=100)
+    client = Mock()
+    client.datasets = {}
+    client.map.return_value = ["fut-0"]
+    client.scheduler_info.return_value = {"workers": {}}
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [TaskSpec(name=str(idx), command=f"echo {idx}") for idx in range(3)]
+
+    # the batch size from the task config wins
+    executor.execute(tasks, results, "run", batch_size=3)
+
+    args = client.map.call_args.args
+    assert args[0] is execute_batch
+    assert [[t.name for t in batch] for batch in args[2]] == [["0", "1", "2"]]
+    assert "concurrency" not in client.map.call_args.kwargs
+    assert client.datasets == {"srun/run": [("fut-0", ["0", "1", "2"])]}
+
+
+def test_execute_resources(monkeypatch, tmpdir, caplog):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    client = Mock()
+    client.datasets = {}
+    client.map.side_effect = lambda func, results, tasks, **kwargs: [Mock() for _ in tasks]
+    client.scheduler_info.return_value = {
+        "workers": {
+            "small": {"nthreads": 2, "memory_limit": 2**30, "resources": {"GPU": 1}},
+            "big": {"nthreads": 8, "memory_limit": 2**34, "resources": {}},
+        }
+    }
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [
+        TaskSpec(name="a", command="echo a"),
+        TaskSpec(name="b", command="echo b", cpus=4, memory=2**32),
+        TaskSpec(name="c", command="echo c", resources={"GPU": 1}),
+        TaskSpec(name="d", command="echo d"),
+    ]
+
+    executor.execute(tasks, results, "run")
+
+    calls = client.map.call_args_list
+    assert [[t.name for t in c.args[2]] for c in calls] == [["a", "d"], ["b"], ["c"]]
+    assert "workers" not in calls[0].kwargs and "resources" not in calls[0].kwargs
+    assert calls[1].kwargs["workers"] == ["big"]
+    assert calls[2].kwargs["resources"] == {"GPU": 1}
+    # b's memory only picked the worker, and that is said once
+    assert executor.warned_unreserved_memory
+    assert len([r for r in caplog.records if "not reserved" in r.getMessage()]) == 1
+
+
+def test_execute_resources_unsatisfiable(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    client = Mock()
+    client.scheduler_info.return_value = {
+        "workers": {"small": {"nthreads": 2, "memory_limit": 2**30, "resources": {}}}
+    }
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    with raises(ConfigError):
+        executor.execute([TaskSpec(name="a", command="echo a", cpus=4)], results, "run")
+
+
+def test_execute_dependencies(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    client = Mock()
+    client.datasets = {}
+    client.scheduler_info.return_value = {"workers": {}}
+    client.map.side_effect = lambda func, results, tasks, **kwargs: [f"fut-{t.name}" for t in tasks]
+    client.submit.side_effect = lambda func, results, task, **kwargs: f"fut-{task.name}"
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [
+        TaskSpec(name="agg", command="echo agg", depends_on=["train"]),
+        TaskSpec(name="train", command="echo train", depends_on=["prep"]),
+        TaskSpec(name="prep", command="echo prep"),
+    ]
+
+    executor.execute(tasks, results, "run")
+
+    assert [c.args[2].name for c in client.submit.call_args_list] == ["train", "agg"]
+    assert client.submit.call_args_list[0].kwargs["upstream"] == ["fut-prep"]
+    assert client.submit.call_args_list[1].kwargs["upstream"] == ["fut-train"]
+    assert [names for _, names in client.datasets["srun/run"]] == [["prep"], ["train"], ["agg"]]
+
+
+def test_execute_streamed_windows(monkeypatch, tmpdir):
+    monkeypatch.setattr(dask, "SUBMIT_WINDOW", 2)
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", batch_size=10)
+    client = Mock()
+    client.datasets = {}
+    client.scheduler_info.return_value = {"workers": {}}
+    batch = Mock(key="batch")
+    client.map.return_value = [batch]
+    record = Mock()
+    client.submit.side_effect = lambda func, *args, **kwargs: (
+        record if func is operator.getitem else f"fut-{args[1].name}"
+    )
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = (
+        TaskSpec(name=name, command="echo", depends_on=deps)
+        for name, deps in [("a", []), ("b", []), ("c", ["b"])]
+    )
+
+    executor.execute(tasks, results, "run")
+
+    # a and b are batched in the first window, before anything depends on b, so c
+    # picks b's record out of the batch's
+    assert [[t.name for t in batch] for batch in client.map.call_args.args[2]] == [["a", "b"]]
+    getitem, submit_c = client.submit.call_args_list
+    assert getitem.args == (operator.getitem, batch, 1)
+    assert submit_c.kwargs["upstream"] == [record]
+    assert client.datasets["srun/run"] == [(batch, ["a", "b"]), ("fut-c", ["c"])]
+
+
+def test_client_is_cached(monkeypatch):
+    cluster_class = Mock()
+    monkeypatch.setitem(DaskExecutor.cluster_classes, "FakeCluster", cluster_class)
+    client_class = Mock()
+    client_class.return_value.status = "running"
+    monkeypatch.setattr(dask, "Client", client_class)
+    executor = DaskExecutor(cluster_class="FakeCluster", cluster_kwargs={"n_workers": 2})
+
+    assert executor.get_dask_client() is executor.get_dask_client()
+    cluster_class.assert_called_once_with(n_workers=2)
+    client_class.assert_called_once_with(cluster_class.return_value)
+
+    executor.close()
+    client_class.return_value.close.assert_called_once()
+    cluster_class.return_value.close.assert_called_once()
+
+    with raises(ConfigError):
+        DaskExecutor(cluster_class="NoSuchCluster")
+    with raises(ConfigError):
+        DaskExecutor()
+
+
+def test_warm_pool_client(monkeypatch):
+    monkeypatch.setitem(DaskExecutor.cluster_classes, "FakeCluster", Mock())
+    client_class = Mock()
+    client_class.return_value.status = "running"
+    monkeypatch.setattr(dask, "Client", client_class)
+    connect = Mock(return_value="tcp://10.0.0.1:8786")
+    monkeypatch.setattr(dask.warm_pool, "connect", connect)
+    executor = DaskExecutor(cluster_class="FakeCluster", warm_pool=True, warm_pool_idle_timeout=60)
+
+    executor.get_dask_client()
+    connect.assert_called_once_with("FakeCluster", None, 60)
+    client_class.assert_called_once_with("tcp://10.0.0.1:8786", timeout=10)
+    # the pool's cluster outlives the executor
+    executor.close()
+    assert DaskExecutor.cluster_classes["FakeCluster"].call_count == 0
+
+
+def test_execute_priorities(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", batch_size=2)
+    client = Mock()
+    client.datasets = {}
+    client.map.side_effect = lambda *args, **kwargs: [Mock(key=k) for k in kwargs["key"]]
+    client.scheduler_info.return_value = {"workers": {}}
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    priorities = [0, 7, 0, 7, 3]
+    tasks = [
+        TaskSpec(name=str(idx), command=f"echo {idx}", priority=p)
+        for idx, p in enumerate(priorities)
+    ]
+
+    executor.execute(tasks, LocalResults(str(tmpdir), name="run"), "run")
+
+    # one call per priority, highest first, and only tasks of the same priority are batched
+    calls = [
+        (c.kwargs["priority"], [[t.name for t in b] for b in c.args[2]])
+        for c in client.map.call_args_list
+    ]
+    assert calls == [
+        (7 * PREDICTED_PRIORITIES, [["1", "3"]]),
+        (3 * PREDICTED_PRIORITIES, [["4"]]),
+        (0, [["0", "2"]]),
+    ]
+
+
+def test_cleanup_plugin_registered_once(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    client = Mock()
+    client.datasets = {}
+    client.map.return_value = []
+    client.scheduler_info.return_value = {"workers": {}}
+    client.run_on_scheduler.return_value = False
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+
+    executor.execute([TaskSpec(name="a", command="echo a")], results, "run")
+    client.register_worker_plugin.assert_called_once()
+    assert isinstance(client.register_worker_plugin.call_args.args[0], dask.RegisterCleanup)
+
+    # another run on the same cluster must not replace it, which would tear it down
+    client.run_on_scheduler.return_value = True
+    executor.execute([TaskSpec(name="a", command="echo a")], results, "other")
+    client.register_worker_plugin.assert_called_once()
+
+    scheduler = Mock()
+    scheduler.worker_plugins = {"register_cleanup": object()}
+    assert dask.worker_plugin_registered(scheduler, "register_cleanup")
+    assert not dask.worker_plugin_registered(scheduler, "register_files")
+
+
+def test_cleanup_plugin_teardown(monkeypatch):
+    terminate = Mock()
+    monkeypatch.setattr(dask, "terminate_all_processes", terminate)
+    plugin = dask.RegisterCleanup(grace_period=5)
+    worker = Mock()
+
+    # removing the plugin from a running worker leaves its tasks alone
+    worker.status = Status.running
+    asyncio.run(plugin.teardown(worker))
+    terminate.assert_not_called()
+
+    worker.status = Status.closing
+    processes.terminating.set()
+    asyncio.run(plugin.teardown(worker))
+    terminate.assert_called_once_with(5)
+    # the process's other workers keep running tasks
+    assert not processes.terminating.is_set()
+
+
+def test_batches_are_handed_back_when_stopping(monkeypatch, tmpdir):
+    monkeypatch.setattr(processes, "terminating", threading.Event())
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [TaskSpec(name="a", command="true", shell=True)]
+    processes.terminating.set()
+
+    with raises(Reschedule):
+        execute_batch(results, tasks)
+    with raises(Reschedule):
+        execute_many(results, tasks)
+    assert not os.path.exists(os.path.join(str(tmpdir), "a"))
+
+
+def test_sync_files_rescatters_lost_chunks(monkeypatch, tmpdir):
+    monkeypatch.setattr(file_sync, "CHUNK_SIZE", 4)
+    path = str(tmpdir) + "/"
+    with open(join(path, "a"), "wb") as f:
+        f.write(b"01234567")
+    manifest = file_sync.build_manifest(path)
+    kept, lost = manifest["files"]["a"]["chunks"]
+    client = Mock()
+    client.list_datasets.return_value = [f"{dask.PREFIX}{path}"]
+    client.get_dataset.return_value = {
+        "chunks": {kept: Mock(status="finished"), lost: Mock(status="cancelled")}
+    }
+    client.scatter.side_effect = lambda chunks, **kwargs: {k: Mock() for k in chunks}
+
+    dask.sync_files(client, path)
+
+    # only the chunk that went away is sent again, to a few workers rather than all
+    client.scatter.assert_called_once()
+    assert list(client.scatter.call_args.args[0]) == [f"{dask.CHUNK_PREFIX}{lost}"]
+    assert client.scatter.call_args.kwargs == {}
+    client.replicate.assert_called_once()
+    assert client.replicate.call_args.kwargs == {"n": dask.CHUNK_REPLICAS}
+
+
+def test_collect(monkeypatch, tmpdir, completed, collect_client, client_future, collect):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786")
+    results = LocalResults(str(tmpdir), name="run")
+    ok = client_future("a")
+    broken = client_future("b", status="error")
+    batch = client_future("batch")
+    collect_client.manifest = [(ok, ["a"]), (broken, ["b"]), (batch, ["c", "d", "e"])]
+    collect_client.outcomes = {
+        "a": TaskRecord.from_exit_code("a", 0),
+        # a batch returns a record per task, and None for tasks that could not run
+        "batch": [TaskRecord.from_exit_code("c", 0), None, TaskRecord.from_exit_code("e", 1)],
+    }
+    completed.steps = [[ok, broken], [batch]]
+    monkeypatch.setattr(dask, "REPUBLISH_INTERVAL", 0)
+
+    progress = collect(executor, results)
+
+    assert (progress.total, progress.done, progress.failed) == (5, 2, 3)
+    # one round trip per batch, for the futures that finished
+    assert collect_client.gather.call_args_list == [call([ok]), call([batch])]
+    # what is left is republished, so reconnecting only tracks that
+    collect_client.publish_dataset.assert_called_once_with(
+        **{"srun/run": [(batch, ["c", "d", "e"])]}, override=True
+    )
+    collect_client.unpublish_dataset.assert_called_once_with("srun/run")
+    index = StatusIndex(results.fetch_status_index())
+    try:
+        assert index.counts() == {FINISHED: 2, ERROR: 2, FAILED: 1}
+        assert {r.name for r in index.records(state=ERROR)} == {"b", "d"}
+    finally:
+        index.close()
@@ -0,0 +1,112 @@
+import json
+from os.path import join
+
+from saturn_run.executor import LocalProcessExecutor
+from saturn_run.executor.local import RunState
+from saturn_run.results import LocalResults
+from saturn_run.status import StatusIndex
+from saturn_run.tasks import TaskSpec
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_execute_and_collect(tmpdir):
+    executor = LocalProcessExecutor(max_concurrency=2, state_dir=join(str(tmpdir), "state"))
+    results = LocalResults(join(str(tmpdir), "results"), name="run")
+    tasks = [TaskSpec(name=str(idx), command=f"echo {idx}; exit {idx % 2}") for idx in range(5)]
+
+    executor.execute(tasks, results, "run")
+    executor.collect("run", results)
+
+    for idx in range(5):
+        assert read(join(str(tmpdir), "results", str(idx), "stdout")) == f"{idx}\n"
+        assert read(join(str(tmpdir), "results", str(idx), "status")) == str(idx % 2)
+
+    events = list(executor.run_state("run").read_events())
+    finished = {e["task"]: e["exit_code"] for e in events if e["state"] == "finished"}
+    assert finished == {str(idx): idx % 2 for idx in range(5)}
+
+    index = StatusIndex(results.fetch_status_index())
+    assert index.counts() == {"finished": 3, "failed": 2}
+    assert {r.name for r in index.records(state="failed")} == {"1", "3"}
+    index.close()
+
+
+def test_run_state_follow(tmpdir):
+    state = RunState(str(tmpdir))
+    state.create(["a", "b"])
+    assert state.owner_alive()
+    assert state.task_names() == ["a", "b"]
+
+    state.record("a", "running")
+    assert [e["task"] for e in state.read_events()] == ["a"]
+    # only new events are returned
+    state.record("b", "running")
+    assert [e["task"] for e in state.read_events()] == ["b"]
+
+
+def test_cleanup_removes_dead_runs(tmpdir):
+    executor = LocalProcessExecutor(state_dir=str(tmpdir))
+    alive = executor.run_state("foo-alive")
+    alive.create([])
+    dead = executor.run_state("foo-dead")
+    dead.create([])
+    with open(dead.run_path, "w") as f:
+        json.dump({"pid": 2**22 + 1, "create_time": 0, "tasks": []}, f)
+
+    executor.cleanup("foo")
+
+    assert alive.exists()
+    assert not dead.exists()
+
+
+def test_execute_dependencies(tmpdir):
+    executor = LocalProcessExecutor(max_concurrency=4, state_dir=join(str(tmpdir), "state"))
+    results = LocalResults(join(str(tmpdir), "results"), name="run")
+    tasks = [
+        TaskSpec(name="agg", command="cat $UPSTREAM_RESULTS_DIR_TRAIN/out", depends_on=["train"]),
+        TaskSpec(name="train", command="sleep 0.2; echo trained > $RESULTS_DIR/out"),
+        TaskSpec(name="broken", command="exit 1"),
+        TaskSpec(name="after-broken", command="echo nope", depends_on=["broken"]),
+    ]
+
+    executor.execute(tasks, results, "run")
+    executor.collect("run")
+
+    assert read(join(str(tmpdir), "results", "agg", "stdout")) == "trained\n"
+    assert read(join(str(tmpdir), "results", "after-broken", "status")) == "upstream-failed"
+
+
+def test_execute_priorities(tmpdir):
+    executor = LocalProcessExecutor(max_concurrency=1, state_dir=join(str(tmpdir), "state"))
+    results = LocalResults(join(str(tmpdir), "results"), name="run")
+    tasks = [
+        TaskSpec(name="low", command="echo low"),
+        TaskSpec(name="high", command="echo high", priority=10),
+        TaskSpec(name="after-high", command="echo after", depends_on=["high"], priority=20),
+        TaskSpec(name="middle", command="echo middle", priority=5),
+    ]
+
+    executor.execute(tasks, results, "run")
+    executor.collect("run", results)
+
+    events = executor.run_state("run").read_events()
+    started = [e["task"] for e in events if e["state"] == "running"]
+    assert started == ["high", "after-high", "middle", "low"]
+
+
+def test_collect_stops_when_the_dispatcher_dies(tmpdir, monkeypatch, caplog):
+    executor = LocalProcessExecutor(state_dir=join(str(tmpdir), "state"))
+    results = LocalResults(join(str(tmpdir), "results"), name="run")
+
+    def dispatch(tasks, results, state):
+        raise RuntimeError("dispatcher died")
+
+    monkeypatch.setattr(executor, "dispatch", dispatch)
+    executor.execute([TaskSpec(name="a", command="true")], results, "run")
+    # returns instead of waiting for tasks that will never finish
+    executor.collect("run", results)
+    assert "1 tasks did not finish: a" in caplog.text
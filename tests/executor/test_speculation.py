@@ -0,0 +1,230 @@
+from unittest.mock import Mock
+
+import pytest
+from pytest import raises
+from saturn_run.errors import ConfigError
+from saturn_run.executor import DaskExecutor, dask
+from saturn_run.executor.speculation import SpeculationPolicy, Speculator
+from saturn_run.processes import cancel_attempts
+from saturn_run.results import LocalResults
+from saturn_run.results.base import FAILED, FINISHED
+from saturn_run.status import CACHED, ERROR, SUPERSEDED, StatusIndex, TaskRecord
+from saturn_run.tasks import PREDICTED_PRIORITIES, TaskSpec
+
+
+def future(key):
+    fut = Mock()
+    fut.key = key
+    return fut
+
+
+def test_policy():
+    policy = SpeculationPolicy.from_yaml(multiplier=3, min_seconds="1m")
+    assert policy.min_seconds == 60
+    # nothing to go by
+    assert policy.threshold(None, None) is None
+    # the prediction from the run history comes first
+    assert policy.threshold(100, 10) == 300
+    assert policy.threshold(None, 50) == 150
+    # but short tasks are never stragglers
+    assert policy.threshold(1, None) == 60
+
+    with raises(ConfigError):
+        SpeculationPolicy.from_yaml(multiplier=1)
+
+
+def test_stragglers():
+    speculator = Speculator(SpeculationPolicy(multiplier=2, min_seconds=1, min_finished=2))
+    predicted = TaskSpec(name="predicted", command="x", predicted_seconds=10, attempt_prefix="p")
+    unknown = TaskSpec(name="unknown", command="x", attempt_prefix="u")
+    speculator.track(future("p"), predicted, {})
+    speculator.track(future("u"), unknown, {})
+    # p is on its second attempt
+    run_times = {"w1": {"p/1": 15, "u/0": 100}, "w2": {"other/0": 100}}
+
+    assert speculator.stragglers(run_times) == []
+    # the median of finished tasks applies once there are enough of them, cached
+    # tasks do not count
+    speculator.finish(
+        [
+            TaskRecord(name="a", state="finished", start=0, end=10),
+            TaskRecord(name="b", state=CACHED, start=0, end=1),
+        ]
+    )
+    assert speculator.stragglers(run_times) == []
+    speculator.finish([TaskRecord(name="c", state="failed", start=0, end=30)])
+    assert speculator.median() == 20
+    assert speculator.stragglers(run_times) == [("u", "w1")]
+    run_times["w1"]["p/1"] = 25
+    assert speculator.stragglers(run_times) == [("p", "w1"), ("u", "w1")]
+
+    # a task only gets one copy
+    speculator.add_copy("u", future("u/copy"), "u/copy")
+    assert speculator.stragglers(run_times) == [("p", "w1")]
+
+
+def test_settle():
+    speculator = Speculator(SpeculationPolicy())
+    original = future("t")
+    copy = future("t/copy")
+    task = TaskSpec(name="t", command="x", attempt_prefix="t")
+    speculator.track(original, task, {})
+    speculator.add_copy("t", copy, "t/copy")
+
+    assert speculator.original_key("t/copy") == "t"
+    assert speculator.other("t") == (copy, "t/copy")
+    assert speculator.other("t/copy") == (original, "t")
+    # the copy finished first, so the original is the one to cancel
+    assert speculator.settle("t/copy") == (original, "t")
+    assert not speculator.tasks
+    assert not speculator.prefixes
+    assert not speculator.copies
+    assert speculator.original_key("t/copy") == "t/copy"
+
+
+def test_copy_priority():
+    speculator = Speculator(SpeculationPolicy())
+    assert speculator.copy_priority() == -1
+    speculator.track(future("a"), TaskSpec(name="a", command="x", attempt_prefix="a"), {})
+    speculator.track(
+        future("b"), TaskSpec(name="b", command="x", priority=-5, attempt_prefix="b"), {}
+    )
+    speculator.track(
+        future("c"), TaskSpec(name="c", command="x", priority=10, attempt_prefix="c"), {}
+    )
+    # copies go behind every task of the run that may still be waiting
+    assert speculator.copy_priority() == -5 * PREDICTED_PRIORITIES - 1
+    speculator.forget("b")
+    assert speculator.copy_priority() == -1
+
+
+def test_execute_tracks_tasks_without_dependents(monkeypatch, tmpdir):
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", speculation=True)
+    client = Mock()
+    client.datasets = {}
+    client.scheduler_info.return_value = {"workers": {}}
+    client.map.side_effect = lambda func, results, tasks, **kwargs: [future(t.name) for t in tasks]
+    client.submit.side_effect = lambda func, results, task, **kwargs: future(task.name)
+    monkeypatch.setattr(executor, "get_dask_client", Mock(return_value=client))
+    results = LocalResults(str(tmpdir), name="run")
+    tasks = [
+        TaskSpec(name="prep", command="echo prep"),
+        TaskSpec(name="train", command="echo train", depends_on=["prep"]),
+        TaskSpec(name="other", command="echo other"),
+    ]
+
+    executor.execute(tasks, results, "run")
+
+    # every task runs as attempts, but prep's future must stand for it, as train
+    # depends on it
+    assert all(t.attempt_prefix is not None for t in tasks)
+    speculator = executor.speculators["run"]
+    assert sorted(speculator.tasks) == ["other", "train"]
+    assert speculator.tasks["train"][2]["upstream"][0].key == "prep"
+
+
+def speculate_once(monkeypatch, collect_client, client_future, done_status):
+    """
+    Set up the run ``run`` with one task, ``t``, that is copied on the first poll.
+    Returns the executor, and the futures of the original and the copy, which end with
+    ``done_status`` (a pair of statuses).
+    """
+    executor = DaskExecutor(scheduler_address="tcp://127.0.0.1:8786", speculation=True)
+    original = client_future("t", status=done_status[0])
+    copy = client_future("t/copy", status=done_status[1])
+    collect_client.manifest = [(original, ["t"])]
+    collect_client.submit.return_value = copy
+    speculator = Speculator(SpeculationPolicy())
+    speculator.track(original, TaskSpec(name="t", command="x", attempt_prefix="t"), {})
+    monkeypatch.setattr(speculator, "due", Mock(side_effect=[True] + [False] * 10))
+    monkeypatch.setattr(speculator, "stragglers", Mock(return_value=[("t", "w1")]))
+    monkeypatch.setattr(dask, "SPECULATION_POLL_INTERVAL", 0)
+    executor.speculators["run"] = speculator
+    return executor, original, copy
+
+
+def counts(results):
+    index = StatusIndex(results.fetch_status_index())
+    try:
+        return index.counts()
+    finally:
+        index.close()
+
+
+def test_collect_copy_wins(monkeypatch, tmpdir, completed, collect_client, client_future, collect):
+    results = LocalResults(str(tmpdir), name="run")
+    executor, original, copy = speculate_once(
+        monkeypatch, collect_client, client_future, ("cancelled", "finished")
+    )
+    collect_client.outcomes = {"t/copy": TaskRecord.from_exit_code("t", 0)}
+    completed.steps = [None, [copy], [original]]
+
+    progress = collect(executor, results)
+
+    # the copy runs on another worker than the straggler
+    assert collect_client.submit.call_args.kwargs["workers"] == ["w2"]
+    assert collect_client.submit.call_args.kwargs["key"] == "t/copy"
+    assert completed.added == [copy]
+    # the original is cancelled, and its process killed
+    collect_client.cancel.assert_called_once_with([original])
+    collect_client.run.assert_called_with(cancel_attempts, "t", on_error="ignore")
+    assert (progress.done, progress.failed) == (1, 0)
+    assert counts(results) == {FINISHED: 1}
+    assert not executor.speculators
+
+
+def test_collect_original_wins(
+    monkeypatch, tmpdir, completed, collect_client, client_future, collect
+):
+    results = LocalResults(str(tmpdir), name="run")
+    executor, original, copy = speculate_once(
+        monkeypatch, collect_client, client_future, ("finished", "cancelled")
+    )
+    collect_client.outcomes = {"t": TaskRecord.from_exit_code("t", 1)}
+    completed.steps = [None, [original], [copy]]
+
+    progress = collect(executor, results)
+
+    collect_client.cancel.assert_called_once_with([copy])
+    collect_client.run.assert_called_with(cancel_attempts, "t/copy", on_error="ignore")
+    assert (progress.done, progress.failed) == (0, 1)
+    assert counts(results) == {FAILED: 1}
+
+
+def test_collect_original_errors_while_copy_runs(
+    monkeypatch, tmpdir, completed, collect_client, client_future, collect
+):
+    results = LocalResults(str(tmpdir), name="run")
+    executor, original, copy = speculate_once(
+        monkeypatch, collect_client, client_future, ("error", "finished")
+    )
+    collect_client.outcomes = {"t/copy": TaskRecord.from_exit_code("t", 0)}
+    completed.steps = [None, [original], [copy]]
+
+    progress = collect(executor, results)
+
+    # e.g. the straggler's worker went away, and the copy stands for the task
+    collect_client.cancel.assert_not_called()
+    assert (progress.done, progress.failed) == (1, 0)
+    assert counts(results) == {FINISHED: 1}
+
+
+@pytest.mark.parametrize("copy_lost_first", [False, True])
+def test_collect_committed_copy_lost(
+    monkeypatch, tmpdir, completed, collect_client, client_future, collect, copy_lost_first
+):
+    results = LocalResults(str(tmpdir), name="run")
+    executor, original, copy = speculate_once(
+        monkeypatch, collect_client, client_future, ("finished", "error")
+    )
+    # the copy was committed first, but its worker went away before it returned
+    collect_client.outcomes = {"t": TaskRecord(name="t", state=SUPERSEDED)}
+    if copy_lost_first:
+        completed.steps = [None, [copy], [original]]
+    else:
+        completed.steps = [None, [original], [copy]]
+
+    progress = collect(executor, results)
+
+    assert (progress.done, progress.failed) == (0, 1)
+    assert counts(results) == {ERROR: 1}
@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import Mock
+
+from pytest import fixture, raises
+from saturn_run.errors import ConfigError
+from saturn_run.executor import warm_pool
+
+
+@fixture
+def pool_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(warm_pool, "POOL_DIR", str(tmpdir))
+    return str(tmpdir)
+
+
+def test_pool_key():
+    key = warm_pool.pool_key("LocalCluster", {"n_workers": 2, "threads_per_worker": 1})
+    assert key == warm_pool.pool_key("LocalCluster", {"threads_per_worker": 1, "n_workers": 2})
+    assert key != warm_pool.pool_key("LocalCluster", {"n_workers": 3, "threads_per_worker": 1})
+    assert warm_pool.pool_key("LocalCluster", None) == warm_pool.pool_key("LocalCluster", {})
+
+
+def test_discover_and_stop(pool_dir):
+    assert warm_pool.discover("LocalCluster", {}) is None
+    assert not warm_pool.stop("LocalCluster", {})
+
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    state = warm_pool.pool_paths(warm_pool.pool_key("LocalCluster", {}))["json"]
+    with open(state, "w") as f:
+        json.dump({"address": "tcp://127.0.0.1:8786", "pid": process.pid}, f)
+    assert warm_pool.discover("LocalCluster", {}) == "tcp://127.0.0.1:8786"
+    # another configuration has a pool of its own
+    assert warm_pool.discover("LocalCluster", {"n_workers": 1}) is None
+
+    assert warm_pool.stop("LocalCluster", {})
+    assert process.wait(timeout=10) != 0
+    assert not os.path.exists(state)
+    assert warm_pool.discover("LocalCluster", {}) is None
+
+
+def test_connect_fails(pool_dir):
+    # the pool process exits because the cluster class is unknown
+    with raises(ConfigError):
+        warm_pool.connect("NoSuchCluster", {})
+
+
+def test_in_use():
+    scheduler = Mock(clients={"fire-and-forget": 1, "published-srun/a": 1, "Client-own": 1})
+    scheduler.tasks = {}
+    assert not warm_pool.in_use(scheduler, own="Client-own")
+    scheduler.tasks = {"srun/a/task": 1}
+    assert warm_pool.in_use(scheduler, own="Client-own")
+    scheduler.tasks = {}
+    scheduler.clients["Client-other"] = 1
+    assert warm_pool.in_use(scheduler, own="Client-own")
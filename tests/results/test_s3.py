@@ -1,8 +1,10 @@
 import os
+import time
 from os.path import join
 from unittest.mock import Mock, call
 
-from saturn_run.results import S3Results, S3TaskContext
+from botocore.exceptions import ClientError
+from saturn_run.results import S3Results, S3TaskContext, s3
 
 
 def test_s3_results_constructor():
@@ -35,24 +37,53 @@ def test_sync_stdout_stderr(monkeypatch):
     try:
         s3 = Mock()
         monkeypatch.setattr(S3TaskContext, "s3_client", Mock(return_value=s3))
-        s3.upload_file = Mock()
+        s3.put_object = Mock()
         context.sync()
 
         # files do not exist yet, so should not be called
-        s3.upload_file.assert_not_called()
+        s3.put_object.assert_not_called()
 
         with open(context.stdout_path, "w+") as f:
             f.write("hi")
         with open(context.stderr_path, "w+") as f:
             f.write("hihi")
-        # files do not exist yet, so should not be called
         context.sync()
-        s3.upload_file.assert_has_calls(
+        s3.put_object.assert_has_calls(
             [
-                call(context.stdout_path, "bucket", "path/other/my-task/stdout"),
-                call(context.stderr_path, "bucket", "path/other/my-task/stderr"),
+                call(Bucket="bucket", Key="path/other/my-task/stdout.parts/00000000", Body=b"hi"),
+                call(Bucket="bucket", Key="path/other/my-task/stderr.parts/00000000", Body=b"hihi"),
             ]
         )
+
+        # only the bytes appended since the last sync are shipped
+        s3.put_object.reset_mock()
+        with open(context.stdout_path, "a") as f:
+            f.write(" there")
+        context.sync()
+        s3.put_object.assert_called_once_with(
+            Bucket="bucket", Key="path/other/my-task/stdout.parts/00000001", Body=b" there"
+        )
+    finally:
+        context.cleanup()
+
+
+def test_finish_logs(monkeypatch):
+    results = S3Results("s3://bucket/path/other", name="foo")
+    context = results.make_task_context("my-task")
+    try:
+        s3 = Mock()
+        monkeypatch.setattr(S3TaskContext, "s3_client", Mock(return_value=s3))
+
+        with open(context.stdout_path, "w+") as f:
+            f.write("hi")
+        context.sync()
+        context.finish()
+
+        s3.upload_file.assert_any_call(context.stdout_path, "bucket", "path/other/my-task/stdout")
+        s3.delete_objects.assert_called_once_with(
+            Bucket="bucket",
+            Delete={"Objects": [{"Key": "path/other/my-task/stdout.parts/00000000"}]},
+        )
     finally:
         context.cleanup()
 
@@ -96,3 +127,165 @@ def test_sync_results(monkeypatch):
         )
     finally:
         context.cleanup()
+
+
+def test_s3_client_is_shared(monkeypatch):
+    Session = Mock()
+    monkeypatch.setattr(s3, "_clients", {})
+    monkeypatch.setattr(s3.boto3, "Session", Session)
+    results = S3Results("s3://bucket/path", name="foo", max_pool_connections=50)
+    context_a = results.make_task_context("a")
+    context_b = results.make_task_context("b")
+    try:
+        assert context_a.s3_client() is context_b.s3_client()
+        Session.assert_called_once()
+        config = Session.return_value.client.call_args.kwargs["config"]
+        assert config.max_pool_connections == 50
+    finally:
+        context_a.cleanup()
+        context_b.cleanup()
+
+
+def test_sync_results_incremental(monkeypatch):
+    results = S3Results("s3://bucket/path/other", name="foo")
+    context = results.make_task_context("my-task")
+    try:
+        s3_client = Mock()
+        monkeypatch.setattr(S3TaskContext, "s3_client", Mock(return_value=s3_client))
+
+        with open(join(context.results_dir, "test_a"), "w+") as f:
+            f.write("hi")
+        context.sync()
+        s3_client.upload_file.assert_called_once_with(
+            join(context.results_dir, "test_a"), "bucket", "path/other/my-task/results/test_a"
+        )
+
+        # unchanged files are not uploaded again
+        s3_client.upload_file.reset_mock()
+        with open(join(context.results_dir, "test_b"), "w+") as f:
+            f.write("hi")
+        context.finish()
+        s3_client.upload_file.assert_called_once_with(
+            join(context.results_dir, "test_b"), "bucket", "path/other/my-task/results/test_b"
+        )
+    finally:
+        context.cleanup()
+
+
+def test_upload_files_bounded_inflight():
+    inflight = []
+    peak = [0]
+
+    def upload_file(local_path, bucket, key):
+        inflight.append(key)
+        peak[0] = max(peak[0], len(inflight))
+        time.sleep(0.01)
+        inflight.remove(key)
+
+    s3_client = Mock()
+    s3_client.upload_file = upload_file
+    uploads = [(f"/tmp/{idx}", f"key/{idx}", 10) for idx in range(20)]
+    s3.upload_files(s3_client, "bucket", uploads, concurrency=4, max_inflight_bytes=10)
+    # only one 10 byte file fits in the budget at a time
+    assert peak[0] == 1
+
+    peak[0] = 0
+    s3.upload_files(s3_client, "bucket", uploads, concurrency=4, max_inflight_bytes=1000)
+    assert 1 < peak[0] <= 4
+
+
+def test_commit_attempt(monkeypatch):
+    results = S3Results("s3://bucket/path", name="foo")
+    context = results.make_task_context("my-task", attempt="abc/1")
+    try:
+        s3_client = Mock()
+        monkeypatch.setattr(S3TaskContext, "s3_client", Mock(return_value=s3_client))
+        context.set_status("0")
+        s3_client.put_object.assert_called_once_with(
+            Bucket="bucket", Key="path/my-task/attempts/abc/1/status", Body=b"0"
+        )
+
+        # another attempt claimed the execution first
+        s3_client.put_object.side_effect = ClientError(
+            {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+        )
+        assert not context.commit()
+        s3_client.copy.assert_not_called()
+
+        s3_client.put_object.side_effect = None
+        monkeypatch.setattr(
+            s3,
+            "list_objects",
+            Mock(
+                return_value=[
+                    {"Key": "path/my-task/attempts/abc/1/status"},
+                    {"Key": "path/my-task/attempts/abc/1/results/a"},
+                ]
+            ),
+        )
+        assert context.commit()
+        s3_client.put_object.assert_called_with(
+            Bucket="bucket",
+            Key="path/my-task/attempts/abc/committed",
+            Body=b"abc/1",
+            IfNoneMatch="*",
+        )
+        # the status is copied last
+        assert s3_client.copy.call_args_list == [
+            call(
+                {"Bucket": "bucket", "Key": "path/my-task/attempts/abc/1/results/a"},
+                "bucket",
+                "path/my-task/results/a",
+            ),
+            call(
+                {"Bucket": "bucket", "Key": "path/my-task/attempts/abc/1/status"},
+                "bucket",
+                "path/my-task/status",
+            ),
+        ]
+        s3_client.delete_objects.assert_called_once()
+    finally:
+        context.cleanup()
+
+
+def test_claim_attempt(monkeypatch):
+    results = S3Results("s3://bucket/path", name="foo")
+    s3_client = Mock()
+    monkeypatch.setattr(results, "s3_client", Mock(return_value=s3_client))
+    assert results.claim_attempt("my-task", "abc/1")
+    s3_client.put_object.assert_called_once_with(
+        Bucket="bucket", Key="path/my-task/attempts/abc/1.claimed", Body=b"", IfNoneMatch="*"
+    )
+    s3_client.put_object.side_effect = ClientError(
+        {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+    )
+    assert not results.claim_attempt("my-task", "abc/1")
+
+
+def test_store_cached_skips_attempts(monkeypatch):
+    results = S3Results("s3://bucket/path", name="foo", cache_url="s3://cache/entries")
+    s3_client = Mock()
+    monkeypatch.setattr(results, "s3_client", Mock(return_value=s3_client))
+    monkeypatch.setattr(
+        s3,
+        "list_objects",
+        Mock(
+            return_value=[
+                {"Key": "path/my-task/status", "Size": 1},
+                {"Key": "path/my-task/results/a", "Size": 10},
+                {"Key": "path/my-task/attempts/abc/committed", "Size": 5},
+                {"Key": "path/my-task/attempts/abc/0/stdout", "Size": 100},
+                {"Key": "path/my-task/attempts/abc/0.claimed", "Size": 0},
+            ]
+        ),
+    )
+    copy_objects = Mock()
+    monkeypatch.setattr(s3, "copy_objects", copy_objects)
+
+    results.store_cached("my-task", "key")
+
+    assert copy_objects.call_args[0][2] == [
+        ("path/my-task/status", "cache", "entries/key/status"),
+        ("path/my-task/results/a", "cache", "entries/key/results/a"),
+    ]
+    assert b'"size": 11' in s3_client.put_object.call_args[1]["Body"]
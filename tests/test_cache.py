@@ -0,0 +1,73 @@
+from os.path import join
+
+from pytest import raises
+from saturn_run.cache import assign_cache_keys, iter_cache_keys
+from saturn_run.errors import ConfigError
+from saturn_run.file_sync import FileSync
+from saturn_run.results.base import CacheEntry, select_evictions
+from saturn_run.tasks import TaskSpec
+
+
+def make_tasks(input_path):
+    return [
+        TaskSpec(name="a", command="echo a", inputs=[input_path]),
+        TaskSpec(name="b", command="echo b"),
+        TaskSpec(name="c", command="echo c", depends_on=["a"]),
+    ]
+
+
+def test_assign_cache_keys(tmpdir):
+    input_path = join(str(tmpdir), "input.txt")
+    with open(input_path, "w") as f:
+        f.write("1")
+    tasks = make_tasks(input_path)
+    assign_cache_keys(tasks, [])
+    keys = [t.cache_key for t in tasks]
+    assert len(set(keys)) == 3
+
+    # same inputs, same keys
+    tasks = make_tasks(input_path)
+    assign_cache_keys(tasks, [])
+    assert [t.cache_key for t in tasks] == keys
+
+    # changing an input changes the task and everything downstream of it
+    with open(input_path, "w") as f:
+        f.write("2")
+    tasks = make_tasks(input_path)
+    assign_cache_keys(tasks, [])
+    assert [t.cache_key == k for t, k in zip(tasks, keys)] == [False, True, False]
+
+    # so do the synced files
+    tasks = make_tasks(input_path)
+    assign_cache_keys(tasks, [FileSync(src=str(tmpdir), dest=str(tmpdir))])
+    assert all(t.cache_key not in keys for t in tasks)
+
+
+def test_assign_cache_keys_missing_input(tmpdir):
+    with raises(ConfigError):
+        assign_cache_keys(make_tasks(join(str(tmpdir), "missing.txt")), [])
+
+
+def test_select_evictions():
+    entries = [
+        CacheEntry(key="old", created=0, size=10),
+        CacheEntry(key="a", created=90, size=10),
+        CacheEntry(key="b", created=95, size=10),
+        CacheEntry(key="c", created=99, size=10),
+    ]
+    assert select_evictions(entries, max_age=50, now=100) == ["old"]
+    assert select_evictions(entries, max_size=25, now=100) == ["old", "a"]
+    assert select_evictions(entries, max_age=50, max_size=15, now=100) == ["old", "a", "b"]
+    assert not select_evictions(entries, now=100)
+
+
+def test_iter_cache_keys(tmpdir):
+    input_path = join(str(tmpdir), "input.txt")
+    with open(input_path, "w") as f:
+        f.write("1")
+    tasks = make_tasks(input_path)
+    assign_cache_keys(tasks, [])
+
+    # streamed tasks get the same keys, as they are read
+    streamed = iter_cache_keys(iter(make_tasks(input_path)), [])
+    assert [t.cache_key for t in streamed] == [t.cache_key for t in tasks]
@@ -0,0 +1,106 @@
+import os
+import time
+from os.path import join
+
+from saturn_run import file_sync
+from saturn_run.file_sync import ChunkCache, build_manifest, iter_chunks
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_build_manifest(tmpdir, monkeypatch):
+    monkeypatch.setattr(file_sync, "CHUNK_SIZE", 4)
+    src = str(tmpdir.mkdir("src")) + "/"
+    write(join(src, "a"), b"0123456789")
+    write(join(src, "sub/b"), b"0123")
+    write(join(src, ".git/HEAD"), b"ref")
+
+    manifest = build_manifest(src)
+    assert manifest["root"] == src
+    assert sorted(manifest["files"]) == ["a", "sub/b"]
+    assert len(manifest["files"]["a"]["chunks"]) == 3
+    # identical content shares a chunk
+    assert manifest["files"]["sub/b"]["chunks"][0] == manifest["files"]["a"]["chunks"][0]
+
+    chunks = dict(iter_chunks(manifest, manifest["files"]["a"]["chunks"]))
+    assert b"".join(chunks[d] for d in manifest["files"]["a"]["chunks"]) == b"0123456789"
+
+
+def test_build_manifest_file(tmpdir):
+    path = join(str(tmpdir), "a")
+    write(path, b"hi")
+    manifest = build_manifest(path)
+    assert manifest["root"] == str(tmpdir)
+    assert list(manifest["files"]) == ["a"]
+
+
+def test_chunk_cache_apply(tmpdir, monkeypatch):
+    monkeypatch.setattr(file_sync, "CHUNK_SIZE", 4)
+    src = str(tmpdir.mkdir("src")) + "/"
+    dest = str(tmpdir.mkdir("dest")) + "/"
+    write(join(src, "a"), b"0123456789")
+    write(join(src, "sub/b"), b"hello")
+    cache = ChunkCache(str(tmpdir.mkdir("cache")))
+
+    def sync():
+        manifest = build_manifest(src)
+        missing = cache.missing(manifest)
+        for digest, data in iter_chunks(manifest, missing):
+            cache.put(digest, data)
+        # pretend the worker lives somewhere else
+        manifest["root"] = dest
+        return missing, cache.apply(manifest)
+
+    missing, written = sync()
+    assert len(missing) == 5
+    assert sorted(written) == ["a", "sub/b"]
+    assert read(join(dest, "a")) == b"0123456789"
+    assert read(join(dest, "sub/b")) == b"hello"
+
+    # only the changed chunk is needed, and only the changed file is rewritten
+    write(join(src, "sub/b"), b"hellx")
+    missing, written = sync()
+    assert len(missing) == 1
+    assert written == ["sub/b"]
+    assert read(join(dest, "sub/b")) == b"hellx"
+    # the record of applied chunks is replaced whole, never left half written
+    applied = os.listdir(join(str(tmpdir), "cache", "applied"))
+    assert len(applied) == 1 and applied[0].endswith(".json")
+
+
+def test_chunk_cache_prune(tmpdir, monkeypatch):
+    monkeypatch.setattr(file_sync, "CHUNK_SIZE", 4)
+    src = str(tmpdir.mkdir("src")) + "/"
+    write(join(src, "a"), b"01234567")
+    write(join(src, "b"), b"abcdefgh")
+    cache = ChunkCache(str(tmpdir.mkdir("cache")), max_bytes=8)
+    manifest = build_manifest(src)
+    for digest, data in iter_chunks(manifest, cache.missing(manifest)):
+        cache.put(digest, data)
+    cache.apply(manifest)
+
+    # chunks used within the grace period are kept, whatever the size of the cache
+    assert cache.prune() == 0
+    a_chunks, b_chunks = manifest["files"]["a"]["chunks"], manifest["files"]["b"]["chunks"]
+    for age, digest in enumerate(a_chunks + b_chunks):
+        then = time.time() - file_sync.CACHE_GRACE_PERIOD - 100 + age
+        os.utime(cache.chunk_path(digest), (then, then))
+
+    # the least recently used go first, until the rest fit
+    assert cache.prune() == 2
+    assert cache.touch(a_chunks + b_chunks) == a_chunks
+
+    # chunks of files that are already written are not needed again
+    assert cache.missing(manifest) == []
+    write(join(src, "a"), b"0123456x")
+    changed = build_manifest(src)
+    assert cache.missing(changed) == sorted(changed["files"]["a"]["chunks"])
@@ -0,0 +1,100 @@
+from os.path import join
+from unittest.mock import Mock
+
+from saturn_run.history import RunHistory, duration_priority
+from saturn_run.results import LocalResults
+from saturn_run.run import RunConfig, TaskConfig
+from saturn_run.status import CACHED, StatusIndex, TaskRecord
+from saturn_run.tasks import PREDICTED_PRIORITIES, TaskSpec
+
+
+def record(task: TaskSpec, seconds: float, state: str = "finished") -> TaskRecord:
+    return TaskRecord(
+        name=task.name,
+        state=state,
+        exit_code=0,
+        command_token=task.command_token,
+        start=1000.0,
+        end=1000.0 + seconds,
+    )
+
+
+def test_history(tmpdir):
+    history = RunHistory(join(str(tmpdir), "history.db"))
+    long = TaskSpec(name="long", command="sleep 100")
+    short = TaskSpec(name="short", command="sleep 1")
+    assert history.predict(long) is None
+    assert history.default() is None
+
+    history.add([record(long, 100), record(short, 1), record(short, 1000, state=CACHED)])
+    history.add([record(long, 200)])
+    # a moving average of the durations that ran
+    assert history.predict(long) == 150
+    assert history.predict(short) == 1
+    # the same command under another name, and the same name with another command
+    assert history.predict(TaskSpec(name="other", command="sleep 100")) == 150
+    assert history.predict(TaskSpec(name="short", command="sleep 2")) == 1
+    assert history.default() == 75.5
+
+    new = TaskSpec(name="new", command="sleep 50")
+    explicit = TaskSpec(name="short", command="sleep 1", priority=100)
+    tasks = list(history.prioritize([short, long, new, explicit]))
+    assert [t.predicted_priority for t in tasks] == [
+        duration_priority(1),
+        duration_priority(150),
+        duration_priority(75.5),
+        duration_priority(1),
+    ]
+    # a priority set by the task comes before any prediction
+    assert [t.priority for t in tasks] == [None, None, None, 100]
+    assert max(tasks, key=lambda t: t.rank) is explicit
+    history.close()
+
+
+def test_duration_priority():
+    assert duration_priority(0) == 0
+    assert duration_priority(1) == 1
+    assert duration_priority(3600) > duration_priority(1000) > duration_priority(60)
+    # similar durations share a priority, so they can be batched together
+    assert duration_priority(3000) == duration_priority(3600)
+    assert duration_priority(10**12) == PREDICTED_PRIORITIES - 1
+
+
+def test_rank():
+    longest = duration_priority(10**12)
+    assert (
+        TaskSpec(name="a", command="x", priority=1).rank
+        > TaskSpec(name="b", command="x", predicted_priority=longest).rank
+    )
+    assert TaskSpec(name="a", command="x", priority=-1, predicted_priority=longest).rank < 0
+    assert (
+        TaskSpec(name="a", command="x", predicted_priority=2).rank
+        > TaskSpec(name="b", command="x", predicted_priority=1).rank
+    )
+
+
+def test_run_config_history(tmpdir):
+    submitted = []
+    executor = Mock()
+    executor.execute.side_effect = lambda tasks, *args, **kwargs: submitted.extend(tasks)
+    results = LocalResults(join(str(tmpdir), "results", "{name}"), name="run")
+    history = RunHistory(join(str(tmpdir), "history.db"))
+    run_config = RunConfig(
+        name="run", results=results, executor=executor, file_syncs=None, history=history
+    )
+    tasks = [TaskSpec(name="a", command="sleep 1"), TaskSpec(name="b", command="sleep 9")]
+    history.add([record(tasks[0], 1), record(tasks[1], 9)])
+
+    run_config.run(TaskConfig(tasks=tasks))
+    assert [t.predicted_priority for t in submitted] == [
+        duration_priority(1),
+        duration_priority(9),
+    ]
+
+    # durations in the run's status index go into the history when it is collected
+    index = StatusIndex(results.fetch_status_index())
+    index.add([record(tasks[0], 3)])
+    index.close()
+    run_config.collect()
+    executor.collect.assert_called_once_with("run", results)
+    assert history.predict(tasks[0]) == 2
@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+
+# seconds `import saturn_run.cli` may take, it takes ~0.1s when only the CLI's own
+# dependencies are imported
+IMPORT_BUDGET = 0.5
+# imported only by the backends that need them
+HEAVY_MODULES = ["boto3", "botocore", "dask", "distributed", "psutil"]
+
+CODE = """
+import json, sys, time
+start = time.perf_counter()
+import saturn_run.cli
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def test_cli_import_time():
+    output = subprocess.run(
+        [sys.executable, "-c", CODE], check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output)
+    assert not set(HEAVY_MODULES) & set(result["modules"])
+    assert result["elapsed"] < IMPORT_BUDGET
+
+
+def test_backends_are_resolved_lazily(tmpdir):
+    code = """
+import sys
+from saturn_run.results import Results
+results = Results.create("LocalResults", name="foo", path=sys.argv[1])
+print(type(results).__name__, "boto3" in sys.modules)
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", code, str(tmpdir)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert output.split() == ["LocalResults", "False"]
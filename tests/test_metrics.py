@@ -0,0 +1,50 @@
+import json
+import subprocess
+import sys
+import time
+from os.path import join
+
+from saturn_run import processes
+from saturn_run.metrics import ProcessMonitor, TaskMetrics
+from saturn_run.results import LocalResults
+
+
+def test_process_monitor():
+    # hold on to ~50MB and burn some CPU in a child of the shell
+    code = "x = bytearray(50 * 2**20); sum(range(10**7)); import time; time.sleep(1)"
+    proc = subprocess.Popen(f"{sys.executable} -c '{code}'", shell=True)
+    metrics = TaskMetrics("task", "worker")
+    monitor = ProcessMonitor(proc.pid, metrics)
+    try:
+        while proc.poll() is None:
+            monitor.sample()
+            time.sleep(0.1)
+    finally:
+        proc.wait()
+    assert metrics.samples > 1
+    assert metrics.peak_rss_bytes > 50 * 2**20
+    assert metrics.cpu_seconds > 0
+    assert metrics.peak_threads >= 2
+
+
+def test_execute_writes_metrics(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    submitted = time.time() - 10
+    record = processes.execute(
+        results,
+        "my-task",
+        "echo hello; sleep 0.5",
+        shell=True,
+        submitted=submitted,
+        sample_interval=0.1,
+    )
+
+    with open(join(str(tmpdir), "my-task", "metrics.json")) as f:
+        metrics = json.load(f)
+    assert metrics["exit_code"] == 0
+    assert metrics["samples"] >= 1
+    assert metrics["bytes_written"] == 6
+    assert metrics["queue_seconds"] >= 10
+    assert metrics["run_seconds"] >= 0.5
+    assert record.queue_seconds == metrics["queue_seconds"]
+    assert record.peak_rss == metrics["peak_rss_bytes"]
@@ -1,7 +1,18 @@
+import asyncio
+import os
+import threading
+import time
+from os.path import join
 from unittest.mock import Mock, call
 
 import psutil
+from distributed import Reschedule
+from pytest import raises
 from saturn_run import processes
+from saturn_run.errors import ConfigError
+from saturn_run.resources import cpu_allocator
+from saturn_run.results import LocalResults, Results
+from saturn_run.tasks import RetryPolicy, TaskSpec
 
 
 def test_cleanup_all_processes(monkeypatch):
@@ -59,3 +70,391 @@ def test_cleanup_no_such_process_while_terminating(monkeypatch):
     good_proc.kill.assert_called_once()
     good_proc.wait.assert_called_once()
     good_proc.terminate.assert_called_once()
+
+
+def test_execute_streams_output(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    processes.execute(results, "my-task", "echo hello; echo oops >&2; exit 3", shell=True)
+
+    with open(join(str(tmpdir), "my-task", "stdout")) as f:
+        assert f.read() == "hello\n"
+    with open(join(str(tmpdir), "my-task", "stderr")) as f:
+        assert f.read() == "oops\n"
+    with open(join(str(tmpdir), "my-task", "status")) as f:
+        assert f.read() == "3"
+
+
+# leaves a grandchild holding stdout open after the task exits
+ORPHAN = "echo before; (sleep 0.5; echo late; sleep 30) & echo after"
+
+
+def test_execute_stops_pumps_held_open(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    start = time.monotonic()
+    record = processes.execute(results, "my-task", ORPHAN, shell=True, poll_interval=1)
+
+    assert record.state == "finished"
+    assert time.monotonic() - start < 10
+    # what the grandchild wrote before the pumps stopped is synced
+    with open(join(str(tmpdir), "my-task", "stdout")) as f:
+        assert f.read() == "before\nafter\nlate\n"
+    assert not [t for t in threading.enumerate() if isinstance(t, processes.OutputPump)]
+
+    tasks = [TaskSpec(name="async-task", command=ORPHAN)]
+    records = processes.execute_many(results, tasks, poll_interval=1)
+    assert records[0].state == "finished"
+    with open(join(str(tmpdir), "async-task", "stdout")) as f:
+        assert f.read() == "before\nafter\nlate\n"
+
+
+def test_execute_cleans_up_when_supervising_fails(monkeypatch, tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    monitor = Mock()
+    monitor.return_value.sample.side_effect = RuntimeError("boom")
+    monkeypatch.setattr(processes, "ProcessMonitor", monitor)
+
+    with raises(RuntimeError):
+        processes.execute(results, "my-task", "sleep 30", shell=True, cpus=1)
+    with raises(RuntimeError):
+        asyncio.run(processes.execute_async(results, "async-task", "sleep 30", shell=True, cpus=1))
+
+    assert processes.running_pids == set()
+    assert cpu_allocator.in_use == {}
+    for (pid, _), _ in monitor.call_args_list:
+        assert not psutil.pid_exists(pid) or psutil.Process(pid).status() == "zombie"
+    assert not [t for t in threading.enumerate() if isinstance(t, processes.OutputPump)]
+
+
+def test_execute_many(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    tasks = [TaskSpec(name=str(idx), command=f"echo {idx}; exit {idx}") for idx in range(4)]
+    tasks.append(TaskSpec(name="list", command=["echo", "a list"], shell=False))
+
+    records = processes.execute_many(results, tasks, concurrency=2)
+
+    assert [r.exit_code for r in records] == [0, 1, 2, 3, 0]
+    assert [r.state for r in records] == ["finished", "failed", "failed", "failed", "finished"]
+    for idx in range(4):
+        with open(join(str(tmpdir), str(idx), "stdout")) as f:
+            assert f.read() == f"{idx}\n"
+    with open(join(str(tmpdir), "list", "stdout")) as f:
+        assert f.read() == "a list\n"
+    assert processes.running_pids == set()
+
+
+def test_execute_many_rejects_unbatchable_tasks(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    tasks = [
+        TaskSpec(name="plain", command="echo plain"),
+        TaskSpec(name="downstream", command="echo down", depends_on=["plain"]),
+        TaskSpec(name="flaky", command="echo flaky", retry=RetryPolicy(2)),
+        TaskSpec(name="attempted", command="echo attempted", attempt_prefix="abc"),
+    ]
+
+    with raises(ConfigError, match="downstream, flaky, attempted"):
+        processes.execute_many(results, tasks)
+    assert not os.path.exists(join(str(tmpdir), "plain"))
+
+
+def test_execute_async_env_and_attempt(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+
+    record = asyncio.run(
+        processes.execute_async(
+            results, "my-task", "echo $GREETING", shell=True, extra_env={"GREETING": "hi"}
+        )
+    )
+    assert record.state == "finished"
+    with open(join(str(tmpdir), "my-task", "stdout")) as f:
+        assert f.read() == "hi\n"
+
+    processes.cancelled_attempts.add("abc/1")
+    record = asyncio.run(
+        processes.execute_async(results, "other", "echo late", shell=True, attempt="abc/1")
+    )
+    # a cancelled attempt leaves nothing behind, and doesn't stand for the task
+    assert record.state == "superseded"
+    assert "abc/1" not in processes.cancelled_attempts
+    assert processes.running_attempts == {}
+    assert not os.path.exists(join(str(tmpdir), "other", "stdout"))
+
+
+def test_execute_batch(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    tasks = [TaskSpec(name=str(idx), command=f"echo {idx}; exit {idx}") for idx in range(3)]
+
+    records = processes.execute_batch(results, tasks)
+    assert [r.exit_code for r in records] == [0, 1, 2]
+    assert records[1].bytes_written == 2
+    for idx in range(3):
+        with open(join(str(tmpdir), str(idx), "stdout")) as f:
+            assert f.read() == f"{idx}\n"
+        with open(join(str(tmpdir), str(idx), "status")) as f:
+            assert f.read() == str(idx)
+
+
+def test_execute_task_cache(tmpdir):
+    cache_path = join(str(tmpdir), "cache")
+    first = LocalResults(join(str(tmpdir), "first"), name="foo", cache_path=cache_path)
+    ran_path = join(str(tmpdir), "ran")
+    task = TaskSpec(
+        name="my-task",
+        command=f"echo hello; echo data > $RESULTS_DIR/out.txt; echo ran >> {ran_path}",
+        cache_key="abc",
+    )
+    assert processes.execute_task(first, task).state == "finished"
+
+    # the second run restores the outputs instead of running the command
+    second = LocalResults(join(str(tmpdir), "second"), name="foo", cache_path=cache_path)
+    assert processes.execute_task(second, task).state == "cached"
+    with open(join(str(tmpdir), "second", "my-task", "stdout")) as f:
+        assert f.read() == "hello\n"
+    with open(join(str(tmpdir), "second", "my-task", "results", "out.txt")) as f:
+        assert f.read() == "data\n"
+    with open(ran_path) as f:
+        assert f.read() == "ran\n"
+    assert [e.key for e in second.cache_entries()] == ["abc"]
+    # restored outputs are copies, so editing them in place leaves the cache alone
+    with open(join(str(tmpdir), "second", "my-task", "results", "out.txt"), "a") as f:
+        f.write("edited\n")
+    with open(join(cache_path, "abc", "results", "out.txt")) as f:
+        assert f.read() == "data\n"
+
+    # unless caching is skipped
+    second.skip_cached = False
+    assert processes.execute_task(second, task).state == "finished"
+    # the cache can be looked after without a run
+    cache = Results.create_cache(
+        class_spec="LocalResults", path=join(str(tmpdir), "runs", "{name}"), cache_path=cache_path
+    )
+    assert cache.evict_cache(max_size=0) == ["abc"]
+    assert not second.cache_entries()
+    assert not os.path.exists(join(str(tmpdir), "runs"))
+
+
+def test_sync_schedule():
+    schedule = processes.SyncSchedule(poll_interval=4, min_interval=1, max_interval=16)
+    assert schedule.interval == 4
+    assert not schedule.due()
+
+    # back off while there is nothing new
+    for interval in [8, 16, 16]:
+        schedule.skipped()
+        assert schedule.interval == interval
+    # speed up while output is flowing
+    for interval in [8, 4, 2, 1, 1]:
+        schedule.synced(0.01)
+        assert schedule.interval == interval
+    # slow syncs are spaced out
+    schedule.synced(0.5)
+    assert schedule.interval == 0.5 * processes.SYNC_COST_FACTOR
+    schedule.synced(10)
+    assert schedule.interval == 16
+
+
+def test_sync_schedule_results_changed(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    context = results.make_task_context("my-task")
+    schedule = processes.SyncSchedule()
+    assert not schedule.results_changed(context)
+
+    path = join(context.results_dir, "out.txt")
+    with open(path, "w") as f:
+        f.write("a")
+    assert schedule.results_changed(context)
+    assert not schedule.results_changed(context)
+    with open(path, "a") as f:
+        f.write("b")
+    assert schedule.results_changed(context)
+
+
+def test_execute_attempts_commit_once(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    first = processes.execute(results, "my-task", "echo first", shell=True, attempt="abc/0")
+    second = processes.execute(results, "my-task", "echo second", shell=True, attempt="abc/1")
+
+    assert first.state == "finished"
+    assert second.state == "superseded"
+    assert not second.succeeded
+    with open(join(str(tmpdir), "my-task", "stdout")) as f:
+        assert f.read() == "first\n"
+    with open(join(str(tmpdir), "my-task", "attempts", "abc", "committed")) as f:
+        assert f.read() == "abc/0"
+    # the outputs of both attempts have left their prefixes
+    assert os.listdir(join(str(tmpdir), "my-task", "attempts", "abc")) == ["committed"]
+
+
+def test_cancel_attempts(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    records = []
+    thread = threading.Thread(
+        target=lambda: records.append(
+            processes.execute(results, "my-task", "sleep 30", shell=True, attempt="abc/0")
+        )
+    )
+    thread.start()
+    deadline = time.monotonic() + 10
+    while "abc/0" not in processes.attempt_run_times() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    # attempts are cancelled by prefix, whichever number they are on
+    assert processes.cancel_attempts("abc")
+    thread.join(10)
+    assert records[0].state == "superseded"
+    assert not processes.cancel_attempts("abc")
+    assert not processes.cancelled_attempts
+    # nothing was committed
+    assert not os.path.exists(join(str(tmpdir), "my-task", "status"))
+    assert not os.path.exists(join(str(tmpdir), "my-task", "attempts", "abc", "0"))
+
+
+def test_retry_policy():
+    policy = RetryPolicy.from_yaml(exit_codes=[3])
+    assert policy.max_attempts == 3
+    assert policy.retries(3, 0)
+    assert policy.retries(3, 1)
+    # the last attempt, success, and exit codes that are not retried are final
+    assert not policy.retries(3, 2)
+    assert not policy.retries(0, 0)
+    assert not policy.retries(1, 0)
+    assert RetryPolicy(max_attempts=2).retries(1, 0)
+
+    with raises(ConfigError):
+        RetryPolicy.from_yaml(max_attempts=0)
+
+
+# fails until its third attempt, counting attempts in RESULTS_DIR like a checkpoint
+FLAKY = (
+    "n=$(cat $RESULTS_DIR/n 2>/dev/null || echo 0); echo $((n+1)) > $RESULTS_DIR/n; [ $n -ge 2 ]"
+)
+
+
+def test_execute_task_retries(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    task = TaskSpec(
+        name="my-task",
+        command=FLAKY,
+        shell=True,
+        retry=RetryPolicy(max_attempts=3),
+        attempt_prefix="abc",
+    )
+
+    record = processes.execute_task(results, task, poll_interval=1)
+
+    assert record.state == "finished"
+    task_path = join(str(tmpdir), "my-task")
+    # each attempt resumed from the results of the one before
+    with open(join(task_path, "results", "n")) as f:
+        assert f.read() == "3\n"
+    with open(join(task_path, "attempts", "abc", "committed")) as f:
+        assert f.read() == "abc/2"
+    # the attempts that failed are left under their own prefixes
+    assert sorted(os.listdir(join(task_path, "attempts", "abc"))) == ["0", "1", "committed"]
+    with open(join(task_path, "attempts", "abc", "1", "status")) as f:
+        assert f.read() == "1"
+
+    # out of attempts, the last one is committed
+    task = TaskSpec(
+        name="other", command=FLAKY, shell=True, retry=RetryPolicy(2), attempt_prefix="abc"
+    )
+    record = processes.execute_task(results, task, poll_interval=1)
+    assert record.state == "failed"
+    with open(join(str(tmpdir), "other", "attempts", "abc", "committed")) as f:
+        assert f.read() == "abc/1"
+
+
+def test_execute_task_caches_committed_outputs(tmpdir):
+    cache_path = join(str(tmpdir), "cache")
+    results = LocalResults(join(str(tmpdir), "run"), name="foo", cache_path=cache_path)
+    task = TaskSpec(
+        name="my-task",
+        command=FLAKY,
+        shell=True,
+        retry=RetryPolicy(max_attempts=3),
+        attempt_prefix="abc",
+        cache_key="key",
+    )
+    assert processes.execute_task(results, task, poll_interval=1).state == "finished"
+
+    # the failed attempts and the commit marker stay with the run
+    entry = join(cache_path, "key")
+    outputs = ["metrics.json", "results", "status", "stderr", "stdout"]
+    assert sorted(os.listdir(entry)) == ["entry.json"] + outputs
+    with open(join(entry, "results", "n")) as f:
+        assert f.read() == "3\n"
+
+    other = LocalResults(join(str(tmpdir), "other"), name="foo", cache_path=cache_path)
+    assert processes.execute_task(other, task).state == "cached"
+    assert sorted(os.listdir(join(str(tmpdir), "other", "my-task"))) == outputs
+
+
+def test_execute_task_worker_lost(tmpdir):
+    results = LocalResults(str(tmpdir), name="foo")
+    # an attempt that never finished, as its worker went away, and left a checkpoint
+    assert results.claim_attempt("my-task", "abc/0")
+    assert not results.claim_attempt("my-task", "abc/0")
+    os.makedirs(join(str(tmpdir), "my-task", "attempts", "abc", "0", "results"))
+    with open(join(str(tmpdir), "my-task", "attempts", "abc", "0", "results", "n"), "w") as f:
+        f.write("2\n")
+
+    task = TaskSpec(
+        name="my-task",
+        command=FLAKY,
+        shell=True,
+        retry=RetryPolicy(max_attempts=2, worker_lost=False),
+        attempt_prefix="abc",
+    )
+    record = processes.execute_task(results, task, poll_interval=1)
+    assert record.state == "error"
+    with open(join(str(tmpdir), "my-task", "status")) as f:
+        assert f.read() == "error"
+
+    task.retry = RetryPolicy(max_attempts=2)
+    task.attempt_prefix = "def"
+    assert results.claim_attempt("my-task", "def/0")
+    os.makedirs(join(str(tmpdir), "my-task", "attempts", "def", "0", "results"))
+    with open(join(str(tmpdir), "my-task", "attempts", "def", "0", "results", "n"), "w") as f:
+        f.write("2\n")
+    record = processes.execute_task(results, task, poll_interval=1)
+    # the second attempt picked up the checkpoint, and succeeded
+    assert record.state == "finished"
+    with open(join(str(tmpdir), "my-task", "results", "n")) as f:
+        assert f.read() == "3\n"
+
+
+def test_terminate_all_processes(monkeypatch, tmpdir):
+    monkeypatch.setattr(processes, "terminating", threading.Event())
+    results = LocalResults(str(tmpdir), name="foo")
+    # checkpoints on SIGTERM, and exits with a code the retry policy does not retry
+    task = TaskSpec(
+        name="my-task",
+        command="trap 'echo saved > $RESULTS_DIR/checkpoint; exit 3' TERM; sleep 30 & wait",
+        shell=True,
+        retry=RetryPolicy(max_attempts=2, exit_codes=(1,)),
+        attempt_prefix="abc",
+    )
+    errors = []
+
+    def run():
+        try:
+            processes.execute_task(results, task, poll_interval=1)
+        except Reschedule as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while "abc/0" not in processes.attempt_run_times() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    processes.terminate_all_processes(grace_period=10)
+    thread.join(10)
+    # the worker went away, so the task is left to resume on another one
+    assert len(errors) == 1
+    assert not os.path.exists(join(str(tmpdir), "my-task", "status"))
+    with open(join(str(tmpdir), "my-task", "attempts", "abc", "0", "results", "checkpoint")) as f:
+        assert f.read() == "saved\n"
+
+    # and tasks don't start on a worker that is stopping
+    with raises(Reschedule):
+        processes.execute_task(results, TaskSpec(name="other", command="true"))
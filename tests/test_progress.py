@@ -0,0 +1,22 @@
+from unittest.mock import Mock
+
+from saturn_run.progress import Progress
+
+
+def test_progress_summary():
+    progress = Progress(10)
+    progress.finished(3)
+    progress.errored()
+    assert progress.pending == 6
+    summary = progress.summary(running=2)
+    assert summary.startswith("3/10 done, 1 failed, 6 pending (2 on workers), ")
+
+
+def test_progress_report_interval():
+    progress = Progress(10, interval=3600)
+    running = Mock(return_value=1)
+    progress.report(running)
+    # nothing is logged, or computed, until the interval passes
+    running.assert_not_called()
+    progress.report(running, force=True)
+    running.assert_called_once()
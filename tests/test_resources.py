@@ -0,0 +1,50 @@
+import time
+
+import psutil
+from saturn_run.resources import CpuAllocator, ResourceLimits, cpu_allocator
+from saturn_run.utils import parse_bytes
+
+
+def test_parse_bytes():
+    assert parse_bytes(1024) == 1024
+    assert parse_bytes("512MiB") == 512 * 2**20
+    assert parse_bytes("2 GB") == 2 * 10**9
+    assert parse_bytes("1.5kib") == 1536
+
+
+def test_cpu_allocator_spreads_tasks(monkeypatch):
+    process = psutil.Process()
+    monkeypatch.setattr(process.__class__, "cpu_affinity", lambda self, *args: [0, 1, 2, 3])
+    allocator = CpuAllocator()
+    first = allocator.acquire(2)
+    second = allocator.acquire(1.5)
+    assert len(first) == 2 and len(second) == 2
+    assert not set(first) & set(second)
+    allocator.release(first)
+    allocator.release(second)
+    assert allocator.in_use == {}
+
+
+def test_resource_limits_applied(monkeypatch):
+    limits = ResourceLimits(cpus=1, memory=2**30)
+    # the shell forks right away, and its child must be limited too
+    proc = psutil.Popen(["sh", "-c", "sleep 5 & wait"], preexec_fn=limits.prepare())
+    try:
+        deadline = time.monotonic() + 5
+        while not proc.children() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        children = proc.children()
+        assert children
+        for p in [proc] + children:
+            assert p.cpu_affinity() == limits.cores
+            if limits.cgroup is None:
+                assert p.rlimit(psutil.RLIMIT_DATA) == (2**30, 2**30)
+    finally:
+        proc.kill()
+        proc.wait()
+        limits.release()
+    assert not cpu_allocator.in_use
+
+
+def test_resource_limits_nothing_to_apply():
+    assert ResourceLimits().prepare() is None
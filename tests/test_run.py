@@ -1,7 +1,11 @@
 from typing import cast
 
+from pytest import raises
+from saturn_run.errors import ConfigError
 from saturn_run.results import S3Results
-from saturn_run.run import RunConfig
+from saturn_run.run import RunConfig, TaskConfig
+from saturn_run.tasks import sort_by_dependencies
+from saturn_run.utils import resolve_backend
 
 
 def test_run_config():
@@ -31,3 +35,62 @@ def test_run_config_no_file_syncs():
     )
     run_obj = RunConfig.from_yaml(prefix="foo", **data)
     assert run_obj.file_syncs is None
+
+
+def test_task_config():
+    task_config = TaskConfig.from_yaml(tasks=[dict(command="echo 1"), dict(command="echo 2")])
+    assert [t.name for t in task_config.tasks] == ["0", "1"]
+
+
+def test_task_config_duplicate_names():
+    with raises(ConfigError):
+        TaskConfig.from_yaml(
+            tasks=[dict(command="echo 1", name="a"), dict(command="echo 2", name="a")]
+        )
+
+
+def test_task_config_resources():
+    task_config = TaskConfig.from_yaml(
+        tasks=[dict(command="echo 1", cpus=2, memory="1GiB", resources=dict(GPU=1))]
+    )
+    task = task_config.tasks[0]
+    assert task.cpus == 2
+    assert task.memory == 2**30
+    assert task.resources == {"GPU": 1}
+
+
+def test_task_config_dependencies():
+    task_config = TaskConfig.from_yaml(
+        tasks=[
+            dict(command="echo 1", name="train", depends_on=["prep"]),
+            dict(command="echo 2", name="prep"),
+            dict(command="echo 3", name="agg", depends_on="train"),
+        ]
+    )
+    assert task_config.tasks[2].depends_on == ["train"]
+    ordered = sort_by_dependencies(task_config.tasks)
+    assert [t.name for t in ordered] == ["prep", "train", "agg"]
+
+
+def test_task_config_bad_dependencies():
+    with raises(ConfigError):
+        TaskConfig.from_yaml(tasks=[dict(command="echo 1", depends_on=["nope"])])
+    with raises(ConfigError):
+        TaskConfig.from_yaml(
+            tasks=[
+                dict(command="echo 1", name="a", depends_on=["b"]),
+                dict(command="echo 2", name="b", depends_on=["a"]),
+            ]
+        )
+
+
+def test_resolve_backend():
+    backends = {"LocalResults": "saturn_run.results.local:LocalResults"}
+    backend = resolve_backend(backends, "LocalResults")
+    assert backend.__name__ == "LocalResults"
+    # resolved backends are kept
+    assert backends["LocalResults"] is backend
+    # backends can also be given by their path
+    assert resolve_backend(backends, "saturn_run.results.s3:S3Results").__name__ == "S3Results"
+    with raises(ConfigError):
+        resolve_backend(backends, "NoSuchResults")
@@ -0,0 +1,49 @@
+from os.path import join
+
+from saturn_run.status import MetricsSummary, StatusIndex, TaskRecord
+
+
+def test_status_index(tmpdir):
+    index = StatusIndex(join(str(tmpdir), "status.db"))
+    index.add(
+        [
+            TaskRecord.from_exit_code("a", 0, start=1, end=2, worker="host:1", bytes_written=10),
+            TaskRecord.from_exit_code("b", 3, start=2, end=3),
+            TaskRecord(name="c", state="upstream-failed"),
+        ]
+    )
+    assert index.counts() == {"finished": 1, "failed": 1, "upstream-failed": 1}
+    assert [r.name for r in index.records(state="failed")] == ["b"]
+    assert index.records(name="a")[0] == TaskRecord(
+        name="a", state="finished", exit_code=0, start=1, end=2, worker="host:1", bytes_written=10
+    )
+
+    # recording a task again replaces it
+    index.add([TaskRecord.from_exit_code("b", 0)])
+    assert index.counts() == {"finished": 2, "upstream-failed": 1}
+    index.close()
+
+    # the index survives being reopened
+    index = StatusIndex(join(str(tmpdir), "status.db"))
+    assert len(index.records()) == 3
+    index.close()
+
+
+def test_metrics_summary():
+    summary = MetricsSummary()
+    assert summary.summary() == "no tasks ran"
+    summary.add(
+        [
+            TaskRecord.from_exit_code(
+                "a", 0, start=0, end=2, queue_seconds=1, cpu_seconds=1.5, peak_rss=2**20
+            ),
+            TaskRecord.from_exit_code(
+                "b", 1, start=0, end=4, queue_seconds=3, cpu_seconds=0.5, peak_rss=3 * 2**20
+            ),
+            TaskRecord(name="c", state="upstream-failed"),
+        ]
+    )
+    assert summary.summary().startswith(
+        "2 tasks ran for 3.0s on average (max 4.0s), queued 2.0s (max 3.0s), "
+        "used 2.0 CPU seconds, peak RSS 2.0MiB on average (max 3.0MiB)"
+    )
@@ -0,0 +1,72 @@
+from os.path import join
+
+from pytest import raises
+from saturn_run.errors import ConfigError
+from saturn_run.run import TaskConfig
+from saturn_run.task_source import iter_task_specs, windows
+from saturn_run.tasks import TaskSpec
+
+
+def write(tmpdir, name, text):
+    path = join(str(tmpdir), name)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def test_json_lines(tmpdir):
+    path = write(
+        tmpdir,
+        "tasks.jsonl",
+        '{"name": "a", "command": "echo a", "memory": "1GiB"}\n'
+        "\n"
+        '{"command": ["echo", "b"], "shell": false, "depends_on": "a"}\n',
+    )
+    task_config = TaskConfig.from_file(path)
+    # nothing is parsed until the tasks are read
+    assert not isinstance(task_config.tasks, list)
+    tasks = list(task_config.tasks)
+    assert tasks[0] == TaskSpec(name="a", command="echo a", memory=2**30)
+    assert tasks[1] == TaskSpec(name="1", command=["echo", "b"], shell=False, depends_on=["a"])
+
+
+def test_csv(tmpdir):
+    path = write(
+        tmpdir,
+        "tasks.csv",
+        "name,command,cpus,shell,depends_on,resources.GPU\n" "a,echo a,2,,,1\n" "b,echo b,,no,a,\n",
+    )
+    tasks = list(TaskConfig.from_file(path).tasks)
+    assert tasks[0] == TaskSpec(name="a", command="echo a", cpus=2.0, resources={"GPU": 1.0})
+    assert tasks[1] == TaskSpec(name="b", command="echo b", shell=False, depends_on=["a"])
+
+
+def test_yaml_documents(tmpdir):
+    path = write(tmpdir, "tasks.yaml", "command: echo a\n---\ncommand: echo b\n")
+    task_config = TaskConfig.from_file(path)
+    assert not isinstance(task_config.tasks, list)
+    assert [t.command for t in task_config.tasks] == ["echo a", "echo b"]
+
+    # a task yaml with a tasks list is read as before
+    path = write(tmpdir, "list.yaml", "batch_size: 2\ntasks:\n  - command: echo a\n")
+    task_config = TaskConfig.from_file(path)
+    assert task_config.batch_size == 2
+    assert task_config.tasks == [TaskSpec(name="0", command="echo a")]
+
+    with raises(ConfigError):
+        TaskConfig.from_file(write(tmpdir, "empty.yaml", ""))
+
+
+def test_stream_validation():
+    with raises(ConfigError, match="duplicate"):
+        list(iter_task_specs([dict(name="a", command="x"), dict(name="a", command="y")]))
+    # dependencies must come first
+    with raises(ConfigError, match="does not come before"):
+        list(iter_task_specs([dict(command="x", depends_on="b"), dict(name="b", command="y")]))
+    with raises(ConfigError, match="mapping"):
+        list(iter_task_specs(["echo a"]))
+
+
+def test_windows():
+    assert [len(w) for w in windows(iter(range(5)), 2)] == [2, 2, 1]
+    assert not list(windows([], 2))
@@ -0,0 +1,74 @@
+from os.path import join
+
+from pytest import raises
+from saturn_run.errors import ConfigError
+from saturn_run.run import TaskConfig
+from saturn_run.templates import TaskTemplate, substitute
+
+
+def test_cartesian_product():
+    template = TaskTemplate.from_yaml(
+        name="fib-{n}-{seed}",
+        command="julia fib.jl {n} --seed {seed} ${HOME}",
+        cpus="{n}",
+        params={"n": [1, 2], "seed": {"start": 0, "stop": 30, "step": 10}},
+    )
+    tasks = list(template)
+    assert len(tasks) == 6
+    assert tasks[0] == {"name": "fib-1-0", "command": "julia fib.jl 1 --seed 0 ${HOME}", "cpus": 1}
+    assert [t["name"] for t in tasks][-2:] == ["fib-2-10", "fib-2-20"]
+
+
+def test_zip_and_rows(tmpdir):
+    path = join(str(tmpdir), "rows.csv")
+    with open(path, "w") as f:
+        f.write("dataset\nmnist\ncifar\n")
+    template = TaskTemplate.from_yaml(
+        name="{dataset}-{lr}",
+        command=["python", "train.py", "{dataset}", "{lr}"],
+        depends_on=["prepare-{dataset}"],
+        params={"lr": [0.1, 0.01], "epochs": [5, 10]},
+        product="zip",
+        params_file=path,
+    )
+    assert [t["name"] for t in template] == ["mnist-0.1", "mnist-0.01", "cifar-0.1", "cifar-0.01"]
+    first = next(iter(template))
+    assert first["command"] == ["python", "train.py", "mnist", 0.1]
+    assert first["depends_on"] == ["prepare-mnist"]
+
+    with raises(ConfigError):
+        TaskTemplate.from_yaml(command="x", params={"a": [1], "b": [1, 2]}, product="zip")
+    with raises(ConfigError):
+        TaskTemplate.from_yaml(command="x", params={"a": [1]}, product="outer")
+
+
+def test_substitute():
+    assert substitute("awk '{print $1}' {f}", {"f": "a.txt"}) == "awk '{print $1}' a.txt"
+    assert substitute({"GPU": "{gpus}"}, {"gpus": 2}) == {"GPU": 2}
+    assert substitute(3, {"n": 1}) == 3
+
+
+def test_task_config_templates():
+    config = TaskConfig.from_yaml(
+        tasks=[
+            {"name": "prepare", "command": "echo prepare"},
+            {
+                "name": "score-{i}",
+                "command": "echo {i}",
+                "depends_on": ["prepare"],
+                "params": {"i": {"stop": 100000}},
+            },
+        ]
+    )
+    # expanded lazily
+    assert not isinstance(config.tasks, list)
+    tasks = iter(config.tasks)
+    assert next(tasks).name == "prepare"
+    assert next(tasks).name == "score-0"
+    assert sum(1 for _ in tasks) == 99999
+
+    config = TaskConfig.from_yaml(
+        tasks=[{"name": "a", "command": "echo {i}", "params": {"i": [1, 2]}}]
+    )
+    with raises(ConfigError):
+        list(config.tasks)
@@ -0,0 +1,80 @@
+import time
+from os.path import join
+
+import pytest
+from saturn_run import processes, tracing
+from saturn_run.results import LocalResults
+from saturn_run.tracing import (
+    JsonLinesExporter,
+    Span,
+    phase_breakdown,
+    read_spans,
+    span,
+)
+
+
+@pytest.fixture
+def trace_path(tmpdir):
+    path = join(str(tmpdir), "traces.jsonl")
+    tracing.configure(JsonLinesExporter(path))
+    yield path
+    tracing.configure(None)
+
+
+def test_span_nesting(trace_path):
+    with span("outer", trace_id="run-1", tasks=2):
+        with span("inner"):
+            pass
+        with pytest.raises(ValueError):
+            with span("failing"):
+                raise ValueError()
+    tracing.record_span("queue", time.time() - 5, time.time(), trace_id="run-1")
+    with span("other", trace_id="run-2"):
+        pass
+
+    spans = {s.name: s for s in read_spans([trace_path], trace_id="run-1")}
+    assert set(spans) == {"outer", "inner", "failing", "queue"}
+    assert spans["outer"].parent_id is None
+    assert spans["outer"].attributes == {"tasks": 2}
+    assert spans["inner"].parent_id == spans["outer"].span_id
+    assert spans["inner"].trace_id == "run-1"
+    assert spans["failing"].attributes == {"error": "ValueError"}
+    assert spans["queue"].duration >= 5
+
+
+def test_span_without_exporter():
+    tracing.configure(None)
+    with span("nothing") as s:
+        assert s is None
+
+
+def test_execute_spans(tmpdir, trace_path):
+    results = LocalResults(join(str(tmpdir), "results"), name="my-run")
+    processes.execute(
+        results, "my-task", "echo hello", shell=True, submitted=time.time(), poll_interval=1
+    )
+
+    spans = read_spans([trace_path], trace_id="my-run")
+    names = {s.name for s in spans}
+    assert {"task", "spawn", "run", "sync", "set_status", "finish", "queue"} <= names
+    task = next(s for s in spans if s.name == "task")
+    assert all(s.parent_id == task.span_id for s in spans if s.name in ("spawn", "finish"))
+
+
+def test_phase_breakdown():
+    spans = [Span("sync", "run", str(i), duration=float(i)) for i in range(1, 101)]
+    spans.append(Span("spawn", "run", "x", duration=0.5))
+    lines = phase_breakdown(spans).splitlines()
+    assert lines[0].split() == ["phase", "count", "total", "mean", "p50", "p95", "max"]
+    # slowest in total first
+    assert lines[1].split() == [
+        "sync",
+        "100",
+        "5050.000s",
+        "50.500s",
+        "50.000s",
+        "95.000s",
+        "100.000s",
+    ]
+    assert lines[2].split()[0] == "spawn"
+    assert phase_breakdown([]) == "no spans"